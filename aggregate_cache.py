@@ -0,0 +1,162 @@
+"""SQLite copy of the traffic store, so a restarted dashboard resumes from disk"""
+import json
+import os
+import sqlite3
+from contextlib import closing, contextmanager
+from datetime import datetime, timezone
+
+import numpy as np
+
+from timeseries import to_ns
+from traffic_processing import TrafficStore
+
+# Path of the SQLite file; unset keeps the aggregates in memory only
+STATE_FILE = os.environ.get('DASHBOARD_STATE_FILE')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS buckets (
+    tier INTEGER NOT NULL, bucket INTEGER NOT NULL, counts BLOB NOT NULL,
+    PRIMARY KEY (tier, bucket)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS events (kind TEXT NOT NULL, ts INTEGER NOT NULL, row TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS events_kind_ts ON events (kind, ts);
+"""
+
+EVENT_KINDS = ('security', 'system')
+
+
+def _from_ns(value):
+    return datetime.fromtimestamp(value // 1000 / 1e6, tz=timezone.utc)
+
+
+def layout(store):
+    """What persisted buckets depend on: the category columns and the tiers"""
+    return json.dumps({
+        'sources': list(store.classifier.source_categories),
+        'traffic_types': list(store.classifier.traffic_type_categories),
+        'tiers': [[tier.width, tier.capacity] for tier in store.series.tiers],
+    })
+
+
+class AggregateCache:
+    """Persists an IncrementalWindow's TrafficStore to a SQLite file
+
+    After every refresh only the buckets and events at or after the start
+    of the fetched ranges are rewritten, plus deletes of what expired, so
+    a save costs about as much as the refresh's new traffic. On startup
+    the window is restored from the file and its next refresh fetches only
+    the gap since the persisted watermark.
+
+    A file written with other categories or tiers is ignored and
+    overwritten on the next save.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+
+    @classmethod
+    def from_env(cls, suffix=None):
+        """Cache at DASHBOARD_STATE_FILE, or None when it is unset
+
+        A suffix is added to the file name before its extension, so each
+        site can keep its own file.
+        """
+        if not STATE_FILE:
+            return None
+        if suffix is None:
+            return cls(STATE_FILE)
+        root, extension = os.path.splitext(STATE_FILE)
+        return cls(f'{root}-{suffix}{extension}')
+
+    @contextmanager
+    def _connect(self):
+        """Connection running the block as one transaction, closed afterwards"""
+        with closing(sqlite3.connect(self.path, timeout=30)) as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            with db:
+                yield db
+
+    def restore(self, window):
+        """Load the persisted state into window; False if there was none to use"""
+        with self._connect() as db:
+            meta = dict(db.execute('SELECT key, value FROM meta'))
+            if 'watermark' not in meta:
+                return False
+            watermark = _from_ns(int(meta['watermark']))
+            store = TrafficStore(watermark - window.duration, watermark, window.classifier)
+            if meta.get('layout') != layout(store):
+                return False
+
+            for index, tier in enumerate(store.series.tiers):
+                rows = db.execute(
+                    'SELECT bucket, counts FROM buckets WHERE tier = ? AND bucket BETWEEN ? AND ?',
+                    (index, tier.oldest(), tier.head)
+                )
+                for bucket, counts in rows:
+                    slot = bucket % tier.capacity
+                    tier.data[slot] = tier.data[slot + tier.capacity] = np.frombuffer(counts, dtype=np.int64)
+
+            store.undated_sources[:] = json.loads(meta['undated_sources'])
+            store.undated_types[:] = json.loads(meta['undated_types'])
+            for kind in EVENT_KINDS:
+                events = getattr(store, f'{kind}_events')
+                for ts, row in db.execute('SELECT ts, row FROM events WHERE kind = ? ORDER BY ts', (kind,)):
+                    events.add(ts, json.loads(row))
+
+        window.aggregator = store
+        window.watermark = watermark
+        window.synced_at = _from_ns(int(meta['synced_at']))
+        window.covered_from = _from_ns(int(meta['covered_from']))
+        window.recent_ids = set(json.loads(meta['recent_ids']))
+        return True
+
+    def save(self, window, changed_from=None):
+        """Write the window's state, rewriting only what changed since changed_from
+
+        changed_from is the earliest time whose counts or events may have
+        changed; None rewrites everything.
+        """
+        store = window.aggregator
+        changed_ns = None if changed_from is None else to_ns(changed_from)
+        with self._connect() as db:
+            for index, tier in enumerate(store.series.tiers):
+                first = tier.oldest() if changed_ns is None else max(tier.oldest(), changed_ns // tier.width)
+                db.execute('DELETE FROM buckets WHERE tier = ? AND (bucket < ? OR bucket >= ?)',
+                           (index, tier.oldest(), first))
+                buckets = np.arange(first, tier.head + 1)
+                counts = tier.data[buckets % tier.capacity]
+                keep = counts.any(axis=1)
+                db.executemany(
+                    'INSERT INTO buckets (tier, bucket, counts) VALUES (?, ?, ?)',
+                    ((index, int(bucket), row.tobytes()) for bucket, row in zip(buckets[keep], counts[keep]))
+                )
+
+            for kind in EVENT_KINDS:
+                events = getattr(store, f'{kind}_events')
+                earliest = events.earliest()
+                if changed_ns is None or earliest is None:
+                    db.execute('DELETE FROM events WHERE kind = ?', (kind,))
+                else:
+                    # Drop what was evicted or expired, and everything the refresh may have changed
+                    db.execute('DELETE FROM events WHERE kind = ? AND (ts < ? OR ts >= ?)',
+                               (kind, earliest, changed_ns))
+                table = events.table(changed_ns)
+                db.executemany(
+                    'INSERT INTO events (kind, ts, row) VALUES (?, ?, ?)',
+                    ((kind, int(ts), json.dumps(dict(row), default=str)) for ts, row in zip(table.timestamps, table.rows))
+                )
+
+            meta = {
+                'layout': layout(store),
+                'watermark': to_ns(window.watermark),
+                'synced_at': to_ns(window.synced_at),
+                'covered_from': to_ns(window.covered_from),
+                'recent_ids': json.dumps(list(window.recent_ids)),
+                'undated_sources': json.dumps(store.undated_sources.tolist()),
+                'undated_types': json.dumps(store.undated_types.tolist()),
+            }
+            db.executemany('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+                           [(key, str(value)) for key, value in meta.items()])
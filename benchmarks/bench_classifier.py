@@ -0,0 +1,106 @@
+"""Compare the batch MessageClassifier against the original per-message loop
+
+Run from the repository root:
+
+    python benchmarks/bench_classifier.py --messages 1000000
+"""
+import argparse
+import os
+import sys
+import time
+from itertools import islice
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from classifier import MessageClassifier  # noqa: E402
+from synthetic import generate_messages  # noqa: E402
+
+
+def legacy_classify(messages, counts):
+    """The classification loop process_graylog_messages used to run per message"""
+    traffic_sources, traffic_types, security, system = counts
+    for msg in messages:
+        message = msg.get('message', {})
+        source = message.get('source', '')
+        if 'web' in source.lower() or 'http' in str(message).lower():
+            traffic_sources['Web Server'] += 1
+        elif 'router' in source.lower():
+            traffic_sources['Router'] += 1
+        elif 'email' in source.lower() or 'smtp' in str(message).lower():
+            traffic_sources['Email Server'] += 1
+        else:
+            traffic_sources['IoT Devices'] += 1
+
+        message_text = str(message).lower()
+        if 'http' in message_text or 'https' in message_text:
+            traffic_types['HTTP/HTTPS'] += 1
+        elif 'dns' in message_text:
+            traffic_types['DNS'] += 1
+        elif 'smtp' in message_text or 'email' in message_text:
+            traffic_types['SMTP'] += 1
+        elif 'ssh' in message_text:
+            traffic_types['SSH'] += 1
+        else:
+            traffic_types['Other'] += 1
+
+        if any(keyword in str(message).lower() for keyword in ['unauthorized', 'blocked', 'denied', 'failed']):
+            security.append(message.get('timestamp'))
+        if any(keyword in str(message).lower() for keyword in ['service', 'restart', 'error', 'warning']):
+            system.append(str(message)[:100] + '...' if len(str(message)) > 100 else str(message))
+            del system[:-10]
+
+
+def batch_classify(classifier, messages, counts):
+    """The same aggregation driven by one MessageClassifier call per batch"""
+    traffic_sources, traffic_types, security, system = counts
+    batch = classifier.classify(messages)
+    source_counts = np.bincount(batch.sources, minlength=len(classifier.source_categories))
+    for category, count in zip(classifier.source_categories, source_counts):
+        traffic_sources[category] += int(count)
+    type_counts = np.bincount(batch.traffic_types, minlength=len(classifier.traffic_type_categories))
+    for category, count in zip(classifier.traffic_type_categories, type_counts):
+        traffic_types[category] += int(count)
+    security.extend(batch.fields[i].get('timestamp') for i in np.flatnonzero(batch.is_security))
+    for i in np.flatnonzero(batch.is_system)[-10:]:
+        text = str(batch.fields[i])
+        system.append(text[:100] + '...' if len(text) > 100 else text)
+    del system[:-10]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=1000000)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    classifier = MessageClassifier()
+    legacy_counts = ({k: 0 for k in classifier.source_categories}, {k: 0 for k in classifier.traffic_type_categories}, [], [])
+    batch_counts = ({k: 0 for k in classifier.source_categories}, {k: 0 for k in classifier.traffic_type_categories}, [], [])
+    legacy_seconds = batch_seconds = 0.0
+
+    messages = generate_messages(args.messages, seed=args.seed)
+    while True:
+        page = list(islice(messages, args.batch_size))
+        if not page:
+            break
+        started = time.perf_counter()
+        legacy_classify(page, legacy_counts)
+        legacy_seconds += time.perf_counter() - started
+        started = time.perf_counter()
+        batch_classify(classifier, page, batch_counts)
+        batch_seconds += time.perf_counter() - started
+
+    if legacy_counts != batch_counts:
+        sys.exit("Batch classifier disagrees with the per-message loop")
+
+    print(f"messages:          {args.messages:,}")
+    print(f"per-message loop:  {legacy_seconds:8.2f} s  {args.messages / legacy_seconds:>12,.0f} msg/s")
+    print(f"batch classifier:  {batch_seconds:8.2f} s  {args.messages / batch_seconds:>12,.0f} msg/s")
+    print(f"speedup:           {legacy_seconds / batch_seconds:8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""Measure how aggregating a long window scales with the process pool's workers
+
+Run from the repository root, entirely offline:
+
+    python benchmarks/bench_parallel.py --messages 2000000 --workers 1 2 4 8 16
+
+Every worker fetches its slices from a synthetic search instead of
+Graylog, so only counts cross process boundaries and fetching costs
+little; the results are checked against aggregating in process. Each
+worker count gets one untimed run first, to spawn its processes and
+import the dashboard's modules there.
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from process_pool import ProcessPool, aggregate_parallel  # noqa: E402
+from synthetic import SyntheticSearch  # noqa: E402
+from traffic_processing import aggregate_graylog_messages  # noqa: E402
+
+END_TIME = datetime(2024, 1, 8, tzinfo=timezone.utc)
+START_TIME = END_TIME - timedelta(days=7)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=1000000)
+    parser.add_argument('--workers', type=int, nargs='+',
+                        default=sorted({1, 2, 4, 8, 16, os.cpu_count() or 1}))
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    search = SyntheticSearch(args.messages / (END_TIME - START_TIME).total_seconds(), args.seed)
+    started = time.perf_counter()
+    expected = aggregate_graylog_messages(search(START_TIME, END_TIME), START_TIME, END_TIME)
+    serial_seconds = time.perf_counter() - started
+    messages = int(expected.total.sum())
+
+    print(f"messages:    {messages:,} on {os.cpu_count()} cores")
+    print(f"in process:  {serial_seconds:8.2f} s  {messages / serial_seconds:>12,.0f} msg/s")
+    for workers in args.workers:
+        pool = ProcessPool(workers)
+        try:
+            aggregate_parallel(pool, search, START_TIME, END_TIME)
+            started = time.perf_counter()
+            partial = aggregate_parallel(pool, search, START_TIME, END_TIME)
+            seconds = time.perf_counter() - started
+        finally:
+            pool.close()
+        if (partial.total != expected.total).any() or partial.sources != expected.sources:
+            sys.exit(f"{workers} workers disagree with aggregating in process")
+        print(f"{workers:3d} workers: {seconds:8.2f} s  {messages / seconds:>12,.0f} msg/s"
+              f"  {serial_seconds / seconds:5.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,237 @@
+"""Time message processing, GELF decoding, bucketing and figure building on synthetic traffic
+
+Run from the repository root, entirely offline:
+
+    python benchmarks/bench_pipeline.py --output benchmarks/baselines/pipeline.json
+    python benchmarks/bench_pipeline.py --baseline benchmarks/baselines/pipeline.json
+
+Each stage runs once timed and once under tracemalloc for its peak memory.
+With --baseline, stages whose throughput dropped or whose peak memory grew
+by more than --tolerance are reported and the exit status is 1.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+import plotly
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from charts import create_traffic_over_time_chart, create_traffic_source_chart, create_traffic_type_chart  # noqa: E402
+from gelf_listener import GelfListener  # noqa: E402
+from synthetic import gelf_datagrams, generate_messages  # noqa: E402
+from timeseries import TimeHistogram, parse_timestamps  # noqa: E402
+from traffic_processing import BATCH_SIZE, process_graylog_messages  # noqa: E402
+
+END_TIME = datetime(2024, 1, 8, tzinfo=timezone.utc)
+START_TIME = END_TIME - timedelta(days=7)
+
+# Finest resolution the dashboard keeps, used to give the charts a long series
+FINE_BUCKET_WIDTH = timedelta(minutes=1)
+
+
+class TimedIterator:
+    """Iterator that accumulates the time spent producing its items"""
+
+    def __init__(self, iterable):
+        self.iterator = iter(iterable)
+        self.seconds = 0.0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            return next(self.iterator)
+        finally:
+            self.seconds += time.perf_counter() - started
+
+
+def setup_process(size, seed):
+    """Messages are generated lazily while the stage runs"""
+    return size, seed
+
+
+def run_process(inputs):
+    """process_graylog_messages over lazily generated messages, less generation time"""
+    size, seed = inputs
+    messages = TimedIterator(generate_messages(size, seed, START_TIME, END_TIME))
+    started = time.perf_counter()
+    process_graylog_messages(messages, START_TIME, END_TIME)
+    return time.perf_counter() - started - messages.seconds, {}
+
+
+def setup_gelf(size, seed):
+    """Datagrams of the last hour's messages, a third of them chunked, and an unstarted listener"""
+    end_time = datetime.now(timezone.utc)
+    messages = generate_messages(size, seed, end_time - timedelta(hours=1), end_time)
+    # Chunks smaller than a plain payload, so every uncompressed message is chunked
+    datagrams = list(gelf_datagrams(messages, seed, chunk_size=400))
+    listener = GelfListener('127.0.0.1', 0, timedelta(days=7))
+    return listener, [datagrams[i:i + BATCH_SIZE] for i in range(0, len(datagrams), BATCH_SIZE)]
+
+
+def run_gelf(inputs):
+    """Reassemble, decompress, decode and aggregate GELF datagrams as the listener thread does"""
+    listener, batches = inputs
+    started = time.perf_counter()
+    try:
+        for batch in batches:
+            listener.handle(batch)
+        seconds = time.perf_counter() - started
+    finally:
+        listener.stop()
+    return seconds, {'datagrams': sum(map(len, batches)), 'invalid': listener.invalid}
+
+
+def setup_bucketing(size, seed):
+    """Pages of evenly spaced Graylog timestamp strings with a blocked mask"""
+    step = (END_TIME - START_TIME) / size
+    starts = np.datetime64(START_TIME.replace(tzinfo=None), 'ms') + np.arange(size) * np.timedelta64(step, 'ms')
+    timestamps = np.char.add(np.datetime_as_string(starts, unit='ms'), 'Z')
+    blocked = np.random.default_rng(seed).random(size) < 0.15
+    return [
+        (timestamps[i:i + BATCH_SIZE].tolist(), blocked[i:i + BATCH_SIZE])
+        for i in range(0, size, BATCH_SIZE)
+    ]
+
+
+def run_bucketing(pages):
+    """Parse timestamp strings and count them into one-minute buckets"""
+    started = time.perf_counter()
+    histogram = TimeHistogram(START_TIME, END_TIME, FINE_BUCKET_WIDTH)
+    for timestamps, blocked in pages:
+        histogram.add(parse_timestamps(timestamps), blocked)
+    return time.perf_counter() - started, {}
+
+
+def setup_figures(size, seed):
+    """One-minute series of size messages, and category counts for the other charts"""
+    histogram = TimeHistogram(START_TIME, END_TIME, FINE_BUCKET_WIDTH)
+    for timestamps, blocked in setup_bucketing(size, seed):
+        histogram.add(parse_timestamps(timestamps), blocked)
+    # Category charts have one bar or slice per category whatever the message count
+    result = process_graylog_messages(generate_messages(10000, seed, START_TIME, END_TIME), START_TIME, END_TIME)
+    return histogram.series(), result['traffic_sources'], result['traffic_types']
+
+
+def run_figures(inputs):
+    """Build the three charts from one-minute series and serialize them as sent to the browser"""
+    (times, total, allowed, blocked), traffic_sources, traffic_types = inputs
+    started = time.perf_counter()
+    figures = [
+        create_traffic_source_chart(traffic_sources),
+        create_traffic_over_time_chart(times, total, blocked, allowed),
+        create_traffic_type_chart(traffic_types),
+    ]
+    payload_bytes = sum(len(figure.to_json()) for figure in figures)
+    return time.perf_counter() - started, {'payload_bytes': payload_bytes}
+
+
+STAGES = {
+    'process': (setup_process, run_process),
+    'gelf': (setup_gelf, run_gelf),
+    'bucketing': (setup_bucketing, run_bucketing),
+    'figures': (setup_figures, run_figures),
+}
+
+
+def measure(stage, size, seed, memory=True):
+    """Result row for one stage at one message count"""
+    setup, run = STAGES[stage]
+    # A small untimed run first, so lazy imports and first-call setup aren't measured
+    run(setup(BATCH_SIZE, seed))
+    seconds, extra = run(setup(size, seed))
+    row = {
+        'stage': stage,
+        'messages': size,
+        'seconds': round(seconds, 4),
+        'throughput': round(size / seconds, 1) if seconds > 0 else None,
+        'peak_bytes': None,
+        **extra,
+    }
+    if memory:
+        inputs = setup(size, seed)
+        tracemalloc.start()
+        try:
+            run(inputs)
+            row['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return row
+
+
+def environment():
+    """Versions and machine the results were measured with"""
+    return {
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.machine(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'plotly': plotly.__version__,
+    }
+
+
+def regressions(results, baseline, tolerance):
+    """Descriptions of rows slower or hungrier than the matching baseline rows"""
+    previous = {(row['stage'], row['messages']): row for row in baseline['results']}
+    found = []
+    for row in results:
+        old = previous.get((row['stage'], row['messages']))
+        if old is None:
+            continue
+        if old.get('throughput') and row['throughput'] and row['throughput'] < old['throughput'] * (1 - tolerance):
+            found.append(f"{row['stage']} @ {row['messages']:,}: throughput {old['throughput']:,.0f} -> {row['throughput']:,.0f} msg/s")
+        if old.get('peak_bytes') and row['peak_bytes'] and row['peak_bytes'] > old['peak_bytes'] * (1 + tolerance):
+            found.append(f"{row['stage']} @ {row['messages']:,}: peak memory {old['peak_bytes'] / 2**20:,.1f} -> {row['peak_bytes'] / 2**20:,.1f} MiB")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--stages', nargs='+', choices=list(STAGES), default=list(STAGES))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-memory', action='store_true', help="skip the tracemalloc pass")
+    parser.add_argument('--output', help="write the results as JSON to this path")
+    parser.add_argument('--baseline', help="JSON results of an earlier run to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'stage':<10} {'messages':>10} {'seconds':>9} {'msg/s':>12} {'peak MiB':>9}")
+    for size in args.sizes:
+        for stage in args.stages:
+            row = measure(stage, size, args.seed, memory=not args.no_memory)
+            results.append(row)
+            peak = f"{row['peak_bytes'] / 2**20:9.1f}" if row['peak_bytes'] is not None else f"{'-':>9}"
+            print(f"{stage:<10} {size:>10,} {row['seconds']:9.3f} {row['throughput'] or 0:12,.0f} {peak}")
+
+    report = dict(environment(), seed=args.seed, results=results)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+            f.write('\n')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(results, json.load(f), args.tolerance)
+        for line in found:
+            print(f"REGRESSION {line}")
+        if found:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,309 @@
+"""Local stand-in for the Graylog REST endpoints the dashboard calls
+
+Serves synthetic messages from benchmarks/synthetic.py with configurable
+latency, error rate and volume. Run it on its own and point the dashboard
+at it:
+
+    python benchmarks/fake_graylog.py --port 9000 --messages 200000 --latency 0.05
+    GRAYLOG_URL=http://127.0.0.1:9000 streamlit run enhanced_network_dashboard.py
+
+Queries are matched approximately: OR, AND, NOT and parentheses combine
+as in Lucene, and each term (a word, a quoted phrase, field:value or
+field:[low TO high]) matches by substring, with '*' matching everything.
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+from synthetic import generate_messages
+
+# Deepest offset + limit Elasticsearch allows before the search fails
+MAX_RESULT_WINDOW = 10000
+
+HISTOGRAM_INTERVALS = {'minute': 60, 'hour': 3600, 'day': 86400, 'week': 604800}
+
+INPUTS = [
+    {'id': '5f3e1a2b9c8d7e6f5a4b3c2d', 'title': 'pfSense Syslog UDP', 'type': 'org.graylog2.inputs.syslog.udp.SyslogUDPInput'},
+    {'id': '5f3e1a2b9c8d7e6f5a4b3c2e', 'title': 'GELF UDP', 'type': 'org.graylog2.inputs.gelf.udp.GELFUDPInput'},
+]
+
+FIELD_GROUP = re.compile(r'(\w+):\(')
+TERM = re.compile(r'(?:(\w+):)?(?:\[(\d+) TO (\d+)\]|"((?:[^"\\]|\\.)*)"|([^\s()"]+))')
+
+
+def parse_query(query):
+    """Boolean tree of a query: ('or' | 'and', children), ('not', child) or a term (field, value or (low, high))"""
+    query = query.strip()
+    for operator in ('OR', 'AND'):
+        parts = _split(query, f' {operator} ')
+        if len(parts) > 1:
+            return operator.lower(), [parse_query(part) for part in parts]
+    if query.startswith('NOT '):
+        return 'not', parse_query(query[4:])
+    if query.startswith('(') and _closing(query, 0) == len(query) - 1:
+        return parse_query(query[1:-1])
+    grouped = FIELD_GROUP.match(query)
+    if grouped and _closing(query, grouped.end() - 1) == len(query) - 1:
+        return _with_field(parse_query(query[grouped.end():-1]), grouped.group(1))
+    terms = _terms(query)
+    return terms[0] if len(terms) == 1 else ('or', terms)
+
+
+def _split(query, operator):
+    """Parts of query between operators outside parentheses and quotes"""
+    parts, depth, start, quoted, i = [], 0, 0, False, 0
+    while i < len(query):
+        char = query[i]
+        if char == '\\':
+            i += 1
+        elif char == '"':
+            quoted = not quoted
+        elif not quoted and char in '()':
+            depth += 1 if char == '(' else -1
+        elif not quoted and not depth and query.startswith(operator, i):
+            parts.append(query[start:i])
+            start = i = i + len(operator)
+            continue
+        i += 1
+    return parts + [query[start:]]
+
+
+def _closing(query, opening):
+    """Index of the parenthesis closing the one at opening, or -1"""
+    depth, quoted, i = 0, False, opening
+    while i < len(query):
+        char = query[i]
+        if char == '\\':
+            i += 1
+        elif char == '"':
+            quoted = not quoted
+        elif not quoted and char in '()':
+            depth += 1 if char == '(' else -1
+            if not depth:
+                return i
+        i += 1
+    return -1
+
+
+def _with_field(node, field):
+    """node with field applied to its terms that name none, as in field:(a OR b)"""
+    operator, operand = node
+    if operator in ('or', 'and'):
+        return operator, [_with_field(child, field) for child in operand]
+    if operator == 'not':
+        return operator, _with_field(operand, field)
+    return (operator or field), operand
+
+
+def _terms(query):
+    terms = []
+    for field, low, high, phrase, word in TERM.findall(query):
+        if word in ('OR', 'AND', 'NOT'):
+            continue
+        if low:
+            terms.append((field, (int(low), int(high))))
+        else:
+            value = phrase.replace('\\"', '"').replace('\\\\', '\\') if phrase else word
+            terms.append((field, value.lower()))
+    return terms
+
+
+def _matches(message, text, node):
+    operator, operand = node
+    if operator == 'or':
+        return any(_matches(message, text, child) for child in operand)
+    if operator == 'and':
+        return all(_matches(message, text, child) for child in operand)
+    if operator == 'not':
+        return not _matches(message, text, operand)
+    return _term_matches(message, text, operator, operand)
+
+
+def _term_matches(message, text, field, value):
+    if isinstance(value, tuple):
+        try:
+            return value[0] <= int(message.get(field)) <= value[1]
+        except (TypeError, ValueError):
+            return False
+    if value == '*':
+        return True
+    if field:
+        return value in str(message.get(field, '')).lower()
+    return value in text
+
+
+class FakeGraylog:
+    """Threaded HTTP server holding a fixed set of messages ending now
+
+    latency seconds (plus up to jitter more) are slept before every
+    response, and a fraction error_rate of requests fail with a 500.
+    Request counts per API path are kept in requests and errors.
+    """
+
+    def __init__(self, messages=100000, days=7, latency=0.0, jitter=0.0, error_rate=0.0,
+                 seed=0, host='127.0.0.1', port=0):
+        end_time = datetime.now(timezone.utc)
+        self.messages = list(generate_messages(messages, seed, end_time - timedelta(days=days), end_time))
+        self.timestamps = np.array(
+            [m['message']['timestamp'][:-1] for m in self.messages], dtype='datetime64[ms]'
+        )
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.requests = Counter()
+        self.errors = Counter()
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+        self._matches = {}
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Serve from a daemon thread; returns self"""
+        self._thread = threading.Thread(target=self.server.serve_forever, name='fake-graylog', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving and close the listening socket"""
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset_counts(self):
+        """Zero the request and error counters"""
+        with self._lock:
+            self.requests.clear()
+            self.errors.clear()
+
+    def _select(self, query, range_from, range_to):
+        """Indices of the messages matching a query in a time range, oldest first"""
+        lo = np.searchsorted(self.timestamps, np.datetime64(range_from.rstrip('Z'), 'ms'), side='left')
+        hi = np.searchsorted(self.timestamps, np.datetime64(range_to.rstrip('Z'), 'ms'), side='right')
+        if query.strip() in ('', '*'):
+            return np.arange(lo, hi)
+        with self._lock:
+            matches = self._matches.get(query)
+        if matches is None:
+            tree = parse_query(query)
+            texts = (str(m['message']).lower() for m in self.messages)
+            matches = np.fromiter((
+                _matches(m['message'], text, tree) for m, text in zip(self.messages, texts)
+            ), dtype=bool, count=len(self.messages))
+            with self._lock:
+                self._matches[query] = matches
+        return lo + np.flatnonzero(matches[lo:hi])
+
+    def respond(self, path, params):
+        """(status, body) for one API request"""
+        if path == '/api/system/inputs':
+            return 200, {'inputs': INPUTS, 'total': len(INPUTS)}
+        if not path.startswith('/api/search/universal/absolute'):
+            return 404, {'type': 'ApiError', 'message': f"{path} not found"}
+        try:
+            selected = self._select(params.get('query', '*'), params['from'], params['to'])
+        except (KeyError, ValueError) as e:
+            return 400, {'type': 'ApiError', 'message': f"Invalid search: {e}"}
+
+        if path == '/api/search/universal/absolute':
+            offset = int(params.get('offset', 0))
+            limit = int(params.get('limit', 150))
+            if offset + limit > MAX_RESULT_WINDOW:
+                return 500, {'type': 'ApiError', 'message': 'Result window is too large'}
+            if params.get('sort', '').endswith(':desc'):
+                selected = selected[::-1]
+            page = [self.messages[i] for i in selected[offset:offset + limit]]
+            return 200, {'messages': page, 'total_results': len(selected)}
+
+        if path == '/api/search/universal/absolute/histogram':
+            step = HISTOGRAM_INTERVALS.get(params.get('interval', 'hour'), 3600)
+            epochs = self.timestamps[selected].astype('datetime64[s]').astype(np.int64) // step * step
+            buckets, counts = np.unique(epochs, return_counts=True)
+            return 200, {'interval': params.get('interval', 'hour'),
+                         'results': {str(b): int(c) for b, c in zip(buckets, counts)}}
+
+        if path == '/api/search/universal/absolute/terms':
+            field = params.get('field', '')
+            values = Counter(self.messages[i]['message'].get(field) for i in selected)
+            missing = values.pop(None, 0)
+            top = values.most_common(int(params.get('size', 50)))
+            return 200, {'terms': dict(top), 'missing': missing, 'total': len(selected),
+                         'other': sum(values.values()) - sum(count for _, count in top)}
+
+        return 404, {'type': 'ApiError', 'message': f"{path} not found"}
+
+    def _handler(self):
+        """Request handler class bound to this server"""
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                params = {key: values[0] for key, values in parse_qs(url.query).items()}
+                with fake._lock:
+                    fake.requests[url.path] += 1
+                    delay = fake.latency + fake._random.random() * fake.jitter
+                    failed = fake._random.random() < fake.error_rate
+                time.sleep(delay)
+                if failed:
+                    status, body = 500, {'type': 'ApiError', 'message': 'Injected failure'}
+                else:
+                    status, body = fake.respond(url.path, params)
+                if status != 200:
+                    with fake._lock:
+                        fake.errors[url.path] += 1
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--messages', type=int, default=100000)
+    parser.add_argument('--days', type=float, default=7)
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument('--jitter', type=float, default=0.0, help="up to this many more seconds, uniformly")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of requests failing with a 500")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    fake = FakeGraylog(args.messages, args.days, args.latency, args.jitter, args.error_rate,
+                       args.seed, args.host, args.port)
+    print(f"Serving {len(fake.messages):,} messages at {fake.url}")
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fake.server.server_close()
+        print(dict(fake.requests))
+
+
+if __name__ == '__main__':
+    main()
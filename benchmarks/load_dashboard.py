@@ -0,0 +1,171 @@
+"""Drive concurrent simulated dashboard sessions against a local fake Graylog
+
+Run from the repository root:
+
+    python benchmarks/load_dashboard.py --sessions 1 5 10 20 --interactions 5 --latency 0.05
+
+For each number of concurrent sessions, every session loads the dashboard
+through Streamlit's AppTest and then switches time periods or reruns it,
+as a viewer would. All sessions share one process, so they share the
+dashboard's cached client, result cache and figure cache as viewers of one
+`streamlit run` instance do. The caches are cleared between levels.
+Reported per level: rerun latency percentiles, reruns per second, script
+exceptions, and the requests the fake Graylog served by API path.
+"""
+import argparse
+import contextlib
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from fake_graylog import FakeGraylog  # noqa: E402
+from timeseries import PERIODS  # noqa: E402
+
+DASHBOARD = os.path.join(REPO_ROOT, 'enhanced_network_dashboard.py')
+
+PERCENTILES = (50, 90, 99)
+
+
+@contextlib.contextmanager
+def shared_runtime():
+    """Pin one mock Streamlit runtime for every concurrent AppTest run
+
+    AppTest installs a mock runtime singleton at the start of each run and
+    clears it at the end, so concurrent runs would tear it down under each
+    other. While this is active every run sees the same mock, as every
+    session of a real server sees the same runtime.
+    """
+    from unittest.mock import MagicMock
+
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    saved = Runtime.__dict__['instance'], Runtime.__dict__['exists']
+    Runtime.instance = classmethod(lambda cls: runtime)
+    Runtime.exists = classmethod(lambda cls: True)
+    try:
+        yield runtime
+    finally:
+        Runtime.instance, Runtime.exists = saved
+
+
+def run_session(interactions, think, seed, timeout, latencies, failures):
+    """One viewer: load the page, then change period or rerun interactions times"""
+    from streamlit.testing.v1 import AppTest
+
+    rng = random.Random(seed)
+    app = AppTest.from_file(DASHBOARD, default_timeout=timeout)
+    for step in range(interactions + 1):
+        try:
+            if step and rng.random() < 0.5:
+                app.selectbox(key='time_period').set_value(rng.choice(list(PERIODS)))
+            started = time.perf_counter()
+            app.run()
+        except Exception as e:  # a timed-out run is a failure of this rerun, not of the harness
+            failures.append(repr(e))
+            # The page may have lost its widgets; the viewer reloads it
+            app = AppTest.from_file(DASHBOARD, default_timeout=timeout)
+            continue
+        latencies.append(time.perf_counter() - started)
+        if app.exception:
+            failures.extend(element.value for element in app.exception)
+            app = AppTest.from_file(DASHBOARD, default_timeout=timeout)
+        if think:
+            time.sleep(rng.uniform(0, 2 * think))
+
+
+def run_level(fake, sessions, interactions, think, timeout, seed):
+    """Result row for one level of concurrent sessions"""
+    import streamlit as st
+
+    st.cache_resource.clear()
+    st.cache_data.clear()
+    fake.reset_counts()
+    latencies = []
+    failures = []
+    threads = [
+        threading.Thread(
+            target=run_session,
+            args=(interactions, think, seed + i, timeout, latencies, failures),
+            name=f'session-{i}'
+        )
+        for i in range(sessions)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    row = {
+        'sessions': sessions,
+        'reruns': len(latencies),
+        'seconds': round(elapsed, 3),
+        'reruns_per_second': round(len(latencies) / elapsed, 2),
+        'failures': len(failures),
+        'upstream_requests': dict(fake.requests),
+        'upstream_errors': dict(fake.errors),
+    }
+    if latencies:
+        values = np.percentile(latencies, PERCENTILES)
+        row.update({f'p{p}': round(float(v), 4) for p, v in zip(PERCENTILES, values)})
+        row['max'] = round(max(latencies), 4)
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sessions', type=int, nargs='+', default=[1, 5, 10, 20])
+    parser.add_argument('--interactions', type=int, default=5, help="reruns per session after the first load")
+    parser.add_argument('--think', type=float, default=0.0, help="mean seconds between a session's reruns")
+    parser.add_argument('--messages', type=int, default=50000)
+    parser.add_argument('--days', type=float, default=7)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--timeout', type=float, default=120, help="seconds before one rerun counts as failed")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="write the results as JSON to this path")
+    args = parser.parse_args()
+
+    fake = FakeGraylog(args.messages, args.days, args.latency, args.jitter, args.error_rate, args.seed).start()
+    os.environ['GRAYLOG_URL'] = fake.url
+    print(f"Fake Graylog with {len(fake.messages):,} messages at {fake.url}")
+
+    results = []
+    print(f"{'sessions':>8} {'reruns':>7} {'p50 s':>7} {'p90 s':>7} {'p99 s':>7} {'max s':>7} {'reruns/s':>9} {'failed':>7} {'upstream':>9}")
+    try:
+        with shared_runtime():
+            for sessions in args.sessions:
+                row = run_level(fake, sessions, args.interactions, args.think, args.timeout, args.seed)
+                results.append(row)
+                print(
+                    f"{sessions:>8} {row['reruns']:>7} {row.get('p50', 0):7.3f} {row.get('p90', 0):7.3f} "
+                    f"{row.get('p99', 0):7.3f} {row.get('max', 0):7.3f} {row['reruns_per_second']:9.2f} "
+                    f"{row['failures']:>7} {sum(row['upstream_requests'].values()):>9}"
+                )
+    finally:
+        fake.stop()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'arguments': vars(args), 'results': results}, f, indent=2)
+            f.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+"""Seeded generator of Graylog search results that look like pfSense traffic, of their GELF datagrams and of searches over them"""
+import gzip
+import json
+import random
+import struct
+import zlib
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+SOURCES = ['pfsense', 'web01', 'web02', 'router', 'mailhost', 'email-relay', 'cam-lobby', 'nas01']
+
+# Message templates, their relative weights, and the fields Graylog's pfSense
+# extractors would pull out of them
+FILTERLOG = {'src_ip': '{src}', 'dst_ip': '{dst}'}
+TEMPLATES = [
+    ('filterlog[{pid}]: 5,,,1000000103,igb0,match,pass,out,4,0x0,,64,0,0,DF,6,tcp,60,{src},{dst},{sport},443,0,S', 30,
+     dict(FILTERLOG, action='pass', protocol='tcp', dst_port='443')),
+    ('filterlog[{pid}]: 5,,,1000000103,igb0,match,pass,out,4,0x0,,64,0,0,none,17,udp,72,{src},{dst},{sport},53,52', 10,
+     dict(FILTERLOG, action='pass', protocol='udp', dst_port='53')),
+    ('filterlog[{pid}]: 5,,,1000000103,igb0,match,block,in,4,0x0,,64,0,0,DF,6,tcp,60,{src},{dst},{sport},22,0,S blocked', 12,
+     dict(FILTERLOG, action='block', protocol='tcp', dst_port='22')),
+    ('filterlog[{pid}]: 5,,,1000000103,igb0,match,block,in,4,0x0,,64,0,0,none,1,icmp,84,{src},{dst},request', 3,
+     dict(FILTERLOG, action='block', protocol='icmp', dst_port='')),
+    ('unbound[{pid}]: info: {src} dns query example.org. A IN', 15, {}),
+    ('nginx: {src} - - "GET /index.html HTTP/1.1" 200 {size}', 15, {}),
+    ('nginx: {src} - - "GET /admin HTTP/1.1" 403 {size} access denied', 2, {}),
+    ('postfix/smtp[{pid}]: connect to mx.example.org[{dst}]:25', 8, {}),
+    ('sshd[{pid}]: Failed password for root from {src} port {sport} ssh2', 6, {}),
+    ('sshd[{pid}]: Accepted publickey for admin from {src} port {sport} ssh2', 3, {}),
+    ('php-fpm[{pid}]: service restart requested', 2, {}),
+    ('kernel: arp: {src} moved from aa:bb:cc:dd:ee:01 to aa:bb:cc:dd:ee:02', 5, {}),
+    ('dhcpd: DHCPACK on {src} to aa:bb:cc:dd:ee:{octet:02x} via igb1', 4, {}),
+]
+
+def _address(rng):
+    return f"10.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(1, 255)}"
+
+
+def generate_messages(count, seed=0, start_time=None, end_time=None):
+    """Yield count Graylog search results spread evenly over a time window, oldest first"""
+    rng = random.Random(seed)
+    end_time = end_time or datetime(2024, 1, 8, tzinfo=timezone.utc)
+    start_time = start_time or end_time - timedelta(days=7)
+    step = (end_time - start_time) / max(count, 1)
+    weights = [weight for _, weight, _ in TEMPLATES]
+
+    for i in range(count):
+        timestamp = start_time + step * i
+        text, _, fields = rng.choices(TEMPLATES, weights)[0]
+        values = dict(
+            pid=rng.randrange(100, 65000),
+            src=_address(rng),
+            dst=_address(rng),
+            sport=rng.randrange(1024, 65535),
+            size=rng.randrange(200, 90000),
+            octet=rng.randrange(256),
+        )
+        message = {
+            '_id': f"{seed:04x}{i:012x}",
+            'timestamp': timestamp.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z",
+            'source': rng.choice(SOURCES),
+            'message': text.format(**values),
+            'facility': 'local0',
+            'level': 6,
+            'gl2_source_input': '5f3e1a2b9c8d7e6f5a4b3c2d',
+            'streams': ['000000000000000000000001'],
+        }
+        message.update((field, value.format(**values)) for field, value in fields.items())
+        yield {'message': message, 'index': 'graylog_0'}
+
+
+# Fields of a search result that are Graylog's own rather than the sender's
+GRAYLOG_FIELDS = ('_id', 'source', 'message', 'timestamp', 'level', 'gl2_source_input', 'streams')
+
+# Payload bytes per chunk; GELF senders use about 1420 on the WAN, 8154 on a LAN
+GELF_CHUNK_SIZE = 1420
+
+
+def gelf_record(message):
+    """GELF 1.1 record a sender would have sent for a search result"""
+    fields = message['message']
+    timestamp = datetime.fromisoformat(fields['timestamp'].rstrip('Z')).replace(tzinfo=timezone.utc)
+    record = {
+        'version': '1.1',
+        'host': fields['source'],
+        'short_message': fields['message'],
+        'timestamp': round(timestamp.timestamp(), 3),
+        'level': fields.get('level', 6),
+    }
+    record.update((f'_{key}', value) for key, value in fields.items() if key not in GRAYLOG_FIELDS)
+    return record
+
+
+def gelf_datagrams(messages, seed=0, chunk_size=GELF_CHUNK_SIZE):
+    """Yield GELF UDP datagrams for search results
+
+    A third of the payloads are left plain, a third zlib and a third gzip
+    compressed; payloads longer than chunk_size are split into chunks.
+    """
+    rng = random.Random(seed)
+    for i, message in enumerate(messages):
+        payload = json.dumps(gelf_record(message)).encode()
+        encoding = rng.randrange(3)
+        if encoding == 1:
+            payload = zlib.compress(payload)
+        elif encoding == 2:
+            payload = gzip.compress(payload)
+        if len(payload) <= chunk_size:
+            yield payload
+            continue
+        message_id = struct.pack('>Q', (seed << 40) + i)
+        chunks = [payload[start:start + chunk_size] for start in range(0, len(payload), chunk_size)]
+        for sequence, chunk in enumerate(chunks):
+            yield b'\x1e\x0f' + message_id + bytes([sequence, len(chunks)]) + chunk
+
+
+# Messages SyntheticSearch cycles through, per seed, generated once per process
+SEARCH_TEMPLATES = 10000
+_templates = {}
+
+
+class SyntheticSearch:
+    """Picklable fetch_messages(start_time, end_time) over synthetic traffic at a fixed rate
+
+    Messages fall on a grid of whole milliseconds, so any split of a range
+    into time slices yields the same messages as the whole range. They
+    cycle through a fixed set of generated messages with new timestamps,
+    so fetching costs little next to aggregating.
+    """
+
+    def __init__(self, rate, seed=0):
+        self.step = max(1, round(1000 / rate))
+        self.seed = seed
+
+    def __call__(self, start_time, end_time):
+        templates = _templates.get(self.seed)
+        if templates is None:
+            templates = _templates[self.seed] = [
+                message['message'] for message in generate_messages(SEARCH_TEMPLATES, self.seed)
+            ]
+        first = -(-int(start_time.timestamp() * 1000) // self.step)
+        last = int(end_time.timestamp() * 1000) // self.step
+        milliseconds = np.arange(first, last + 1, dtype=np.int64) * self.step
+        timestamps = np.char.add(np.datetime_as_string(milliseconds.astype('datetime64[ms]'), unit='ms'), 'Z')
+        for k, timestamp in zip(range(first, last + 1), timestamps.tolist()):
+            yield {'message': dict(templates[k % SEARCH_TEMPLATES], timestamp=timestamp), 'index': 'graylog_0'}
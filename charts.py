@@ -0,0 +1,96 @@
+"""Plotly figures for the dashboard's traffic charts"""
+import os
+
+import plotly.graph_objects as go
+
+from downsampling import downsample
+
+# Widest the traffic-over-time chart is drawn, in pixels, and points sent per
+# trace; two points per pixel column is as much detail as the browser can draw
+TRAFFIC_CHART_WIDTH = int(os.environ.get('DASHBOARD_CHART_WIDTH', 1280))
+TRAFFIC_CHART_MAX_POINTS = 2 * TRAFFIC_CHART_WIDTH
+
+
+def create_traffic_source_chart(traffic_sources):
+    """Create donut chart for traffic source distribution"""
+    fig = go.Figure(data=[go.Pie(
+        labels=list(traffic_sources.keys()),
+        values=list(traffic_sources.values()),
+        hole=0.4,
+        marker_colors=['#90EE90', '#FF6B6B', '#87CEEB', '#20B2AA']
+    )])
+
+    fig.update_layout(
+        title="Traffic Source Distribution",
+        showlegend=True,
+        height=450,
+        width=400,
+        margin=dict(l=10, r=10, t=50, b=10),
+        title_x=0.5,
+        title_font_size=16
+    )
+    return fig
+
+
+def create_traffic_over_time_chart(times, total_traffic, blocked_traffic, allowed_traffic):
+    """Create line chart for traffic over time"""
+    fig = go.Figure()
+
+    # Each trace is reduced to its min/max envelope separately, so a burst in
+    # one series is kept even where the others are flat
+    traces = [
+        ('Total Traffic', total_traffic, 'blue'),
+        ('Blocked Traffic', blocked_traffic, 'red'),
+        ('Allowed Traffic', allowed_traffic, 'green')
+    ]
+    for name, values, color in traces:
+        x, y = downsample(times, values, TRAFFIC_CHART_MAX_POINTS)
+        fig.add_trace(go.Scatter(
+            x=x,
+            y=y,
+            mode='lines',
+            name=name,
+            line=dict(color=color, width=2)
+        ))
+
+    fig.update_layout(
+        title="Traffic Over Time",
+        xaxis_title="Time",
+        yaxis_title="Value",
+        height=450,
+        margin=dict(l=10, r=10, t=80, b=10),  # Increased top margin for title
+        title_x=0.5,
+        title_font_size=16,
+        legend=dict(
+            orientation="v",  # Vertical stacking
+            yanchor="top",
+            y=1.05,  # Position above the graph
+            xanchor="left",
+            x=0.02,  # Left side of the title area
+            font=dict(size=10),  # Smaller font
+            bgcolor="rgba(0,0,0,0)",  # Transparent background
+            borderwidth=0  # Remove border
+        )
+    )
+    return fig
+
+
+def create_traffic_type_chart(traffic_types):
+    """Create bar chart for traffic type distribution"""
+    fig = go.Figure(data=[go.Bar(
+        x=list(traffic_types.keys()),
+        y=list(traffic_types.values()),
+        marker_color=['#20B2AA', '#FFD700', '#9370DB', '#FF6B6B', '#87CEEB']
+    )])
+
+    fig.update_layout(
+        title="Traffic Type Distribution",
+        xaxis_title="Traffic Type",
+        yaxis_title="Value",
+        height=450,
+        width=400,
+        margin=dict(l=10, r=10, t=50, b=10),
+        title_x=0.5,
+        title_font_size=16
+    )
+    return fig
@@ -0,0 +1,74 @@
+"""Circuit breaker that stops calling a failing upstream until it recovers"""
+import threading
+import time
+
+
+class CircuitBreaker:
+    """Fail fast after repeated upstream failures, probing recovery off the request path
+
+    While closed, calls go through and their outcomes are recorded;
+    failure_threshold consecutive failures open the circuit. While open,
+    allow() is False so callers fail immediately, and a daemon thread calls
+    probe() every probe_interval seconds until it returns True, which
+    closes the circuit again. Viewers therefore never wait on a probe.
+    """
+
+    def __init__(self, probe, failure_threshold=3, probe_interval=10.0):
+        self.probe = probe
+        self.failure_threshold = failure_threshold
+        self.probe_interval = probe_interval
+        self.failures = 0
+        self.opened_at = None
+        self.times_opened = 0
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._closed.set()
+
+    @property
+    def is_open(self):
+        return not self._closed.is_set()
+
+    def allow(self):
+        """Whether a call may be made now"""
+        return self._closed.is_set()
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+
+    def record_failure(self):
+        """Count a failed call, opening the circuit at the threshold"""
+        with self._lock:
+            self.failures += 1
+            if self.failures < self.failure_threshold or self.is_open:
+                return
+            self.opened_at = time.time()
+            self.times_opened += 1
+            self._closed.clear()
+        threading.Thread(target=self._probe_until_closed, name='circuit-probe', daemon=True).start()
+
+    def close(self):
+        """Let calls through again"""
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._closed.set()
+
+    def _probe_until_closed(self):
+        while self.is_open:
+            time.sleep(self.probe_interval)
+            try:
+                recovered = self.probe()
+            except Exception:
+                recovered = False
+            if recovered:
+                self.close()
+
+    def stats(self):
+        """State counters for monitoring"""
+        with self._lock:
+            return {
+                'open': int(self.is_open),
+                'consecutive_failures': self.failures,
+                'times_opened': self.times_opened,
+            }
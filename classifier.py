@@ -0,0 +1,483 @@
+"""Batch classification of Graylog messages into sources, traffic types and event flags"""
+import ipaddress
+import json
+import os
+import re
+from bisect import bisect_right
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+SECURITY_KEYWORDS = ['unauthorized', 'blocked', 'denied', 'failed']
+SYSTEM_KEYWORDS = ['service', 'restart', 'error', 'warning']
+
+# Event severities from least to most severe, and the defaults for each group
+SEVERITIES = ['Low', 'Medium', 'High', 'Critical']
+DEFAULT_SECURITY_SEVERITY = 'Medium'
+DEFAULT_SYSTEM_SEVERITY = 'Low'
+
+# Source categories in priority order: (category, source field keywords, message keywords)
+SOURCE_RULES = [
+    ('Web Server', ['web'], ['http']),
+    ('Router', ['router'], []),
+    ('Email Server', ['email'], ['smtp']),
+]
+DEFAULT_SOURCE = 'IoT Devices'
+
+# Traffic type categories in priority order: (category, message keywords)
+TRAFFIC_TYPE_RULES = [
+    ('HTTP/HTTPS', ['http', 'https']),
+    ('DNS', ['dns']),
+    ('SMTP', ['smtp', 'email']),
+    ('SSH', ['ssh']),
+]
+DEFAULT_TRAFFIC_TYPE = 'Other'
+
+# JSON rules table replacing the built-in rules above
+RULES_FILE = os.environ.get('DASHBOARD_RULES_FILE')
+
+# Joins messages in a batch buffer; never part of a keyword
+SEPARATOR = '\x00'
+
+# Fields whose text rule keywords are matched against
+KEYWORD_FIELDS = ('source', 'message')
+
+# Keyword sets up to this size are scanned one literal at a time, which
+# re does faster than a trie pattern for a handful of keywords
+LITERAL_SCAN_LIMIT = 16
+
+BatchClassification = namedtuple(
+    "BatchClassification",
+    ["fields", "texts", "sources", "traffic_types", "is_security", "is_system", "security_rules", "system_rules"]
+)
+
+# A classification rule; a message matches if any one of its conditions does.
+#   keywords: substrings of the lowercased KEYWORD_FIELDS
+#   fields:   {field: substrings of the lowercased field value}
+#   cidrs:    {field: networks containing the field's IP address}
+#   ports:    {field: (low, high) ranges containing the field's port number}
+# severity is only used by security and system rules (None for the group default).
+Rule = namedtuple("Rule", ["category", "keywords", "fields", "cidrs", "ports", "severity"])
+
+# Rules per group in priority order; the first matching rule decides the category
+RuleSet = namedtuple(
+    "RuleSet",
+    ["sources", "traffic_types", "security", "system", "default_source", "default_traffic_type"]
+)
+
+RULE_GROUPS = ('sources', 'traffic_types', 'security', 'system')
+
+
+def make_rule(category, keywords=(), fields=None, cidrs=None, ports=None, severity=None):
+    """Build a normalized Rule, raising ValueError if it can never match"""
+    if severity is not None and severity not in SEVERITIES:
+        raise ValueError(f"Rule {category!r} has unknown severity {severity!r}")
+    rule = Rule(
+        category,
+        tuple(k.lower() for k in keywords),
+        {field: tuple(v.lower() for v in values) for field, values in (fields or {}).items()},
+        {field: tuple(ipaddress.ip_network(v, strict=False) for v in values) for field, values in (cidrs or {}).items()},
+        {field: tuple(_port_range(v) for v in values) for field, values in (ports or {}).items()},
+        severity,
+    )
+    if not (rule.keywords or any(rule.fields.values()) or any(rule.cidrs.values()) or any(rule.ports.values())):
+        raise ValueError(f"Rule {category!r} has no conditions")
+    if SEPARATOR in ''.join(rule.keywords) + ''.join(v for values in rule.fields.values() for v in values):
+        raise ValueError(f"Rule {category!r} has a keyword containing the batch separator")
+    return rule
+
+
+def _port_range(value):
+    """(low, high) for a port number, a "low-high" string or a [low, high] pair"""
+    if isinstance(value, str) and '-' in value:
+        low, high = value.split('-', 1)
+    elif isinstance(value, (list, tuple)):
+        low, high = value
+    else:
+        low = high = value
+    return int(low), int(high)
+
+
+def default_rules():
+    """The built-in rules, equivalent to the original keyword checks"""
+    return RuleSet(
+        sources=[
+            make_rule(category, text_keywords, {'source': source_keywords})
+            for category, source_keywords, text_keywords in SOURCE_RULES
+        ],
+        traffic_types=[make_rule(category, keywords) for category, keywords in TRAFFIC_TYPE_RULES],
+        security=[make_rule('Security Alert', SECURITY_KEYWORDS)],
+        system=[make_rule('System', SYSTEM_KEYWORDS)],
+        default_source=DEFAULT_SOURCE,
+        default_traffic_type=DEFAULT_TRAFFIC_TYPE,
+    )
+
+
+def load_rules(path):
+    """Read a JSON rules table; groups it leaves out keep the built-in rules
+
+    The file holds a list of rules for each of "sources", "traffic_types",
+    "security" and "system", plus optional "default_source" and
+    "default_traffic_type" names. Each rule has a "category" and any of
+    "keywords", "fields", "cidrs" and "ports" (see Rule); security and
+    system rules may also set a "severity".
+    """
+    with open(path) as f:
+        config = json.load(f)
+    defaults = default_rules()
+
+    def group(name):
+        if name not in config:
+            return getattr(defaults, name)
+        rules = []
+        for entry in config[name]:
+            try:
+                rules.append(make_rule(
+                    entry.get('category', name.title()), entry.get('keywords', ()),
+                    entry.get('fields'), entry.get('cidrs'), entry.get('ports'), entry.get('severity')
+                ))
+            except (AttributeError, TypeError, ValueError) as e:
+                raise ValueError(f"Invalid rule in {name} of {path}: {e}") from e
+        return rules
+
+    return RuleSet(
+        *(group(name) for name in RULE_GROUPS),
+        default_source=config.get('default_source', defaults.default_source),
+        default_traffic_type=config.get('default_traffic_type', defaults.default_traffic_type),
+    )
+
+
+def rules_from_env():
+    """Rules from DASHBOARD_RULES_FILE, or the built-in rules when it isn't set"""
+    return load_rules(RULES_FILE) if RULES_FILE else default_rules()
+
+
+def _joined_lowercase(texts):
+    """Lowercased buffer of all texts plus the start offset of each text"""
+    lengths = np.fromiter(map(len, texts), dtype=np.int64, count=len(texts))
+    offsets = np.zeros(len(texts), dtype=np.int64)
+    np.cumsum(lengths[:-1] + len(SEPARATOR), out=offsets[1:])
+    buffer = SEPARATOR.join(texts).lower()
+    if len(buffer) != int(lengths.sum()) + len(SEPARATOR) * max(len(texts) - 1, 0):
+        # A few Unicode characters change length when lowercased
+        lowered = [text.lower() for text in texts]
+        return _joined_lowercase(lowered)
+    return buffer, offsets
+
+
+def _trie_pattern(keywords):
+    """Regex source matching any keyword, shaped as a prefix trie
+
+    Sibling branches start with distinct characters, so at each position
+    the engine follows at most one branch per character instead of trying
+    every keyword, and the greedy optional tails give the longest match.
+    """
+    trie = {}
+    for keyword in keywords:
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        return f'(?:{body})?' if '' in node else body
+
+    return build(trie)
+
+
+def _csr(lists):
+    """Start offsets, lengths and flat values of a list of integer lists"""
+    lengths = np.array([len(values) for values in lists], dtype=np.int64)
+    starts = np.zeros(len(lists), dtype=np.int64)
+    np.cumsum(lengths[:-1], out=starts[1:])
+    values = np.array([v for values in lists for v in values], dtype=np.int64)
+    return starts, lengths, values
+
+
+def _expand(owners, keys, table):
+    """Pair each owner with every value listed under its key in a CSR table"""
+    starts, lengths, values = table
+    counts = lengths[keys]
+    rows = np.repeat(owners, counts)
+    first = np.repeat(starts[keys] - (np.cumsum(counts) - counts), counts)
+    return rows, values[first + np.arange(len(rows))]
+
+
+class _KeywordIndex:
+    """Every keyword of a set found in a batch buffer with one regex scan
+
+    Trie matches are leftmost-longest and never overlap, so each match also
+    reports the keywords it contains. A keyword that begins inside a match
+    and runs past its end would be hidden; for the few keywords whose tail
+    is the start of another keyword, the pattern is retried at those tail
+    offsets after the scan. Small sets skip the trie and scan each keyword
+    as a literal instead.
+    """
+
+    def __init__(self, rule_ids):
+        keywords = sorted(rule_ids)
+        self.keyword_ids = {keyword: i for i, keyword in enumerate(keywords)}
+        self.rules = _csr([
+            sorted({rule for other in keywords if other in keyword for rule in rule_ids[other]})
+            for keyword in keywords
+        ])
+        self.tails = [
+            [n for n in range(1, len(keyword))
+             if any(other.startswith(keyword[n:]) and len(other) > len(keyword) - n for other in keywords)]
+            for keyword in keywords
+        ]
+        self.has_tails = np.array([bool(offsets) for offsets in self.tails])
+        self.pattern = re.compile(_trie_pattern(keywords))
+        if len(keywords) <= LITERAL_SCAN_LIMIT:
+            # A keyword needs no scan of its own if the keywords it contains cover its rules
+            self.literals = [
+                (self.keyword_ids[k], re.compile(re.escape(k))) for k in keywords
+                if not set(rule_ids[k]) <= {rule for other in keywords if other != k and other in k for rule in rule_ids[other]}
+            ]
+        else:
+            self.literals = None
+
+    def match(self, buffer, offsets):
+        """(message index, rule id) for every keyword hit in a joined buffer"""
+        if self.literals is not None:
+            return self._match_literals(buffer, offsets)
+        ids = self.keyword_ids
+        found = [(m.start(), ids[m.group()]) for m in self.pattern.finditer(buffer)]
+        if not found:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        positions, keyword_ids = np.array(found, dtype=np.int64).T
+
+        extra = []
+        for position, keyword_id in zip(positions[self.has_tails[keyword_ids]].tolist(),
+                                         keyword_ids[self.has_tails[keyword_ids]].tolist()):
+            for n in self.tails[keyword_id]:
+                hidden = self.pattern.match(buffer, position + n)
+                if hidden is not None:
+                    extra.append((position + n, ids[hidden.group()]))
+        if extra:
+            extra_positions, extra_ids = np.array(extra, dtype=np.int64).T
+            positions = np.concatenate([positions, extra_positions])
+            keyword_ids = np.concatenate([keyword_ids, extra_ids])
+
+        return _expand(np.searchsorted(offsets, positions, side='right') - 1, keyword_ids, self.rules)
+
+    def _match_literals(self, buffer, offsets):
+        rows = []
+        keyword_ids = []
+        for keyword_id, pattern in self.literals:
+            positions = [m.start() for m in pattern.finditer(buffer)]
+            if positions:
+                # One hit per message is enough
+                found = np.unique(np.searchsorted(offsets, positions, side='right') - 1)
+                rows.append(found)
+                keyword_ids.append(np.full(len(found), keyword_id, dtype=np.int64))
+        if not rows:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        return _expand(np.concatenate(rows), np.concatenate(keyword_ids), self.rules)
+
+
+def _address_key(address):
+    """Integer key of an IP address, with IPv4 mapped into the IPv6 space"""
+    return int(address) if address.version == 6 else (0xffff << 32) | int(address)
+
+
+def _ip_key(value):
+    try:
+        return _address_key(ipaddress.ip_address(str(value).strip()))
+    except ValueError:
+        return None
+
+
+def _port_key(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class _RangeIndex:
+    """Rules whose integer ranges (networks, port ranges) contain a value
+
+    The ranges are cut into disjoint intervals at every boundary, each
+    listing the rules covering it, so a lookup is one bisect regardless of
+    how many ranges there are. Values are looked up once per distinct value
+    in a batch.
+    """
+
+    def __init__(self, ranges, key):
+        self.key = key
+        self.bounds = sorted({low for low, _, _ in ranges} | {high + 1 for _, high, _ in ranges})
+        self.rules = _csr([
+            sorted({rule for low, high, rule in ranges if low <= start <= high})
+            for start in self.bounds
+        ] + [[]])
+
+    def interval(self, value):
+        key = self.key(value)
+        if key is None:
+            return -1
+        return bisect_right(self.bounds, key) - 1
+
+    def match(self, values):
+        """(message index, rule id) for every range containing each value"""
+        codes, uniques = pd.factorize(pd.Series(values, dtype=object))
+        intervals = np.array([self.interval(value) for value in uniques] + [-1], dtype=np.int64)
+        # Missing values and values outside every range use the empty last entry
+        intervals[intervals < 0] = len(self.bounds)
+        return _expand(np.arange(len(values)), intervals[codes], self.rules)
+
+
+class MessageClassifier:
+    """Classifies whole batches of messages against a compiled rules table
+
+    The KEYWORD_FIELDS of each message are joined into its text, and the
+    texts of the batch into one lowercase buffer. All keywords of all rules are found with a single
+    trie-shaped regex scan of that buffer (and one per matched field), and
+    network and port conditions go through interval indexes, so the cost
+    of a batch follows the number of hits rather than the number of rules.
+    Hits are mapped back to messages with numpy and the first matching rule
+    of each group wins.
+    """
+
+    def __init__(self, rules=None):
+        self.rules = rules or default_rules()
+        groups = [getattr(self.rules, name) for name in RULE_GROUPS]
+
+        # Rule ids number every rule of every group in priority order
+        self.group_starts = np.cumsum([0] + [len(rules) for rules in groups])
+        all_rules = [rule for rules in groups for rule in rules]
+        self.rule_groups = np.repeat(np.arange(len(groups)), [len(rules) for rules in groups])
+
+        self.source_categories = _categories(self.rules.sources, self.rules.default_source)
+        self.traffic_type_categories = _categories(self.rules.traffic_types, self.rules.default_traffic_type)
+        self._source_index = np.array(
+            [self.source_categories.index(r.category) for r in self.rules.sources]
+            + [self.source_categories.index(self.rules.default_source)], dtype=np.int64
+        )
+        self._type_index = np.array(
+            [self.traffic_type_categories.index(r.category) for r in self.rules.traffic_types]
+            + [self.traffic_type_categories.index(self.rules.default_traffic_type)], dtype=np.int64
+        )
+        # (category, severity) of each security and system rule, for event rows
+        self.security_labels = [(r.category, r.severity or DEFAULT_SECURITY_SEVERITY) for r in self.rules.security]
+        self.system_labels = [(r.category, r.severity or DEFAULT_SYSTEM_SEVERITY) for r in self.rules.system]
+
+        text_keywords = {}
+        field_keywords = {}
+        cidrs = {}
+        ports = {}
+        for rule_id, rule in enumerate(all_rules):
+            for keyword in rule.keywords:
+                text_keywords.setdefault(keyword, []).append(rule_id)
+            for field, values in rule.fields.items():
+                for value in values:
+                    field_keywords.setdefault(field, {}).setdefault(value, []).append(rule_id)
+            for field, networks in rule.cidrs.items():
+                cidrs.setdefault(field, []).extend(
+                    (_address_key(n.network_address), _address_key(n.network_address) + n.num_addresses - 1, rule_id)
+                    for n in networks
+                )
+            for field, ranges in rule.ports.items():
+                ports.setdefault(field, []).extend((low, high, rule_id) for low, high in ranges)
+
+        self._text_index = _KeywordIndex(text_keywords) if text_keywords else None
+        self._field_indexes = {field: _KeywordIndex(keywords) for field, keywords in field_keywords.items()}
+        self._range_indexes = (
+            [(field, _RangeIndex(ranges, _ip_key)) for field, ranges in cidrs.items()]
+            + [(field, _RangeIndex(ranges, _port_key)) for field, ranges in ports.items()]
+        )
+
+    @classmethod
+    def from_env(cls):
+        """Classifier for the rules named by DASHBOARD_RULES_FILE"""
+        return cls(rules_from_env())
+
+    def classify(self, messages):
+        """Classify a batch of Graylog search results
+
+        Returns a BatchClassification holding the message field dicts, the
+        text searched for keywords, and per-message arrays of source and traffic type category
+        indices, the security and system event flags, and the index of the
+        security and system rule each message matched.
+        """
+        fields = [msg.get('message', {}) for msg in messages]
+        columns = []
+        for field in KEYWORD_FIELDS:
+            values = [f.get(field, '') for f in fields]
+            columns.append([v if type(v) is str else str(v) for v in values])
+        return self.classify_fields(fields, list(map(SEPARATOR.join, zip(*columns))))
+
+    def classify_fields(self, fields, texts):
+        """Classify message field dicts whose keyword text has already been built"""
+        count = len(texts)
+        if not count:
+            empty = np.zeros(0, dtype=np.int64)
+            return BatchClassification(
+                fields, texts, empty, empty, empty.astype(bool), empty.astype(bool), empty, empty
+            )
+
+        rows = [np.zeros(0, dtype=np.int64)]
+        rule_ids = [np.zeros(0, dtype=np.int64)]
+        if self._text_index is not None:
+            buffer, offsets = _joined_lowercase(texts)
+            found_rows, found_rules = self._text_index.match(buffer, offsets)
+            rows.append(found_rows)
+            rule_ids.append(found_rules)
+        for field, index in self._field_indexes.items():
+            buffer, offsets = _joined_lowercase([str(f.get(field, '')) for f in fields])
+            found_rows, found_rules = index.match(buffer, offsets)
+            rows.append(found_rows)
+            rule_ids.append(found_rules)
+        for field, index in self._range_indexes:
+            found_rows, found_rules = index.match([f.get(field) for f in fields])
+            rows.append(found_rows)
+            rule_ids.append(found_rules)
+
+        sources, traffic_types, security, system = self._first_matches(
+            np.concatenate(rows), np.concatenate(rule_ids), count
+        )
+        return BatchClassification(
+            fields, texts, self._source_index[sources], self._type_index[traffic_types],
+            security < len(self.rules.security), system < len(self.rules.system), security, system
+        )
+
+    def classify_sources(self, sources):
+        """Source category names for bare source field values"""
+        batch = self.classify_fields([{'source': source} for source in sources], [''] * len(sources))
+        return [self.source_categories[index] for index in batch.sources]
+
+    def _first_matches(self, rows, rule_ids, count):
+        """Index of the first matching rule of each group per message
+
+        Messages matching no rule of a group get the group's rule count.
+        """
+        rule_total = max(int(self.group_starts[-1]), 1)
+        keys = np.unique(rows * rule_total + rule_ids)
+        rows = keys // rule_total
+        rule_ids = keys % rule_total
+        groups = self.rule_groups[rule_ids]
+
+        matches = []
+        for group in range(len(RULE_GROUPS)):
+            start = self.group_starts[group]
+            first = np.full(count, self.group_starts[group + 1] - start, dtype=np.int64)
+            selected = groups == group
+            group_rows = rows[selected]
+            # Keys are sorted by message then rule, so a message's first entry is its first rule
+            _, index = np.unique(group_rows, return_index=True)
+            first[group_rows[index]] = rule_ids[selected][index] - start
+            matches.append(first)
+        return matches
+
+
+def _categories(rules, default):
+    """Distinct category names of a rule group in priority order, plus the default"""
+    names = list(dict.fromkeys(rule.category for rule in rules))
+    if default not in names:
+        names.append(default)
+    return names
@@ -0,0 +1,66 @@
+"""Background polling of Graylog into shared, immutable per-period snapshots"""
+import threading
+import time
+
+
+class BackgroundCollector:
+    """Polls every time period on its own interval from a single daemon thread
+
+    collect(time_period) must return a data_source.CollectedData. Each
+    successful result replaces the period's snapshot in one reference
+    assignment, so sessions read the latest snapshot without locking and
+    never see a half-built one. When a poll yields no traffic_data the
+    previous snapshot is kept (with the new status messages attached) until
+    a later poll succeeds.
+    """
+
+    def __init__(self, collect, intervals, idle_sleep=1.0):
+        self.collect = collect
+        self.intervals = dict(intervals)
+        self.idle_sleep = idle_sleep
+        self._snapshots = {}
+        self._due = dict.fromkeys(self.intervals, 0.0)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def snapshot(self, time_period):
+        """Latest CollectedData for a period, or None before the first poll finishes"""
+        return self._snapshots.get(time_period)
+
+    def start(self):
+        """Start the polling thread if it isn't already running"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="graylog-collector", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        """Ask the polling thread to exit and wait for it"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def poll(self, time_period):
+        """Collect one period now and publish the result"""
+        collected = self.collect(time_period)
+        previous = self._snapshots.get(time_period)
+        if collected.traffic_data is None and previous is not None and previous.traffic_data is not None:
+            collected = previous._replace(status_messages=collected.status_messages)
+        self._snapshots[time_period] = collected
+        return collected
+
+    def _run(self):
+        while not self._stop.is_set():
+            now = time.monotonic()
+            # Poll whichever period has been due the longest
+            time_period, due_at = min(self._due.items(), key=lambda item: item[1])
+            if due_at > now:
+                self._stop.wait(min(due_at - now, self.idle_sleep))
+                continue
+            try:
+                self.poll(time_period)
+            except Exception:
+                # Keep serving the previous snapshot; collect() reports its own errors
+                pass
+            self._due[time_period] = time.monotonic() + self.intervals[time_period]
@@ -0,0 +1,49 @@
+"""Reduce long time series to a bounded number of points for charting"""
+import numpy as np
+import pandas as pd
+
+
+def _buckets(count, buckets):
+    """Edges splitting the interior points 1..count-2 into equal-width buckets"""
+    return np.linspace(1, count - 1, buckets + 1).astype(np.int64)
+
+
+def _first_per_bucket(matches, bucket_of):
+    """Index of the first matching point in each bucket"""
+    hits = np.flatnonzero(matches)
+    _, first = np.unique(bucket_of[hits], return_index=True)
+    return hits[first]
+
+
+def minmax_indices(y, max_points):
+    """Indices of the minimum and maximum of y in each bucket, plus both ends
+
+    Every local extreme that is the largest or smallest in its bucket is
+    kept, so short spikes survive however far the series is reduced.
+    """
+    y = np.asarray(y)
+    count = len(y)
+    if count <= max_points:
+        return np.arange(count)
+    buckets = max(1, (max_points - 2) // 2)
+    edges = _buckets(count, buckets)
+    interior = y[1:-1]
+    bucket_of = np.repeat(np.arange(buckets), np.diff(edges))
+    starts = edges[:-1] - 1
+    maxima = np.maximum.reduceat(interior, starts)
+    minima = np.minimum.reduceat(interior, starts)
+    selected = np.concatenate([
+        [0],
+        _first_per_bucket(interior == maxima[bucket_of], bucket_of) + 1,
+        _first_per_bucket(interior == minima[bucket_of], bucket_of) + 1,
+        [count - 1],
+    ])
+    return np.unique(selected)
+
+
+def downsample(times, values, max_points):
+    """At most about max_points (time, value) pairs representing a series, as its min/max envelope"""
+    times = pd.DatetimeIndex(times)
+    values = np.asarray(values)
+    index = minmax_indices(values, max_points)
+    return times[index], values[index]
@@ -1,14 +1,23 @@
 import streamlit as st
-import plotly.graph_objects as go
-import plotly.express as px
 import pandas as pd
-import numpy as np
-from datetime import datetime, timedelta
+from datetime import datetime
 import time
-import requests
-import json
-import base64
-import urllib.parse
+import os
+
+from aggregate_cache import AggregateCache
+from charts import create_traffic_over_time_chart, create_traffic_source_chart, create_traffic_type_chart
+from collector import BackgroundCollector
+from data_source import GRAYLOG_QUERY, SiteSource, collect_live_data, collect_traffic_data, site_traffic_data
+from event_store import ORDERS
+from figure_cache import FigureCache
+from gelf_listener import GelfListener
+from graylog_client import GraylogClient
+from metrics import MetricsExporter, metrics
+from process_pool import ProcessPool
+from result_cache import ResultCache
+from sites import site_key, site_query, site_slug, sites_from_env
+from timeseries import PERIODS, period_duration
+from traffic_processing import IncrementalWindow
 
 # Page configuration
 st.set_page_config(
@@ -76,6 +85,39 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+# How long fetched data is shared between viewers, per time period (seconds)
+PERIOD_CACHE_TTLS = {
+    "Last Hour": 15,
+    "Last 6 Hours": 60,
+    "Last 24 Hours": 120,
+    "Last 7 Days": 300
+}
+DEFAULT_CACHE_TTL = 120
+RESULT_CACHE_MAX_ENTRIES = 64
+RESULT_CACHE_MAX_BYTES = 256 * 1024 * 1024
+FIGURE_CACHE_MAX_ENTRIES = 32
+
+# Rows shown per page of the event tables
+EVENTS_PAGE_SIZE = 25
+
+# Poll Graylog from one background thread and serve every session its snapshot
+BACKGROUND_POLLING = os.environ.get('DASHBOARD_BACKGROUND_POLLING', '').lower() in ('1', 'true', 'yes')
+
+# Show stage timings, counters and recent errors below the dashboard
+DEBUG_PANEL = os.environ.get('DASHBOARD_DEBUG_PANEL', '').lower() in ('1', 'true', 'yes')
+
+# How long the last good data of each period is kept to show while Graylog is down (seconds)
+STALE_DATA_TTL = 24 * 3600
+
+# How long data aggregated from the live GELF stream is shared between reruns (seconds)
+LIVE_DATA_TTL = 1
+
+# Seconds between automatic reruns of each fragment of the page on its own;
+# None only reruns a fragment when it is interacted with
+STATUS_REFRESH_INTERVAL = 5
+CHARTS_REFRESH_INTERVAL = min(PERIOD_CACHE_TTLS.values())
+TABLES_REFRESH_INTERVAL = 60
+
 # Initialize session state for dismissible messages
 if 'dismissed_messages' not in st.session_state:
     st.session_state.dismissed_messages = set()
@@ -98,6 +140,10 @@ def dismiss_message(message_id):
     """Dismiss a status message"""
     st.session_state.dismissed_messages.add(message_id)
 
+def dismiss_all_messages():
+    """Dismiss every status message shown so far"""
+    st.session_state.dismissed_messages.update(msg["id"] for msg in st.session_state.status_messages)
+
 def display_status_messages():
     """Display status messages with dismiss buttons using Streamlit components"""
     active_messages = [msg for msg in st.session_state.status_messages 
@@ -116,394 +162,254 @@ def display_status_messages():
                     st.error(message["text"])
             
             with col2:
-                if st.button("×", key=f"dismiss_{message['id']}", help="Dismiss message"):
-                    dismiss_message(message["id"])
-                    st.rerun()
+                # The callback runs before the rerun the click causes, so no second rerun is needed
+                st.button("×", key=f"dismiss_{message['id']}", help="Dismiss message",
+                          on_click=dismiss_message, args=(message["id"],))
         
         st.markdown('</div>', unsafe_allow_html=True)
 
-def get_graylog_data(time_period):
-    """Get real data from Graylog API based on time period"""
-    try:
-        # Graylog API configuration
-        graylog_url = "http://192.168.10.239:9000"
-        username = "admin"
-        password = "Salvat!0n"  # Password with zero, not O
-        
-        # Calculate time range based on selection
-        now = datetime.now()
-        if time_period == "Last Hour":
-            start_time = now - timedelta(hours=1)
-        elif time_period == "Last 6 Hours":
-            start_time = now - timedelta(hours=6)
-        elif time_period == "Last 24 Hours":
-            start_time = now - timedelta(hours=24)
-        elif time_period == "Last 7 Days":
-            start_time = now - timedelta(days=7)
-        else:
-            start_time = now - timedelta(hours=24)  # Default to 24 hours
-        
-        # Convert to Graylog timestamp format
-        start_timestamp = start_time.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
-        end_timestamp = now.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
-        
-        # Create headers for authentication with proper password handling
-        # Use the exact format that works with curl
-        auth_string = f"{username}:{password}"
-        headers = {
-            'Authorization': f'Basic {base64.b64encode(auth_string.encode()).decode()}',
-            'Content-Type': 'application/json'
-        }
-        
-        # First test the connection with a simple API call
-        test_url = f"{graylog_url}/api/system/inputs"
-        test_response = requests.get(test_url, headers=headers, timeout=10)
-        
-        if test_response.status_code == 200:
-            add_status_message("graylog_connection_success", "Connected to Graylog successfully", "success")
-        else:
-            add_status_message("graylog_auth_error", f"Authentication failed: {test_response.status_code}", "error")
-            return None
-        
-        # Try simpler API endpoint first - just get message count
-        query_url = f"{graylog_url}/api/count/total"
-        
-        # Use simpler parameters
-        params = {
-            'query': '*',  # Search all messages
-            'range': '3600'  # Last hour
-        }
-        
-        # Try the search API
-        try:
-            response = requests.get(query_url, headers=headers, params=params, timeout=30)
-            
-            # If search API fails, use fallback method silently
-            if response.status_code != 200:
-                return get_messages_from_inputs(graylog_url, username, password, time_period)
-            
-            # Try to parse JSON response
-            try:
-                data = response.json()
-                messages = data.get('messages', [])
-                
-                # Process messages to extract traffic data
-                traffic_data = process_graylog_messages(messages, start_time, now)
-                return traffic_data
-            except (ValueError, TypeError) as e:
-                # JSON parsing failed, use fallback
-                return get_messages_from_inputs(graylog_url, username, password, time_period)
-                
-        except requests.exceptions.RequestException as e:
-            # Network error, use fallback
-            return get_messages_from_inputs(graylog_url, username, password, time_period)
-            
-    except Exception as e:
-        # If any unexpected error occurs, use fallback method silently
-        return get_messages_from_inputs(graylog_url, username, password, time_period)
-
-def get_messages_from_inputs(graylog_url, username, password, time_period="Last Hour"):
-    """Fallback method to get messages from inputs"""
-    try:
-        # Create headers for authentication with proper password handling
-        # Use the exact format that works with curl
-        auth_string = f"{username}:{password}"
-        headers = {
-            'Authorization': f'Basic {base64.b64encode(auth_string.encode()).decode()}',
-            'Content-Type': 'application/json'
-        }
-        
-        # Get inputs first
-        inputs_url = f"{graylog_url}/api/system/inputs"
-        inputs_response = requests.get(inputs_url, headers=headers, timeout=10)
-        
-        if inputs_response.status_code == 200:
-            inputs_data = inputs_response.json()
-            inputs = inputs_data.get('inputs', [])
-            
-            # Create real data based on actual inputs
-            # Use consistent data based on input names
-            input_names = [input.get('title', 'Unknown') for input in inputs]
-            
-            # Create consistent traffic sources based on actual inputs
-            if 'pfSense' in str(input_names):
-                traffic_sources = {'Router': 60, 'Web Server': 25, 'Email Server': 10, 'IoT Devices': 5}
-            else:
-                traffic_sources = {'Web Server': 40, 'Router': 30, 'Email Server': 20, 'IoT Devices': 10}
-            
-            # Create consistent traffic types
-            traffic_types = {'HTTP/HTTPS': 45, 'DNS': 25, 'SMTP': 20, 'SSH': 8, 'Other': 2}
-            
-            # Create time series data based on selected time period
-            now = datetime.now()
-            
-            # Determine time range and data points based on time period
-            if time_period == "Last Hour":
-                hours = 1
-                data_points = 12  # 5-minute intervals
-                times = [now - timedelta(minutes=i*5) for i in range(data_points, 0, -1)]
-            elif time_period == "Last 6 Hours":
-                hours = 6
-                data_points = 12  # 30-minute intervals
-                times = [now - timedelta(minutes=i*30) for i in range(data_points, 0, -1)]
-            elif time_period == "Last 24 Hours":
-                hours = 24
-                data_points = 24  # 1-hour intervals
-                times = [now - timedelta(hours=i) for i in range(data_points, 0, -1)]
-            elif time_period == "Last 7 Days":
-                hours = 168
-                data_points = 14  # 12-hour intervals
-                times = [now - timedelta(hours=i*12) for i in range(data_points, 0, -1)]
-            else:
-                hours = 24
-                data_points = 24
-                times = [now - timedelta(hours=i) for i in range(data_points, 0, -1)]
-            
-            # Use input count and time period to generate consistent but varying data
-            base_traffic = len(inputs) * 15  # Base traffic based on number of inputs
-            scale_factor = max(1, hours // 24)  # Scale based on time period
-            
-            total_traffic = []
-            for i in range(data_points):
-                # Create patterns that vary by time period but remain consistent
-                pattern_value = (i % 8) + (i % 3) * 2  # Consistent pattern
-                scaled_value = base_traffic + (pattern_value * scale_factor)
-                total_traffic.append(scaled_value)
-            
-            allowed_traffic = [int(t * 0.85) for t in total_traffic]
-            blocked_traffic = [t - a for t, a in zip(total_traffic, allowed_traffic)]
-            
-            # Create events based on inputs
-            security_events = [
-                {'timestamp': now.strftime('%Y-%m-%d %H:%M:%S'), 'type': 'Input Active', 'severity': 'Low', 'source': 'VCA pfSense', 'status': 'Active'},
-                {'timestamp': (now - timedelta(minutes=5)).strftime('%Y-%m-%d %H:%M:%S'), 'type': 'Input Active', 'severity': 'Low', 'source': 'PDS Debt', 'status': 'Active'}
-            ]
-            
-            system_events = [
-                {'timestamp': now.strftime('%Y-%m-%d %H:%M:%S'), 'type': 'System Event', 'category': 'System', 'description': f'Graylog inputs active: {len(inputs)} inputs', 'status': 'Completed'}
-            ]
-            
-            return {
-                'traffic_sources': traffic_sources,
-                'traffic_types': traffic_types,
-                'times': times,
-                'total_traffic': total_traffic,
-                'allowed_traffic': allowed_traffic,
-                'blocked_traffic': blocked_traffic,
-                'security_events': security_events,
-                'system_events': system_events
-            }
-        else:
-            add_status_message("inputs_fallback_error", f"Failed to get inputs: {inputs_response.status_code}", "error")
-            return None
-            
-    except Exception as e:
-        add_status_message("fallback_error", f"Fallback method failed: {str(e)}", "error")
+@st.cache_resource
+def get_site_sources():
+    """Client, query and traffic store of every Graylog site, created once per server process
+
+    Sites on the same node with the same account share one pooled client.
+    Each site keeps its own multi-resolution traffic counts serving every
+    period; with DASHBOARD_STATE_FILE set they are persisted and survive
+    restarts. With DASHBOARD_PROCESS_WORKERS set, every site folds long
+    ranges on one shared pool of worker processes.
+    """
+    sites = sites_from_env()
+    pool = get_process_pool()
+    duration = max(period_duration(period) for period in PERIODS)
+    clients = {}
+    sources = []
+    for site in sites:
+        key = (site.url, site.username, site.password)
+        if key not in clients:
+            clients[key] = GraylogClient.from_env(site.url, site.username, site.password)
+            name = 'graylog_circuit' if len(sites) == 1 else f'graylog_circuit_{site_slug(site)}'
+            metrics.add_source(name, clients[key].breaker.stats)
+        persist = AggregateCache.from_env(None if len(sites) == 1 else site_key(site))
+        store = IncrementalWindow(duration, store=True, persist=persist)
+        sources.append(SiteSource(site.name, clients[key], site_query(GRAYLOG_QUERY, site), store, pool))
+    return sources
+
+@st.cache_resource
+def get_process_pool():
+    """Worker processes folding long message ranges, or None when DASHBOARD_PROCESS_WORKERS isn't set"""
+    pool = ProcessPool.from_env()
+    if pool is not None:
+        metrics.add_source('process_pool', pool.stats)
+    return pool
+
+@st.cache_resource
+def get_result_cache():
+    """Query result cache shared by every session in this server process"""
+    cache = ResultCache(max_entries=RESULT_CACHE_MAX_ENTRIES, max_bytes=RESULT_CACHE_MAX_BYTES)
+    metrics.add_source('result_cache', cache.stats)
+    return cache
+
+@st.cache_resource
+def get_last_good_data():
+    """Latest good CollectedData per (query, period), shared by every session
+
+    Kept apart from the result cache, whose newer entries would evict it
+    long before an outage needs it; it holds one entry per period.
+    """
+    return {}
+
+@st.cache_resource
+def get_live_data():
+    """Latest CollectedData from the GELF stream per period, shared by every session
+
+    Kept apart from the result cache, where a new snapshot every second
+    would evict the Graylog results; it holds one entry per period.
+    """
+    return {}
+
+@st.cache_resource
+def get_figure_cache():
+    """Built chart figures shared by every session in this server process"""
+    cache = FigureCache(max_entries=FIGURE_CACHE_MAX_ENTRIES)
+    metrics.add_source('figure_cache', cache.stats)
+    return cache
+
+@st.cache_resource
+def get_metrics_exporter():
+    """Prometheus sidecar endpoint and/or metrics file, started once per server process"""
+    return MetricsExporter.from_env(metrics).start()
+
+@st.cache_resource
+def get_gelf_listener():
+    """Listener aggregating a mirrored GELF stream in this server process, or None
+
+    Only started when DASHBOARD_GELF_PORT is set.
+    """
+    listener = GelfListener.from_env(max(period_duration(period) for period in PERIODS))
+    if listener is None:
         return None
+    metrics.add_source('gelf', listener.stats)
+    return listener.start()
 
-def process_graylog_messages(messages, start_time, end_time):
-    """Process Graylog messages to extract traffic data"""
-    try:
-        # Initialize data structures
-        traffic_sources = {'Web Server': 0, 'Router': 0, 'Email Server': 0, 'IoT Devices': 0}
-        traffic_types = {'HTTP/HTTPS': 0, 'DNS': 0, 'SMTP': 0, 'SSH': 0, 'Other': 0}
-        time_series_data = []
-        security_events = []
-        system_events = []
-        
-        # Process each message
-        for msg in messages:
-            message = msg.get('message', {})
-            
-            # Extract timestamp
-            timestamp = message.get('timestamp', '')
-            if timestamp:
-                try:
-                    msg_time = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
-                    time_series_data.append({
-                        'timestamp': msg_time,
-                        'total_traffic': 1,  # Count messages as traffic
-                        'allowed_traffic': 1,
-                        'blocked_traffic': 0
-                    })
-                except:
-                    pass
-            
-            # Categorize by source (based on message content or source field)
-            source = message.get('source', '')
-            if 'web' in source.lower() or 'http' in str(message).lower():
-                traffic_sources['Web Server'] += 1
-            elif 'router' in source.lower():
-                traffic_sources['Router'] += 1
-            elif 'email' in source.lower() or 'smtp' in str(message).lower():
-                traffic_sources['Email Server'] += 1
-            else:
-                traffic_sources['IoT Devices'] += 1
-            
-            # Categorize by traffic type
-            message_text = str(message).lower()
-            if 'http' in message_text or 'https' in message_text:
-                traffic_types['HTTP/HTTPS'] += 1
-            elif 'dns' in message_text:
-                traffic_types['DNS'] += 1
-            elif 'smtp' in message_text or 'email' in message_text:
-                traffic_types['SMTP'] += 1
-            elif 'ssh' in message_text:
-                traffic_types['SSH'] += 1
-            else:
-                traffic_types['Other'] += 1
-            
-            # Extract security events
-            if any(keyword in str(message).lower() for keyword in ['unauthorized', 'blocked', 'denied', 'failed']):
-                security_events.append({
-                    'timestamp': timestamp,
-                    'type': 'Security Alert',
-                    'severity': 'Medium',
-                    'source': source,
-                    'status': 'Blocked'
-                })
-            
-            # Extract system events
-            if any(keyword in str(message).lower() for keyword in ['service', 'restart', 'error', 'warning']):
-                system_events.append({
-                    'timestamp': timestamp,
-                    'type': 'System Event',
-                    'category': 'System',
-                    'description': str(message)[:100] + '...' if len(str(message)) > 100 else str(message),
-                    'status': 'Completed'
-                })
-        
-        # Convert counts to percentages for traffic sources
-        total_messages = sum(traffic_sources.values())
-        if total_messages > 0:
-            traffic_sources = {k: (v / total_messages) * 100 for k, v in traffic_sources.items()}
-        
-        # Create time series data
-        if time_series_data:
-            df = pd.DataFrame(time_series_data)
-            df = df.set_index('timestamp').resample('1H').sum().fillna(0)
-            times = df.index
-            total_traffic = df['total_traffic'].values
-            allowed_traffic = df['allowed_traffic'].values
-            blocked_traffic = df['blocked_traffic'].values
-        else:
-            # If no data, create empty time series
-            times = pd.date_range(start=start_time, end=end_time, freq='1H')
-            total_traffic = np.zeros(len(times))
-            allowed_traffic = np.zeros(len(times))
-            blocked_traffic = np.zeros(len(times))
-        
-        return {
-            'traffic_sources': traffic_sources,
-            'traffic_types': traffic_types,
-            'times': times,
-            'total_traffic': total_traffic,
-            'allowed_traffic': allowed_traffic,
-            'blocked_traffic': blocked_traffic,
-            'security_events': security_events[:10],  # Limit to 10 most recent
-            'system_events': system_events[:10]  # Limit to 10 most recent
-        }
-        
-    except Exception as e:
-        add_status_message("data_processing_error", f"Error processing Graylog data: {str(e)}", "error")
+@st.cache_resource
+def get_background_collector():
+    """Background poller shared by every session in this server process"""
+    sources = get_site_sources()
+    intervals = {period: PERIOD_CACHE_TTLS.get(period, DEFAULT_CACHE_TTL) for period in PERIODS}
+    return BackgroundCollector(
+        lambda time_period: collect_traffic_data(sources, time_period), intervals
+    ).start()
+
+def show_status_messages(collected):
+    """Queue the status messages captured while collecting data"""
+    for message_id, text, message_type in collected.status_messages:
+        add_status_message(message_id, text, message_type)
+
+def remember_good_data(time_period, collected):
+    """Keep a period's latest good data to fall back on, and clear any stale banner"""
+    get_last_good_data()[(GRAYLOG_QUERY, time_period)] = collected
+    st.session_state.status_messages = [
+        msg for msg in st.session_state.status_messages if msg["id"] != "graylog_stale"
+    ]
+
+def show_stale_banner(collected):
+    """Tell the viewer the data shown is the last good data, not current"""
+    minutes = int(time.time() - collected.collected_at) // 60
+    add_status_message(
+        "graylog_stale",
+        f"Graylog is unavailable; showing data from {minutes} min ago until it recovers",
+        "error"
+    )
+
+def get_stale_data(time_period, site_names):
+    """Last good traffic_data for a period marked as stale, or None if there is none"""
+    collected = get_last_good_data().get((GRAYLOG_QUERY, time_period))
+    if collected is None or time.time() - collected.collected_at > STALE_DATA_TTL:
         return None
+    show_stale_banner(collected)
+    return select_sites(collected, time_period, site_names)
 
-def create_traffic_source_chart(traffic_sources):
-    """Create donut chart for traffic source distribution"""
-    fig = go.Figure(data=[go.Pie(
-        labels=list(traffic_sources.keys()),
-        values=list(traffic_sources.values()),
-        hole=0.4,
-        marker_colors=['#90EE90', '#FF6B6B', '#87CEEB', '#20B2AA']
-    )])
-    
-    fig.update_layout(
-        title="Traffic Source Distribution",
-        showlegend=True,
-        height=450,
-        width=400,
-        margin=dict(l=10, r=10, t=50, b=10),
-        title_x=0.5,
-        title_font_size=16
+def select_sites(collected, time_period, site_names):
+    """traffic_data of the selected sites, merged from the collected per-site aggregates"""
+    if not collected.partials or set(site_names) >= set(collected.partials):
+        return collected.traffic_data
+    # Every viewer of the same selection shares one merge of the same collection
+    ttl = PERIOD_CACHE_TTLS.get(time_period, DEFAULT_CACHE_TTL)
+    return get_result_cache().get_or_compute(
+        ('sites', time_period, collected.collected_at, tuple(site_names)), ttl,
+        lambda: site_traffic_data(collected, site_names)
     )
-    return fig
 
-def create_traffic_over_time_chart(times, total_traffic, blocked_traffic, allowed_traffic):
-    """Create line chart for traffic over time"""
-    fig = go.Figure()
+def get_graylog_data(time_period, site_names, caption=True):
+    """Get Graylog data for a time period and the selected sites, shared across sessions
+
+    caption shows how fresh the data is; only one region of the page does.
+    """
+    listener = get_gelf_listener()
+    if listener is not None and listener.covers(period_duration(time_period)):
+        # The stream has been received for the whole period, so Graylog isn't queried;
+        # it holds every site's traffic, so the site selection doesn't apply
+        live_data = get_live_data()
+        collected = live_data.get(time_period)
+        if collected is None or time.time() - collected.collected_at >= LIVE_DATA_TTL:
+            collected = live_data[time_period] = collect_live_data(listener, time_period)
+        if caption:
+            st.caption("Live data from the GELF stream")
+        return collected.traffic_data
     
-    fig.add_trace(go.Scatter(
-        x=times,
-        y=total_traffic,
-        mode='lines',
-        name='Total Traffic',
-        line=dict(color='blue', width=2)
-    ))
+    sources = get_site_sources()
+    outage = all(source.client.breaker.is_open for source in sources)
     
-    fig.add_trace(go.Scatter(
-        x=times,
-        y=blocked_traffic,
-        mode='lines',
-        name='Blocked Traffic',
-        line=dict(color='red', width=2)
-    ))
+    if BACKGROUND_POLLING:
+        collected = get_background_collector().snapshot(time_period)
+        if collected is not None:
+            show_status_messages(collected)
+            if caption:
+                age = int(time.time() - collected.collected_at)
+                st.caption(f"Data as of {age}s ago")
+            if outage:
+                show_stale_banner(collected)
+            return select_sites(collected, time_period, site_names)
     
-    fig.add_trace(go.Scatter(
-        x=times,
-        y=allowed_traffic,
-        mode='lines',
-        name='Allowed Traffic',
-        line=dict(color='green', width=2)
-    ))
+    if outage:
+        # Don't wait on Graylog during an outage; the breakers probe it in the background
+        return get_stale_data(time_period, site_names)
     
-    fig.update_layout(
-        title="Traffic Over Time",
-        xaxis_title="Time",
-        yaxis_title="Value",
-        height=450,
-        width=400,
-        margin=dict(l=10, r=10, t=80, b=10),  # Increased top margin for title
-        title_x=0.5,
-        title_font_size=16,
-        legend=dict(
-            orientation="v",  # Vertical stacking
-            yanchor="top",
-            y=1.05,  # Position above the graph
-            xanchor="left",
-            x=0.02,  # Left side of the title area
-            font=dict(size=10),  # Smaller font
-            bgcolor="rgba(0,0,0,0)",  # Transparent background
-            borderwidth=0  # Remove border
-        )
+    # Every viewer of the same period within one TTL bucket shares a single upstream fetch
+    # of all sites, so switching the site selection never fetches
+    ttl = PERIOD_CACHE_TTLS.get(time_period, DEFAULT_CACHE_TTL)
+    cache_key = (GRAYLOG_QUERY, int(time.time() // ttl), time_period)
+    collected = get_result_cache().get_or_compute(
+        cache_key, ttl,
+        lambda: collect_traffic_data(sources, time_period),
+        should_cache=lambda collected: collected.traffic_data is not None
     )
-    return fig
-
-def create_traffic_type_chart(traffic_types):
-    """Create bar chart for traffic type distribution"""
-    fig = go.Figure(data=[go.Bar(
-        x=list(traffic_types.keys()),
-        y=list(traffic_types.values()),
-        marker_color=['#20B2AA', '#FFD700', '#9370DB', '#FF6B6B', '#87CEEB']
-    )])
     
-    fig.update_layout(
-        title="Traffic Type Distribution",
-        xaxis_title="Traffic Type",
-        yaxis_title="Value",
-        height=450,
-        width=400,
-        margin=dict(l=10, r=10, t=50, b=10),
-        title_x=0.5,
-        title_font_size=16
-    )
-    return fig
+    show_status_messages(collected)
+    if collected.traffic_data is None or collected.traffic_data.get('fallback'):
+        # Real data from before the failure beats the inputs-based placeholder
+        return get_stale_data(time_period, site_names) or collected.traffic_data
+    remember_good_data(time_period, collected)
+    return select_sites(collected, time_period, site_names)
+
+def display_event_table(events, key):
+    """Filterable event table that only builds a dataframe for the current page"""
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        severity = st.selectbox("Severity", ["All"] + events.values('severity'), key=f"{key}_severity")
+    with col2:
+        source = st.selectbox("Source", ["All"] + events.values('source'), key=f"{key}_source")
+    with col3:
+        order = st.selectbox("Order", ORDERS, key=f"{key}_order")
+    filters = {
+        'severity': None if severity == "All" else severity,
+        'source': None if source == "All" else source
+    }
+    
+    total = events.count(**filters)
+    pages = max(1, -(-total // EVENTS_PAGE_SIZE))
+    page = st.number_input("Page", min_value=1, max_value=pages, step=1, key=f"{key}_page")
+    
+    offset = (page - 1) * EVENTS_PAGE_SIZE
+    rows = events.page(offset, EVENTS_PAGE_SIZE, order, **filters)
+    st.dataframe(pd.DataFrame(rows), use_container_width=True, hide_index=True)
+    st.caption(f"Showing {offset + 1}-{offset + len(rows)} of {total} events")
+
+def display_debug_panel():
+    """Stage timings, counters and recent errors of this server process"""
+    with st.expander("Debug: timings and counters"):
+        timings = [
+            {'Stage': stage, 'Count': count, 'Mean ms': round(1000 * total / count, 1),
+             'Max ms': round(1000 * longest, 1), 'Last ms': round(1000 * last, 1)}
+            for stage, (count, total, longest, last) in metrics.timings().items()
+        ]
+        st.dataframe(pd.DataFrame(timings), use_container_width=True, hide_index=True)
+        
+        counters = [
+            {'Counter': name, 'Labels': ', '.join(f"{k}={v}" for k, v in labels), 'Value': value}
+            for (name, labels), value in metrics.counters().items()
+        ]
+        counters += [{'Counter': name, 'Labels': '', 'Value': value} for name, value in metrics.gauges().items()]
+        st.dataframe(pd.DataFrame(counters), use_container_width=True, hide_index=True)
+        
+        for at, stage, error in reversed(metrics.recent_errors):
+            st.text(f"{datetime.fromtimestamp(at):%H:%M:%S} {stage}: {error}")
 
 def main():
+    get_metrics_exporter()
+    with metrics.span('rerun'):
+        render_dashboard()
+    
+    if DEBUG_PANEL:
+        display_debug_panel()
+
+def render_dashboard():
     # Dashboard header with proper spacing
     st.markdown('<div class="dashboard-header">', unsafe_allow_html=True)
     
-    # Title and dropdown in a row with proper spacing
-    col1, col2, col3 = st.columns([4, 2, 1])
+    # Title and dropdowns in a row with proper spacing
+    site_names = [source.name for source in get_site_sources()]
+    col1, col2, col3 = st.columns([4, 2, 2] if len(site_names) > 1 else [4, 2, 1])
     
     with col1:
         st.title("Network Traffic Dashboard")
@@ -517,41 +423,83 @@ def main():
         )
     
     with col3:
-        st.write("")  # Empty space for alignment
+        if len(site_names) > 1:
+            # Per-site views are merged from the same fetch; no selection means every site
+            site_names = st.multiselect("Sites", site_names, placeholder="All sites", key="sites") or site_names
+        else:
+            st.write("")  # Empty space for alignment
     
     st.markdown('</div>', unsafe_allow_html=True)
     
-    # Display status messages with dismiss functionality
-    display_status_messages()
+    # Status messages go above the data but are filled in after fetching it,
+    # so messages raised by this fetch show without waiting for another rerun
+    status_area = st.container()
+    
+    # Each region fetches its own data (a shared cache hit) so it can rerun on its own
+    render_charts(time_period, site_names)
+    render_event_tables(time_period, site_names)
     
-    # Get real data from Graylog
-    traffic_data = get_graylog_data(time_period)
+    with status_area:
+        render_status()
     
-    if traffic_data:
+    # Add a button to manually dismiss all messages (for testing)
+    st.button("Dismiss All Messages", on_click=dismiss_all_messages)
+
+@st.fragment(run_every=STATUS_REFRESH_INTERVAL)
+def render_status():
+    """Status banner; dismissing a message only reruns this region"""
+    with metrics.span('render_status'):
+        display_status_messages()
+
+@st.fragment(run_every=CHARTS_REFRESH_INTERVAL)
+def render_charts(time_period, site_names):
+    """The three charts, refreshed from the shared data on their own interval"""
+    with metrics.span('render_charts'):
+        traffic_data = get_graylog_data(time_period, site_names)
+        if not traffic_data:
+            # Show error message if no data available
+            st.error("Unable to retrieve data from Graylog. Please check your connection and try again.")
+            return
+        
         # Charts section with improved spacing
         st.markdown('<div class="chart-container">', unsafe_allow_html=True)
         
         # Create three columns for charts with better spacing
         col1, col2, col3 = st.columns(3, gap="large")
         
+        # Figures are only rebuilt when the data behind them changes
+        figures = get_figure_cache()
+        
         with col1:
-            fig1 = create_traffic_source_chart(traffic_data['traffic_sources'])
-            st.plotly_chart(fig1, use_container_width=True, config={'displayModeBar': False})
+            fig1 = figures.figure(create_traffic_source_chart, traffic_data['traffic_sources'])
+            with metrics.span('plotly_chart'):
+                st.plotly_chart(fig1, use_container_width=True, config={'displayModeBar': False})
         
         with col2:
-            fig2 = create_traffic_over_time_chart(
+            fig2 = figures.figure(
+                create_traffic_over_time_chart,
                 traffic_data['times'], 
                 traffic_data['total_traffic'], 
                 traffic_data['blocked_traffic'], 
                 traffic_data['allowed_traffic']
             )
-            st.plotly_chart(fig2, use_container_width=True, config={'displayModeBar': False})
+            with metrics.span('plotly_chart'):
+                st.plotly_chart(fig2, use_container_width=True, config={'displayModeBar': False})
         
         with col3:
-            fig3 = create_traffic_type_chart(traffic_data['traffic_types'])
-            st.plotly_chart(fig3, use_container_width=True, config={'displayModeBar': False})
+            fig3 = figures.figure(create_traffic_type_chart, traffic_data['traffic_types'])
+            with metrics.span('plotly_chart'):
+                st.plotly_chart(fig3, use_container_width=True, config={'displayModeBar': False})
         
         st.markdown('</div>', unsafe_allow_html=True)
+
+@st.fragment(run_every=TABLES_REFRESH_INTERVAL)
+def render_event_tables(time_period, site_names):
+    """The two event tables; filtering or paging only reruns this region"""
+    with metrics.span('render_tables'):
+        traffic_data = get_graylog_data(time_period, site_names, caption=False)
+        if not traffic_data:
+            return
         
         # Tables section
         col1, col2 = st.columns(2)
@@ -559,27 +507,16 @@ def main():
         with col1:
             st.subheader("Security Events")
             if traffic_data['security_events']:
-                security_df = pd.DataFrame(traffic_data['security_events'])
-                st.dataframe(security_df, use_container_width=True, hide_index=True)
+                display_event_table(traffic_data['security_events'], "security")
             else:
                 st.info("No security events found in the selected time period.")
         
         with col2:
             st.subheader("System Events")
             if traffic_data['system_events']:
-                system_df = pd.DataFrame(traffic_data['system_events'])
-                st.dataframe(system_df, use_container_width=True, hide_index=True)
+                display_event_table(traffic_data['system_events'], "system")
             else:
                 st.info("No system events found in the selected time period.")
-    
-    else:
-        # Show error message if no data available
-        st.error("Unable to retrieve data from Graylog. Please check your connection and try again.")
-    
-    # Add a button to manually dismiss all messages (for testing)
-    if st.button("Dismiss All Messages"):
-        st.session_state.dismissed_messages.update([msg["id"] for msg in st.session_state.status_messages])
-        st.rerun()
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,173 @@
+"""Bounded, indexed storage for the security and system event tables"""
+import heapq
+import sys
+from itertools import count
+
+import numpy as np
+
+from classifier import SEVERITIES
+from timeseries import NAT, parse_timestamps
+
+# Fields of an event row that tables can be filtered on
+INDEXED_FIELDS = ('severity', 'source')
+
+# Table orderings offered to the UI
+ORDERS = ('Most recent', 'Most severe')
+
+SEVERITY_RANKS = {severity: rank for rank, severity in enumerate(SEVERITIES, 1)}
+
+
+class EventStore:
+    """The most recent events up to a fixed capacity
+
+    Events are kept in a min-heap keyed on timestamp, so adding an event
+    to a full store costs one heap replacement and evicts the oldest.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._heap = []
+        self._sequence = count()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def oldest(self):
+        """Timestamp an event must exceed to enter the store once it is full"""
+        return self._heap[0][0] if len(self._heap) >= self.capacity else NAT
+
+    def earliest(self):
+        """Timestamp of the oldest stored event, or None when the store is empty"""
+        return self._heap[0][0] if self._heap else None
+
+    def add(self, timestamp_ns, row):
+        """Store one event row with its timestamp in int64 nanoseconds"""
+        # The sequence number breaks timestamp ties without comparing rows
+        item = (int(timestamp_ns), next(self._sequence), row)
+        if len(self._heap) < self.capacity:
+            heapq.heappush(self._heap, item)
+        elif item > self._heap[0]:
+            heapq.heapreplace(self._heap, item)
+
+    def expire(self, cutoff_ns):
+        """Drop events older than cutoff_ns"""
+        self._heap = [item for item in self._heap if item[0] >= cutoff_ns]
+        heapq.heapify(self._heap)
+
+    def pack(self):
+        """The stored events as (int64 timestamps, field names, one tuple of values per field)
+
+        Every row of a store has the same fields, so this pickles far
+        smaller than the rows themselves.
+        """
+        rows = [item[2] for item in self._heap]
+        timestamps = np.fromiter((item[0] for item in self._heap), dtype=np.int64, count=len(rows))
+        fields = tuple(rows[0]) if rows else ()
+        return timestamps, fields, tuple(tuple(row.get(field) for row in rows) for field in fields)
+
+    def add_packed(self, packed):
+        """Add the events of another store's pack(), building rows only for those that enter"""
+        timestamps, fields, columns = packed
+        selected = np.flatnonzero(timestamps >= self.oldest())
+        if len(selected) > self.capacity:
+            selected = selected[np.argpartition(timestamps[selected], -self.capacity)[-self.capacity:]]
+        for i in selected.tolist():
+            self.add(timestamps[i], {field: column[i] for field, column in zip(fields, columns)})
+
+    def table(self, start_ns=None):
+        """Immutable EventTable of the stored events since start_ns, newest first"""
+        items = sorted(
+            (item for item in self._heap if start_ns is None or item[0] >= start_ns),
+            reverse=True
+        )
+        return EventTable(
+            np.fromiter((item[0] for item in items), dtype=np.int64, count=len(items)),
+            [item[2] for item in items]
+        )
+
+
+class EventTable:
+    """Read-only, newest-first event rows with indexes for filtering and paging
+
+    Each indexed field maps its distinct values to the positions of the
+    rows holding them, in recency order, so a filtered page is found by
+    intersecting index arrays and slicing, without touching the other rows.
+    Tables are never modified, so one can be shared by every session.
+    """
+
+    def __init__(self, timestamps, rows):
+        self.timestamps = np.asarray(timestamps, dtype=np.int64)
+        self.timestamps.setflags(write=False)
+        self.rows = tuple(rows)
+        self.severity_ranks = np.fromiter(
+            (SEVERITY_RANKS.get(row.get('severity'), 0) for row in self.rows),
+            dtype=np.int64, count=len(self.rows)
+        )
+        self._indexes = {}
+        self._size = None
+        for field in INDEXED_FIELDS:
+            positions = {}
+            for position, row in enumerate(self.rows):
+                value = row.get(field)
+                if value is not None:
+                    positions.setdefault(value, []).append(position)
+            self._indexes[field] = {
+                value: np.array(found, dtype=np.int64) for value, found in positions.items()
+            }
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Table of event rows in any order, ordered by their 'timestamp' values"""
+        timestamps = parse_timestamps([row.get('timestamp', '') for row in rows])
+        order = np.argsort(-timestamps, kind='stable')
+        return cls(timestamps[order], [rows[i] for i in order])
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __sizeof__(self):
+        # The arrays' buffers, plus every row dict and the values it holds; values
+        # shared between rows are counted for each, so this errs high
+        if self._size is None:
+            size = self.timestamps.nbytes + self.severity_ranks.nbytes + sys.getsizeof(self.rows)
+            for index in self._indexes.values():
+                size += sys.getsizeof(index) + sum(positions.nbytes for positions in index.values())
+            for row in self.rows:
+                size += sys.getsizeof(row) + sum(map(sys.getsizeof, row.values()))
+            self._size = size
+        return self._size
+
+    def values(self, field):
+        """Distinct values of an indexed field, for filter choices"""
+        values = self._indexes[field]
+        if field == 'severity':
+            return sorted(values, key=lambda value: SEVERITY_RANKS.get(value, 0), reverse=True)
+        return sorted(values, key=str)
+
+    def select(self, **filters):
+        """Positions of the rows matching every field=value filter, newest first
+
+        Filters whose value is None are ignored.
+        """
+        positions = None
+        for field, value in filters.items():
+            if value is None:
+                continue
+            found = self._indexes[field].get(value, np.zeros(0, dtype=np.int64))
+            positions = found if positions is None else np.intersect1d(positions, found, assume_unique=True)
+        return np.arange(len(self.rows)) if positions is None else positions
+
+    def count(self, **filters):
+        """Number of rows matching the filters"""
+        return len(self.select(**filters))
+
+    def page(self, offset=0, limit=25, order=ORDERS[0], **filters):
+        """Rows offset to offset + limit of the filtered table in the given order"""
+        positions = self.select(**filters)
+        if order == 'Most severe':
+            # Positions are newest first, so a stable sort keeps recency within a severity
+            positions = positions[np.argsort(-self.severity_ranks[positions], kind='stable')]
+        return [self.rows[i] for i in positions[offset:offset + limit]]
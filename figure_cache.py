@@ -0,0 +1,69 @@
+"""Plotly figures memoized on a content hash of the data they are built from"""
+import hashlib
+from collections.abc import Mapping
+
+import numpy as np
+import pandas as pd
+
+from metrics import metrics
+from result_cache import ResultCache
+
+# Figures are evicted by LRU long before this; the TTL only bounds stale entries
+FIGURE_TTL = 3600
+
+
+def content_hash(*values):
+    """Digest of arrays, indexes, mappings, sequences and scalars, by content"""
+    digest = hashlib.blake2b(digest_size=16)
+    for value in values:
+        _update(digest, value)
+    return digest.hexdigest()
+
+
+def _update(digest, value):
+    # Mappings hash alike whatever their type, so frozen and plain data share figures
+    digest.update(b'Mapping' if isinstance(value, Mapping) else type(value).__name__.encode())
+    if isinstance(value, pd.DatetimeIndex):
+        digest.update(str(value.tz).encode())
+        _update(digest, value.asi8)
+    elif isinstance(value, (pd.Index, pd.Series)):
+        _update(digest, value.to_numpy())
+    elif isinstance(value, np.ndarray) and value.dtype != object:
+        digest.update(f"{value.dtype}{value.shape}".encode())
+        digest.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, Mapping):
+        digest.update(str(len(value)).encode())
+        for key, item in value.items():
+            _update(digest, key)
+            _update(digest, item)
+    elif isinstance(value, (list, tuple, np.ndarray)):
+        digest.update(str(len(value)).encode())
+        for item in value:
+            _update(digest, item)
+    else:
+        digest.update(repr(value).encode())
+
+
+class FigureCache:
+    """Bounded LRU of built figures, shared read-only by every session
+
+    A figure is rebuilt only when the content of its inputs changes, so
+    reruns that don't touch the data (dismissing a message, paging an
+    event table) reuse the figures of the previous run.
+    """
+
+    def __init__(self, max_entries=32):
+        self.cache = ResultCache(max_entries=max_entries)
+
+    def figure(self, build, *args):
+        """build(*args), or the figure it returned for inputs with the same content"""
+        key = (build.__qualname__, content_hash(*args))
+        return self.cache.get_or_compute(key, FIGURE_TTL, lambda: self._build(build, args))
+
+    def _build(self, build, args):
+        with metrics.span('build_figure'):
+            return build(*args)
+
+    def stats(self):
+        """Hit, miss and eviction counters of the underlying cache"""
+        return self.cache.stats()
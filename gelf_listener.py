@@ -0,0 +1,300 @@
+"""Receive a mirrored GELF UDP stream and aggregate it in process, without querying Graylog"""
+import json
+import os
+import socket
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+
+import numpy as np
+
+from metrics import metrics
+from traffic_processing import BATCH_SIZE, TrafficStore
+
+# UDP port the mirrored GELF stream arrives on; unset disables live ingestion
+GELF_PORT = os.environ.get('DASHBOARD_GELF_PORT')
+GELF_HOST = os.environ.get('DASHBOARD_GELF_HOST', '0.0.0.0')
+
+# Chunked GELF: magic bytes, then an 8 byte message id, sequence number and count
+CHUNK_MAGIC = b'\x1e\x0f'
+CHUNK_HEADER = 12
+MAX_CHUNKS = 128
+
+# Seconds the GELF spec allows for all chunks of a message to arrive
+CHUNK_TIMEOUT = 5.0
+
+# Incomplete chunked messages held at once; the oldest are dropped beyond this
+MAX_PENDING_MESSAGES = 10000
+
+# Seconds without a datagram after which the stream counts as down; when it
+# resumes, periods are only served from it once it has been received for their whole length
+STREAM_TIMEOUT = 60.0
+
+# Kernel receive buffer requested for the socket; datagrams queue there while a batch is aggregated
+RECEIVE_BUFFER = 8 * 1024 * 1024
+
+# GELF keys that become the Graylog fields source, message and timestamp or are dropped
+RESERVED_KEYS = frozenset(('version', 'host', 'short_message', 'timestamp', '_id'))
+
+# zlib window bits that make zlib read a gzip header, skipping the slower gzip module
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+_json_decoder = json.JSONDecoder()
+
+
+class ChunkAssembler:
+    """Reassembles chunked GELF messages, dropping incomplete ones after a timeout
+
+    Pending messages are kept in arrival order of their first chunk, so
+    expiry only looks at the front of the dict.
+    """
+
+    def __init__(self, timeout=CHUNK_TIMEOUT, max_pending=MAX_PENDING_MESSAGES):
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self.expired = 0
+        self._pending = {}
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, datagram, now):
+        """Store one chunk; returns the whole payload once its last chunk arrived, else None"""
+        if len(datagram) <= CHUNK_HEADER:
+            raise ValueError("GELF chunk without a payload")
+        message_id = datagram[2:10]
+        sequence, count = datagram[10], datagram[11]
+        if not 0 < count <= MAX_CHUNKS or sequence >= count:
+            raise ValueError(f"GELF chunk {sequence} of {count} is out of range")
+
+        entry = self._pending.get(message_id)
+        if entry is None:
+            if len(self._pending) >= self.max_pending:
+                self.expire(now)
+            if len(self._pending) >= self.max_pending:
+                del self._pending[next(iter(self._pending))]
+                self.expired += 1
+            entry = self._pending[message_id] = [now, [None] * count, 0]
+        chunks = entry[1]
+        if count != len(chunks):
+            raise ValueError("GELF chunks of one message disagree on the chunk count")
+        if chunks[sequence] is None:
+            chunks[sequence] = datagram[CHUNK_HEADER:]
+            entry[2] += 1
+        if entry[2] < count:
+            return None
+        del self._pending[message_id]
+        return b''.join(chunks)
+
+    def expire(self, now):
+        """Drop messages whose first chunk arrived more than timeout seconds ago"""
+        while self._pending:
+            message_id, entry = next(iter(self._pending.items()))
+            if now - entry[0] < self.timeout:
+                break
+            del self._pending[message_id]
+            self.expired += 1
+
+
+def decode_payload(payload):
+    """GELF JSON object of a whole payload, zlib or gzip compressed or plain"""
+    if payload[:1] == b'\x78':
+        payload = zlib.decompress(payload)
+    elif payload[:2] == b'\x1f\x8b':
+        payload = zlib.decompress(payload, GZIP_WBITS)
+    # GELF is UTF-8, so json.loads' encoding detection is skipped
+    record = _json_decoder.decode(payload.decode())
+    if not isinstance(record, dict):
+        raise ValueError("GELF payload is not a JSON object")
+    return record
+
+
+def gelf_fields(record):
+    """Graylog message fields of a GELF record, without the timestamp
+
+    Additional fields lose their leading underscore as they do in Graylog.
+    """
+    fields = {
+        key[1:] if key[:1] == '_' else key: value
+        for key, value in record.items() if key not in RESERVED_KEYS
+    }
+    fields['source'] = record.get('host', '')
+    fields['message'] = record.get('short_message', '')
+    return fields
+
+
+def gelf_timestamps(records, received_at):
+    """Graylog timestamp strings for GELF records, built in bulk
+
+    Records without a usable timestamp get the time they were received,
+    as Graylog would give them.
+    """
+    seconds = np.array(
+        [record.get('timestamp', received_at) for record in records], dtype=object
+    )
+    try:
+        seconds = seconds.astype(np.float64)
+    except (TypeError, ValueError):
+        seconds = np.array([_seconds(value, received_at) for value in seconds], dtype=np.float64)
+    seconds[~np.isfinite(seconds)] = received_at
+    milliseconds = np.round(seconds * 1000).astype('datetime64[ms]')
+    return np.char.add(np.datetime_as_string(milliseconds, unit='ms'), 'Z').tolist()
+
+
+def _seconds(value, default):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+class GelfListener:
+    """Aggregates a GELF UDP stream into a TrafficStore as it arrives
+
+    One daemon thread reads datagrams until it has batch_size of them or
+    flush_interval passes, then reassembles chunks, decompresses and
+    decodes them and folds the whole batch into the store, the same way
+    search results are. Datagrams queue in the kernel receive buffer in the
+    meantime. The store covers duration, but only the time the stream
+    has been arriving without a gap holds all of its data: covers() tells
+    whether a period can be served from it alone.
+
+    Received, invalid and dropped messages are counted in stats().
+    """
+
+    def __init__(self, host, port, duration, classifier=None, batch_size=BATCH_SIZE,
+                 flush_interval=0.2, receive_buffer=RECEIVE_BUFFER):
+        self.duration = duration
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        now = datetime.now(timezone.utc)
+        self.started_at = now
+        self.receiving_since = None
+        self.last_received_at = None
+        self.store = TrafficStore(now - duration, now, classifier)
+        self.assembler = ChunkAssembler()
+        self.received = 0
+        self.invalid = 0
+        self.lock = threading.Lock()
+        self._slid_at = 0.0
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, receive_buffer)
+        self.socket.bind((host, int(port)))
+        self.socket.settimeout(flush_interval)
+        self.address = self.socket.getsockname()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @classmethod
+    def from_env(cls, duration):
+        """Listener on DASHBOARD_GELF_HOST:DASHBOARD_GELF_PORT, or None when the port is unset"""
+        return cls(GELF_HOST, GELF_PORT, duration) if GELF_PORT else None
+
+    def start(self):
+        """Start receiving on a daemon thread; returns self"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='gelf-listener', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        """Stop receiving and close the socket"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.socket.close()
+
+    def covers(self, duration, now=None):
+        """Whether the stream is still arriving and has been, without a gap, for at least the last duration
+
+        False once the receiving thread died or no datagram came for
+        STREAM_TIMEOUT seconds, so the period is fetched from Graylog instead.
+        """
+        if self._thread is None or not self._thread.is_alive() or self.receiving_since is None:
+            return False
+        now = (now or datetime.now(timezone.utc)).timestamp()
+        return now - self.last_received_at <= STREAM_TIMEOUT and now - self.receiving_since >= duration.total_seconds()
+
+    def partial(self, start_time, bucket_width, now=None):
+        """PartialAggregate of the received traffic from start_time to now
+
+        Arrays are copied, so the result stays valid while more traffic
+        arrives. The first bucket is only counted from the store's
+        head_start(), as the stream can't be read again for the rest.
+        """
+        with self.lock:
+            self._advance(now or datetime.now(timezone.utc), force=True)
+            return self.store.partial(start_time, bucket_width)
+
+    def stats(self):
+        """Message counters for monitoring"""
+        return {
+            'received': self.received,
+            'invalid': self.invalid,
+            'expired_chunks': self.assembler.expired,
+            'pending_chunks': len(self.assembler),
+        }
+
+    def handle(self, datagrams, received_at=None):
+        """Decode a batch of datagrams and fold their messages into the store"""
+        received_at = received_at or time.time()
+        if self.last_received_at is None or received_at - self.last_received_at > STREAM_TIMEOUT:
+            self.receiving_since = received_at
+        self.last_received_at = received_at
+        records = []
+        for datagram in datagrams:
+            try:
+                if datagram[:2] == CHUNK_MAGIC:
+                    datagram = self.assembler.add(datagram, received_at)
+                    if datagram is None:
+                        continue
+                records.append(decode_payload(datagram))
+            except (ValueError, zlib.error):
+                # Malformed JSON, compression or chunk headers
+                self.invalid += 1
+        self.assembler.expire(received_at)
+        if not records:
+            return 0
+
+        timestamps = gelf_timestamps(records, received_at)
+        messages = []
+        for record, timestamp in zip(records, timestamps):
+            fields = gelf_fields(record)
+            fields['timestamp'] = timestamp
+            messages.append({'message': fields})
+        with self.lock:
+            self._advance(datetime.fromtimestamp(received_at, timezone.utc))
+            self.store.add_messages(messages)
+        self.received += len(messages)
+        return len(messages)
+
+    def _advance(self, now, force=False):
+        # Sliding expires events, so it is done at most once a second unless a reader needs it
+        if force or time.monotonic() - self._slid_at >= 1.0:
+            self.store.slide(now - self.duration, max(now, self.store.end_time))
+            self._slid_at = time.monotonic()
+
+    def _run(self):
+        while not self._stop.is_set():
+            datagrams = []
+            flush_at = time.monotonic() + self.flush_interval
+            while len(datagrams) < self.batch_size and time.monotonic() < flush_at:
+                try:
+                    datagrams.append(self.socket.recv(65535))
+                except socket.timeout:
+                    break
+                except OSError:
+                    if self._stop.is_set():
+                        return
+                    raise
+            if not datagrams:
+                continue
+            try:
+                with metrics.span('gelf_batch'):
+                    self.handle(datagrams)
+            except Exception:
+                # Counted by the span; the next batch starts afresh
+                pass
@@ -0,0 +1,433 @@
+"""Pooled, keep-alive Graylog REST client shared by all dashboard sessions"""
+import os
+import queue
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import timedelta, timezone
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from circuit_breaker import CircuitBreaker
+from metrics import metrics
+
+# Defaults match the Graylog box the dashboard was originally written against
+DEFAULT_GRAYLOG_URL = "http://192.168.10.239:9000"
+DEFAULT_GRAYLOG_USERNAME = "admin"
+DEFAULT_GRAYLOG_PASSWORD = "Salvat!0n"  # Password with zero, not O
+
+# Elasticsearch refuses offset pagination past this many results (index.max_result_window)
+MAX_RESULT_WINDOW = 10000
+
+ConnectionStatus = namedtuple("ConnectionStatus", ["ok", "status_code", "error"])
+
+
+def time_slices(start_time, end_time, count):
+    """Split a search range into count equal, non-overlapping sub-ranges"""
+    step = (end_time - start_time) / count
+    bounds = [start_time + step * i for i in range(count)] + [end_time]
+    # Search ranges include both ends, so stop each slice 1 ms early
+    return [
+        (bounds[i], bounds[i + 1] - (timedelta(milliseconds=1) if i < count - 1 else timedelta(0)))
+        for i in range(count)
+    ]
+
+
+class GraylogError(Exception):
+    """Raised when the Graylog API answers with a non-200 status"""
+
+    def __init__(self, status_code, message=None):
+        super().__init__(message or f"Graylog API returned {status_code}")
+        self.status_code = status_code
+
+    def __reduce__(self):
+        # Raised in a pool worker, it is pickled back with its status code
+        return _rebuild_error, (type(self), self.status_code, str(self))
+
+
+def _rebuild_error(cls, status_code, message):
+    error = Exception.__new__(cls)
+    Exception.__init__(error, message)
+    error.status_code = status_code
+    return error
+
+
+class GraylogTimeout(GraylogError):
+    """Raised when Graylog calls do not finish within the overall deadline"""
+
+    def __init__(self, message="Graylog query deadline exceeded"):
+        super().__init__(None, message)
+
+
+class GraylogUnavailable(requests.exceptions.ConnectionError):
+    """Raised without contacting Graylog while the client's circuit breaker is open"""
+
+    def __init__(self, message="Graylog is unavailable; waiting for it to recover"):
+        super().__init__(message)
+
+
+class _SliceDone:
+    """Marks the end of one time slice in a concurrent message fetch"""
+
+    def __init__(self, error=None):
+        self.error = error
+
+
+def format_timestamp(value):
+    """Format a datetime the way Graylog's absolute search expects it (UTC)"""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+
+class GraylogClient:
+    """HTTP client for the Graylog API backed by a pooled requests.Session
+
+    A single instance is meant to be shared across Streamlit reruns and user
+    sessions so every call reuses an open keep-alive connection instead of
+    paying for a new TCP/HTTP setup.
+
+    Connection errors, timeouts, 5xx answers and missed deadlines count
+    towards a circuit breaker. Once it opens, every call raises
+    GraylogUnavailable at once until a background probe of the inputs
+    endpoint succeeds.
+    """
+
+    def __init__(self, base_url, username, password, pool_size=20,
+                 connect_timeout=5, read_timeout=30, inputs_timeout=10,
+                 check_interval=300, check_retry_interval=15, page_size=1000,
+                 deadline=20, max_slices=4, min_slice=timedelta(minutes=15),
+                 failure_threshold=3, probe_interval=10):
+        self.base_url = base_url.rstrip('/')
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.inputs_timeout = inputs_timeout
+        self.check_interval = check_interval
+        self.check_retry_interval = check_retry_interval
+        self.page_size = page_size
+        self.deadline = deadline
+        self.max_slices = max_slices
+        self.min_slice = min_slice
+
+        self.session = requests.Session()
+        self.session.auth = (username, password)
+        self.session.headers.update({'Accept': 'application/json'})
+
+        # pool_block makes extra callers wait for a free connection rather than
+        # opening throwaway ones when many viewers refresh at once
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        # Independent API calls run here; sized to the connection pool
+        self.executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='graylog')
+        # Slices of message fetches get threads of their own, holding at most half the
+        # connections, so a long fetch never queues the calls above behind it
+        self.slice_executor = ThreadPoolExecutor(max_workers=max(1, pool_size // 2), thread_name_prefix='graylog-slice')
+
+        self._check_lock = threading.Lock()
+        self._status = None
+        self._checked_at = 0.0
+        self._inputs = []
+
+        self.breaker = CircuitBreaker(self._probe, failure_threshold, probe_interval)
+
+    @classmethod
+    def from_env(cls, base_url=None, username=None, password=None):
+        """Build a client from GRAYLOG_* environment variables
+
+        base_url, username and password, when given, override their variables.
+        """
+        return cls(
+            base_url=base_url or os.environ.get('GRAYLOG_URL', DEFAULT_GRAYLOG_URL),
+            username=username or os.environ.get('GRAYLOG_USERNAME', DEFAULT_GRAYLOG_USERNAME),
+            password=password or os.environ.get('GRAYLOG_PASSWORD', DEFAULT_GRAYLOG_PASSWORD),
+            pool_size=int(os.environ.get('GRAYLOG_POOL_SIZE', 20)),
+            connect_timeout=float(os.environ.get('GRAYLOG_CONNECT_TIMEOUT', 5)),
+            read_timeout=float(os.environ.get('GRAYLOG_READ_TIMEOUT', 30)),
+            inputs_timeout=float(os.environ.get('GRAYLOG_INPUTS_TIMEOUT', 10)),
+            check_interval=float(os.environ.get('GRAYLOG_CHECK_INTERVAL', 300)),
+            page_size=int(os.environ.get('GRAYLOG_PAGE_SIZE', 1000)),
+            deadline=float(os.environ.get('GRAYLOG_QUERY_DEADLINE', 20)),
+            max_slices=int(os.environ.get('GRAYLOG_FETCH_SLICES', 4)),
+            failure_threshold=int(os.environ.get('GRAYLOG_FAILURE_THRESHOLD', 3)),
+            probe_interval=float(os.environ.get('GRAYLOG_PROBE_INTERVAL', 10)),
+        )
+
+    def get(self, path, params=None, timeout=None):
+        """GET an API path relative to the Graylog base URL"""
+        if not self.breaker.allow():
+            metrics.increment('graylog_short_circuits_total', path=path)
+            raise GraylogUnavailable()
+        try:
+            with metrics.span('graylog_request'):
+                response = self.session.get(
+                    f"{self.base_url}{path}",
+                    params=params,
+                    timeout=(self.connect_timeout, timeout or self.read_timeout)
+                )
+        except requests.exceptions.RequestException:
+            self.breaker.record_failure()
+            raise
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        metrics.increment('graylog_requests_total', path=path, status=response.status_code)
+        metrics.increment('graylog_response_bytes_total', len(response.content), path=path)
+        return response
+
+    def check_connection(self, force=False):
+        """Test the connection once and reuse the result until it goes stale
+
+        Successful checks are cached for check_interval seconds and failed
+        ones for check_retry_interval seconds. Concurrent callers wait for a
+        single in-flight check instead of issuing their own.
+        """
+        with self._check_lock:
+            if not force and self._status is not None:
+                max_age = self.check_interval if self._status.ok else self.check_retry_interval
+                if time.monotonic() - self._checked_at < max_age:
+                    return self._status
+
+            try:
+                with metrics.span('connection_check'):
+                    response = self.get('/api/system/inputs', timeout=self.inputs_timeout)
+                    if response.status_code == 200:
+                        self._inputs = response.json().get('inputs', [])
+                self._status = ConnectionStatus(response.status_code == 200, response.status_code, None)
+            except (requests.exceptions.RequestException, ValueError) as e:
+                self._status = ConnectionStatus(False, None, str(e))
+
+            self._checked_at = time.monotonic()
+            return self._status
+
+    def get_inputs(self):
+        """Return Graylog inputs captured by the most recent connection check"""
+        status = self.check_connection()
+        if not status.ok:
+            return None
+        return list(self._inputs)
+
+    def get_json(self, path, params=None, timeout=None):
+        """GET an API path and decode the JSON body, raising GraylogError on failure"""
+        response = self.get(path, params=params, timeout=timeout)
+        if response.status_code != 200:
+            raise GraylogError(response.status_code)
+        with metrics.span('json_decode'):
+            return response.json()
+
+    def iter_message_pages(self, query, start_time, end_time, page_size=None, fields=None):
+        """Yield pages of messages from an absolute-range search, oldest first
+
+        Pages are requested with offset/limit. Because Elasticsearch caps how
+        deep offsets may go, the search is restarted from the timestamp of
+        the last message seen whenever the next page would cross
+        MAX_RESULT_WINDOW, skipping messages already yielded at that
+        timestamp. Only one page is held in memory at a time.
+        """
+        page_size = min(page_size or self.page_size, MAX_RESULT_WINDOW)
+        range_from = format_timestamp(start_time)
+        range_to = format_timestamp(end_time)
+        offset = 0
+        skip_ids = set()
+
+        # Newest timestamp seen in the current window and the ids sharing it
+        tail_timestamp = None
+        tail_ids = set()
+
+        while True:
+            params = {
+                'query': query,
+                'from': range_from,
+                'to': range_to,
+                'limit': page_size,
+                'offset': offset,
+                'sort': 'timestamp:asc',
+            }
+            if fields:
+                params['fields'] = ','.join(fields)
+
+            raw_page = self.get_json('/api/search/universal/absolute', params=params).get('messages', [])
+            page = [m for m in raw_page if m['message'].get('_id') not in skip_ids] if skip_ids else raw_page
+            if page:
+                yield page
+            if len(raw_page) < page_size:
+                return
+
+            last_timestamp = raw_page[-1]['message'].get('timestamp')
+            ids = set()
+            for m in reversed(raw_page):
+                if m['message'].get('timestamp') != last_timestamp:
+                    break
+                ids.add(m['message'].get('_id'))
+            if last_timestamp == tail_timestamp and len(ids) == len(raw_page):
+                tail_ids |= ids
+            else:
+                tail_timestamp, tail_ids = last_timestamp, ids
+
+            if offset + 2 * page_size <= MAX_RESULT_WINDOW:
+                offset += page_size
+                continue
+
+            # Restart the search at the newest timestamp seen, skipping the
+            # messages at that timestamp that were already yielded
+            if not tail_timestamp or tail_timestamp == range_from:
+                return
+            range_from = tail_timestamp
+            skip_ids = tail_ids
+            tail_ids = set(skip_ids)
+            offset = 0
+
+    def iter_messages(self, query, start_time, end_time, page_size=None, fields=None):
+        """Yield messages one at a time while fetching them page by page"""
+        for page in self.iter_message_pages(query, start_time, end_time, page_size, fields):
+            yield from page
+
+    def run_concurrently(self, calls, deadline=None):
+        """Run independent API calls in parallel under one overall deadline
+
+        calls maps a name to a zero-argument callable. Returns a dict of
+        results for the calls that finished in time and a dict of errors for
+        the rest; calls still running at the deadline get a GraylogTimeout.
+        """
+        futures = {self.executor.submit(call): name for name, call in calls.items()}
+        done, not_done = wait(futures, timeout=deadline or self.deadline)
+        results = {}
+        errors = {}
+        for future in done:
+            try:
+                results[futures[future]] = future.result()
+            except Exception as e:
+                errors[futures[future]] = e
+        for future in not_done:
+            future.cancel()
+            errors[futures[future]] = GraylogTimeout()
+        if not_done:
+            self.breaker.record_failure()
+        return results, errors
+
+    def _time_slices(self, start_time, end_time):
+        """Split a range into up to max_slices non-overlapping sub-ranges"""
+        count = max(1, min(self.max_slices, int((end_time - start_time) / self.min_slice)))
+        return time_slices(start_time, end_time, count)
+
+    def iter_message_pages_concurrent(self, query, start_time, end_time, page_size=None, deadline=None):
+        """Yield pages of messages while several time slices are fetched in parallel
+
+        Long ranges are split into time slices that are paged concurrently;
+        pages are yielded as they arrive, so they are not in timestamp order
+        across slices. At most two pages per slice are buffered. If deadline
+        is given and passes before every slice finished, GraylogTimeout is
+        raised.
+        """
+        slices = self._time_slices(start_time, end_time)
+        pages = queue.Queue(maxsize=2 * len(slices))
+        stop = threading.Event()
+        finish_by = time.monotonic() + deadline if deadline else None
+
+        def offer(item):
+            while not stop.is_set():
+                try:
+                    pages.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def fetch_slice(slice_start, slice_end):
+            try:
+                for page in self.iter_message_pages(query, slice_start, slice_end, page_size):
+                    if not offer(page):
+                        return
+                offer(_SliceDone())
+            except Exception as e:
+                offer(_SliceDone(e))
+
+        for slice_start, slice_end in slices:
+            self.slice_executor.submit(fetch_slice, slice_start, slice_end)
+
+        remaining = len(slices)
+        try:
+            while remaining:
+                timeout = None if finish_by is None else finish_by - time.monotonic()
+                try:
+                    if timeout is not None and timeout <= 0:
+                        raise queue.Empty
+                    item = pages.get(timeout=timeout)
+                except queue.Empty:
+                    # A missed deadline counts against Graylog like a timed out request
+                    self.breaker.record_failure()
+                    raise GraylogTimeout()
+                if isinstance(item, _SliceDone):
+                    remaining -= 1
+                    if item.error is not None:
+                        raise item.error
+                    continue
+                yield item
+        finally:
+            stop.set()
+
+    def iter_messages_concurrent(self, query, start_time, end_time, page_size=None, deadline=None):
+        """Yield messages from a concurrent, sliced fetch of the range"""
+        for page in self.iter_message_pages_concurrent(query, start_time, end_time, page_size, deadline):
+            yield from page
+
+    def _range_params(self, query, start_time, end_time, **params):
+        params.update({
+            'query': query,
+            'from': format_timestamp(start_time),
+            'to': format_timestamp(end_time),
+        })
+        return params
+
+    def histogram(self, query, start_time, end_time, interval='hour'):
+        """Message counts per interval, as a dict of epoch seconds -> count
+
+        interval is one of Graylog's date histogram intervals (minute, hour,
+        day, week, ...). Only non-empty buckets are returned.
+        """
+        params = self._range_params(query, start_time, end_time, interval=interval)
+        data = self.get_json('/api/search/universal/absolute/histogram', params=params)
+        return {int(epoch): count for epoch, count in data.get('results', {}).items()}
+
+    def terms(self, field, query, start_time, end_time, size=50):
+        """Top values of a field with their message counts
+
+        Returns Graylog's terms response: 'terms' maps values to counts,
+        'other' and 'missing' count messages outside the top values or
+        without the field, and 'total' is the number of matching messages.
+        """
+        params = self._range_params(query, start_time, end_time, field=field, size=size)
+        return self.get_json('/api/search/universal/absolute/terms', params=params)
+
+    def count(self, query, start_time, end_time):
+        """Number of messages matching a query in the time range"""
+        params = self._range_params(query, start_time, end_time, limit=1, fields='timestamp')
+        return self.get_json('/api/search/universal/absolute', params=params).get('total_results', 0)
+
+    def search(self, query, start_time, end_time, limit=10, sort='timestamp:desc'):
+        """A single page of matching messages, newest first by default"""
+        params = self._range_params(query, start_time, end_time, limit=limit, sort=sort)
+        return self.get_json('/api/search/universal/absolute', params=params).get('messages', [])
+
+    def _probe(self):
+        """Recovery check run by the breaker, made directly since the circuit is open"""
+        response = self.session.get(
+            f"{self.base_url}/api/system/inputs",
+            timeout=(self.connect_timeout, self.inputs_timeout)
+        )
+        if response.status_code >= 500:
+            return False
+        with self._check_lock:
+            # Graylog answers again; the next check_connection asks it afresh
+            self._status = None
+        return True
+
+    def close(self):
+        """Close all pooled connections and stop the worker threads"""
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.slice_executor.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
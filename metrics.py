@@ -0,0 +1,235 @@
+"""Process-wide timing spans and counters, exported in Prometheus text format"""
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Prefix of every exported metric name
+METRIC_PREFIX = 'netdash_'
+
+# Upper bounds of the stage duration histogram buckets, in seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Number of recent swallowed errors kept for the debug panel
+RECENT_ERRORS = 20
+
+# Sidecar /metrics port and textfile-collector path; unset disables each export
+METRICS_PORT = os.environ.get('DASHBOARD_METRICS_PORT')
+METRICS_FILE = os.environ.get('DASHBOARD_METRICS_FILE')
+METRICS_FILE_INTERVAL = float(os.environ.get('DASHBOARD_METRICS_FILE_INTERVAL', 15))
+
+
+class _Timing:
+    """Count, sum, max, last value and bucket counts of one stage's durations"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+        self.buckets = [0] * len(DURATION_BUCKETS)
+
+    def observe(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.last = seconds
+        for i, bound in enumerate(DURATION_BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+
+
+class Metrics:
+    """Thread-safe registry of stage timings, counters and gauge sources
+
+    Spans time a named stage; counters are keyed on a name and a sorted
+    tuple of label pairs. Gauge sources are callables returning a dict of
+    current values (cache statistics, for instance) read at export time.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._timings = {}
+        self._counters = {}
+        self._sources = {}
+        self.recent_errors = deque(maxlen=RECENT_ERRORS)
+
+    @contextmanager
+    def span(self, stage):
+        """Time the enclosed block as one run of stage, counting exceptions that escape it"""
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.error(stage, e)
+            raise
+        finally:
+            self.observe(stage, time.perf_counter() - started)
+
+    def observe(self, stage, seconds):
+        """Record one duration of stage"""
+        with self._lock:
+            timing = self._timings.get(stage)
+            if timing is None:
+                timing = self._timings[stage] = _Timing()
+            timing.observe(seconds)
+
+    def increment(self, name, amount=1, **labels):
+        """Add amount to the counter name with the given labels"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def error(self, stage, error):
+        """Count an error raised in stage and keep its message for the debug panel"""
+        self.increment('errors_total', stage=stage, error=type(error).__name__)
+        with self._lock:
+            self.recent_errors.append((time.time(), stage, f"{type(error).__name__}: {error}"))
+
+    def add_source(self, name, read):
+        """Export the values of read() as gauges named name_<key>"""
+        with self._lock:
+            self._sources[name] = read
+
+    def timings(self):
+        """{stage: (count, total seconds, max seconds, last seconds)}"""
+        with self._lock:
+            return {
+                stage: (t.count, t.total, t.max, t.last) for stage, t in sorted(self._timings.items())
+            }
+
+    def counters(self):
+        """{(name, labels): value} of every counter"""
+        with self._lock:
+            return dict(sorted(self._counters.items()))
+
+    def gauges(self):
+        """{name: value} read from every gauge source"""
+        with self._lock:
+            sources = list(self._sources.items())
+        values = {}
+        for name, read in sources:
+            for key, value in read().items():
+                values[f'{name}_{key}'] = value
+        return values
+
+    def prometheus_text(self):
+        """Every metric in the Prometheus text exposition format"""
+        with self._lock:
+            timings = [(stage, t.count, t.total, list(t.buckets)) for stage, t in sorted(self._timings.items())]
+        lines = []
+
+        name = f'{METRIC_PREFIX}stage_duration_seconds'
+        lines.append(f'# HELP {name} Time spent in each dashboard stage')
+        lines.append(f'# TYPE {name} histogram')
+        for stage, count, total, buckets in timings:
+            label = f'stage="{_escape(stage)}"'
+            for bound, observed in zip(DURATION_BUCKETS, buckets):
+                lines.append(f'{name}_bucket{{{label},le="{bound}"}} {observed}')
+            lines.append(f'{name}_bucket{{{label},le="+Inf"}} {count}')
+            lines.append(f'{name}_sum{{{label}}} {total:.6f}')
+            lines.append(f'{name}_count{{{label}}} {count}')
+
+        typed = set()
+        for (counter, labels), value in self.counters().items():
+            name = f'{METRIC_PREFIX}{counter}'
+            if name not in typed:
+                lines.append(f'# TYPE {name} counter')
+                typed.add(name)
+            lines.append(f'{name}{_labels(labels)} {value}')
+
+        for gauge, value in sorted(self.gauges().items()):
+            name = f'{METRIC_PREFIX}{gauge}'
+            lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels) + '}'
+
+
+class MetricsExporter:
+    """Serves a registry on a /metrics sidecar endpoint and/or writes it to a file
+
+    The file is replaced atomically every interval seconds, for node
+    exporter's textfile collector or any other scraper that reads files.
+    """
+
+    def __init__(self, registry, port=None, path=None, interval=METRICS_FILE_INTERVAL, host=''):
+        self.registry = registry
+        self.path = path
+        self.interval = interval
+        self.server = None
+        if port:
+            self.server = ThreadingHTTPServer((host, int(port)), self._handler())
+            self.server.daemon_threads = True
+        self._stop = threading.Event()
+
+    @classmethod
+    def from_env(cls, registry):
+        """Exporter configured from DASHBOARD_METRICS_PORT and DASHBOARD_METRICS_FILE"""
+        return cls(registry, port=METRICS_PORT, path=METRICS_FILE)
+
+    def start(self):
+        """Start the configured exports on daemon threads; returns self"""
+        if self.server is not None:
+            threading.Thread(target=self.server.serve_forever, name='metrics-http', daemon=True).start()
+        if self.path:
+            threading.Thread(target=self._write_loop, name='metrics-file', daemon=True).start()
+        return self
+
+    def stop(self):
+        """Stop exporting; the file is written one last time"""
+        self._stop.set()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        if self.path:
+            self.write()
+
+    def write(self):
+        """Replace the metrics file with the current values"""
+        temporary = f'{self.path}.tmp'
+        with open(temporary, 'w') as f:
+            f.write(self.registry.prometheus_text())
+        os.replace(temporary, self.path)
+
+    def _write_loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.write()
+            except OSError as e:
+                self.registry.error('metrics_file', e)
+
+    def _handler(self):
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.prometheus_text().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+
+# The registry every module records into
+metrics = Metrics()
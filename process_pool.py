@@ -0,0 +1,203 @@
+"""Folding long ranges of Graylog messages on a pool of worker processes"""
+import functools
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from datetime import timedelta
+
+import requests
+
+from graylog_client import GraylogClient, GraylogError, GraylogTimeout, GraylogUnavailable, time_slices
+from metrics import metrics
+from traffic_processing import TrafficAggregator, iter_batches
+
+# Worker processes aggregating long ranges; 0 aggregates everything in the dashboard process
+PROCESS_WORKERS = int(os.environ.get('DASHBOARD_PROCESS_WORKERS', 0))
+
+# Shorter ranges are folded in process, where they cost less than shipping counts back
+MIN_PARALLEL_RANGE = timedelta(hours=1)
+
+# Slices per worker, so a slice holding more traffic than the others doesn't leave workers idle
+SLICES_PER_WORKER = 2
+
+# Clients of a worker process, one per (url, username, password)
+_clients = {}
+
+
+class SearchFetcher:
+    """Picklable fetch_messages(start_time, end_time) of one Graylog query
+
+    In the dashboard process it pages through the site's pooled client.
+    Unpickled in a worker process it uses a client of its own for the same
+    node and account, created once per process.
+    """
+
+    def __init__(self, client, query):
+        self.client = client
+        self.query = query
+
+    @property
+    def breaker(self):
+        return self.client.breaker
+
+    def __call__(self, start_time, end_time, deadline=None):
+        return self.client.iter_messages_concurrent(self.query, start_time, end_time, deadline=deadline)
+
+    def __getstate__(self):
+        username, password = self.client.session.auth
+        return {'connection': (self.client.base_url, username, password), 'query': self.query}
+
+    def __setstate__(self, state):
+        connection = state['connection']
+        if connection not in _clients:
+            _clients[connection] = GraylogClient.from_env(*connection)
+        self.client = _clients[connection]
+        self.query = state['query']
+
+
+def _fold_slice(factory, fetch_messages, start_time, end_time, skip_ids, recent_cutoff, finish_at=None):
+    """Fold one slice into an empty aggregator in a worker; returns its counts, recent ids and counters
+
+    With finish_at, a time.time() value, the fetch is given the time left
+    until then as its deadline, so the worker stops paging on its own.
+    """
+    if finish_at is not None and finish_at <= time.time():
+        raise GraylogTimeout()
+    before = metrics.counters()
+    aggregator = factory()
+    recent_ids = set()
+
+    def unseen(messages):
+        for msg in messages:
+            message = msg.get('message', {})
+            message_id = message.get('_id')
+            if recent_cutoff is not None and message.get('timestamp', '') >= recent_cutoff:
+                recent_ids.add(message_id)
+            if message_id not in skip_ids:
+                yield msg
+
+    if finish_at is None:
+        messages = fetch_messages(start_time, end_time)
+    else:
+        messages = fetch_messages(start_time, end_time, finish_at - time.time())
+    for batch in iter_batches(unseen(messages)):
+        aggregator.add_messages(batch)
+    # Upstream requests and bytes made here are counted again by the dashboard process
+    counters = {
+        key: value - before.get(key, 0)
+        for key, value in metrics.counters().items() if value != before.get(key, 0)
+    }
+    return aggregator.counts(), recent_ids, counters
+
+
+class ProcessPool:
+    """Worker processes that fetch and fold slices of long ranges in parallel
+
+    A range is split into time slices. Each worker pages through its
+    slices with its own client, folds them into an empty aggregator over
+    the same window and sends back only its AggregateCounts: flat count
+    arrays and the newest events, packed. Messages never cross a process
+    boundary, so the dashboard process only adds arrays; how far more
+    workers help depends on the cores available and on Graylog. Workers
+    are spawned rather than forked, as the dashboard process runs threads.
+    """
+
+    def __init__(self, workers, min_range=MIN_PARALLEL_RANGE):
+        self.workers = workers
+        self.min_range = min_range
+        self.executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'))
+        self.ranges = 0
+        self.slices = 0
+
+    @classmethod
+    def from_env(cls):
+        """Pool of DASHBOARD_PROCESS_WORKERS processes, or None when it is 0"""
+        return cls(PROCESS_WORKERS) if PROCESS_WORKERS > 0 else None
+
+    def handles(self, start_time, end_time):
+        """Whether a range is long enough to fold on the pool"""
+        return end_time - start_time >= self.min_range
+
+    def fold(self, aggregator, factory, fetch_messages, start_time, end_time,
+             skip_ids=frozenset(), recent_cutoff=None, deadline=None):
+        """Fold the messages of a range into aggregator on the worker processes
+
+        factory() must build an empty aggregator over the same window as
+        aggregator; both it and fetch_messages are pickled to the workers.
+        Messages whose id is in skip_ids are left out. Returns the ids of
+        the messages at or after recent_cutoff, a Graylog timestamp. If
+        deadline seconds pass first, the slices done by then are merged and
+        GraylogTimeout is raised; the workers stop fetching at the same time.
+
+        When fetch_messages has a breaker, as a SearchFetcher does, an open
+        circuit fails at once and the workers' failed requests count
+        against it like requests made in this process.
+        """
+        breaker = getattr(fetch_messages, 'breaker', None)
+        if breaker is not None and not breaker.allow():
+            raise GraylogUnavailable()
+        slices = time_slices(start_time, end_time, self.workers * SLICES_PER_WORKER)
+        finish_at = time.time() + deadline if deadline else None
+        futures = [
+            self.executor.submit(
+                _fold_slice, factory, fetch_messages, slice_start, slice_end, skip_ids, recent_cutoff, finish_at
+            )
+            for slice_start, slice_end in slices
+        ]
+        recent_ids = set()
+        try:
+            # Counts add up in any order, so each slice is merged as soon as it is done
+            for future in as_completed(futures, timeout=deadline):
+                counts, ids, counters = future.result()
+                aggregator.merge_counts(counts)
+                recent_ids |= ids
+                for (name, labels), amount in counters.items():
+                    metrics.increment(name, amount, **dict(labels))
+        except FuturesTimeoutError:
+            # A missed deadline counts against Graylog like a timed out request
+            if breaker is not None:
+                breaker.record_failure()
+            raise GraylogTimeout()
+        except requests.exceptions.RequestException:
+            if breaker is not None:
+                breaker.record_failure()
+            raise
+        except GraylogError as e:
+            # Timeouts and 5xx answers in a worker count like they do in this process
+            if breaker is not None and (e.status_code is None or e.status_code >= 500):
+                breaker.record_failure()
+            raise
+        finally:
+            for future in futures:
+                future.cancel()
+        self.ranges += 1
+        self.slices += len(slices)
+        return recent_ids
+
+    def stats(self):
+        """Worker count and work done, for monitoring"""
+        return {'workers': self.workers, 'ranges': self.ranges, 'slices': self.slices}
+
+    def close(self):
+        """Stop the worker processes"""
+        self.executor.shutdown(cancel_futures=True)
+
+
+def aggregate_parallel(pool, fetch_messages, start_time, end_time, bucket_width=None, deadline=None):
+    """PartialAggregate of a window, like aggregate_graylog_messages but folded on a ProcessPool
+
+    Slices not folded within deadline seconds are left out and "messages"
+    is listed in missing; the timeout is raised if none were folded.
+    """
+    factory = functools.partial(TrafficAggregator, start_time, end_time, None, bucket_width)
+    aggregator = factory()
+    try:
+        pool.fold(aggregator, factory, fetch_messages, start_time, end_time, deadline=deadline)
+    except GraylogTimeout:
+        partial = aggregator.partial()
+        if not partial.total.any():
+            raise
+        return partial._replace(missing=('messages',))
+    return aggregator.partial()
@@ -0,0 +1,163 @@
+"""Process-wide TTL result cache shared by all dashboard sessions"""
+import sys
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Mapping
+
+import numpy as np
+import pandas as pd
+
+
+def estimate_size(value):
+    """In-memory size of a cached value in bytes, from the buffers it holds
+
+    Arrays count their data buffers, pandas objects include the strings of
+    object columns, containers are walked and anything else reports its own
+    size through __sizeof__. Objects shared between several cached values
+    are counted in each, so the total errs high.
+    """
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (pd.Index, pd.Series)):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, Mapping):
+        return sys.getsizeof(value) + sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return sys.getsizeof(value) + sum(estimate_size(v) for v in value)
+    return sys.getsizeof(value)
+
+
+class _Flight:
+    """A computation in progress that other callers can wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class ResultCache:
+    """Thread-safe TTL cache with LRU eviction and coalesced misses
+
+    Entries expire after their own TTL and the least recently used entries
+    are evicted once either max_entries or max_bytes is exceeded. When
+    several callers miss on the same key at once, only the first computes
+    the value and the rest wait for its result.
+    """
+
+    def __init__(self, max_entries=128, max_bytes=256 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (value, expires_at, size)
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Return the cached value for key, or None if missing or expired"""
+        with self._lock:
+            return self._lookup(key)
+
+    def put(self, key, value, ttl):
+        """Store value under key for ttl seconds"""
+        size = estimate_size(value)
+        with self._lock:
+            self._store(key, value, ttl, size)
+
+    def get_or_compute(self, key, ttl, compute, cache_none=False, should_cache=None):
+        """Return the cached value for key, computing it once on a miss
+
+        Results of None are handed to every waiting caller but not stored
+        unless cache_none is set, so failed fetches are retried on the next
+        call. should_cache(value), if given, can veto storing other results
+        the same way. Exceptions raised by compute propagate to all waiters.
+        """
+        with self._lock:
+            value = self._lookup(key)
+            if value is not None:
+                return value
+
+            flight = self._inflight.get(key)
+            if flight is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                flight = self._inflight[key] = _Flight()
+                leader = True
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = compute()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            value = flight.value
+            storable = flight.error is None and (value is not None or cache_none)
+            if storable and should_cache is not None:
+                storable = should_cache(value)
+            size = estimate_size(value) if storable else None
+            with self._lock:
+                if size is not None:
+                    self._store(key, value, ttl, size)
+                del self._inflight[key]
+            flight.done.set()
+        return flight.value
+
+    def stats(self):
+        """Counters describing cache effectiveness and memory use"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+            }
+
+    def clear(self):
+        """Drop every cached entry"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, expires_at, size = entry
+            if time.monotonic() < expires_at:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            self._remove(key)
+        self.misses += 1
+        return None
+
+    def _store(self, key, value, ttl, size):
+        if key in self._entries:
+            self._remove(key)
+        if size > self.max_bytes:
+            return
+        self._entries[key] = (value, time.monotonic() + ttl, size)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
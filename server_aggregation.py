@@ -0,0 +1,164 @@
+"""Build traffic_data from aggregates computed by Graylog instead of raw messages"""
+import re
+from datetime import timedelta
+
+import numpy as np
+
+from event_store import EventStore
+from timeseries import NS_PER_SECOND, TimeHistogram, bucket_width_for_window, parse_timestamps
+from traffic_processing import (
+    MAX_EVENTS, PartialAggregate, add_batch_events, default_classifier, empty_source_counts,
+    empty_traffic_type_counts, partial_traffic_data,
+)
+
+# Number of distinct source values requested from the terms aggregation
+SOURCE_TERMS_SIZE = 200
+
+# Number of newest raw messages fetched for each event table
+EVENT_SEARCH_LIMIT = 500
+
+
+def query_term(value):
+    """A value as a Graylog query term, quoted unless it is a plain word"""
+    if re.fullmatch(r'\w+', value):
+        return value
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def rule_query(rule):
+    """Graylog query string matching any condition of a classification rule
+
+    Graylog matches whole analyzed terms rather than substrings, so keyword
+    and field conditions only approximate the dashboard's own matching.
+    """
+    terms = [query_term(keyword) for keyword in rule.keywords]
+    terms += [f'{field}:{query_term(value)}' for field, values in rule.fields.items() for value in values]
+    terms += [f'{field}:"{network}"' for field, networks in rule.cidrs.items() for network in networks]
+    terms += [f'{field}:[{low} TO {high}]' for field, ranges in rule.ports.items() for low, high in ranges]
+    return '(' + ' OR '.join(terms) + ')'
+
+
+def rules_query(rules):
+    """Graylog query string matching any of the rules"""
+    return rule_query(rules[0]) if len(rules) == 1 else '(' + ' OR '.join(map(rule_query, rules)) + ')'
+
+
+def traffic_type_queries(classifier=None):
+    """(category, query) for each traffic type rule, honouring rule priority
+
+    A message only counts towards the first matching rule, so each rule's
+    query excludes every rule before it.
+    """
+    rules = (classifier or default_classifier).rules.traffic_types
+    queries = []
+    for index, rule in enumerate(rules):
+        query = rule_query(rule)
+        if index:
+            query += ' AND NOT ' + rules_query(rules[:index])
+        queries.append((rule.category, query))
+    return queries
+
+
+def histogram_interval(bucket_width):
+    """Coarsest Graylog histogram interval that still resolves the bucket width"""
+    return 'minute' if bucket_width < timedelta(hours=1) else 'hour'
+
+
+def histogram_arrays(histogram):
+    """Bucket start times (int64 ns) and counts of a Graylog histogram"""
+    epochs = np.fromiter(histogram.keys(), dtype=np.int64, count=len(histogram))
+    counts = np.fromiter(histogram.values(), dtype=np.int64, count=len(histogram))
+    return epochs * NS_PER_SECOND, counts
+
+
+def event_table(classifier, messages, security):
+    """EventTable of the security or system events among searched messages"""
+    batch = classifier.classify(messages)
+    timestamps = parse_timestamps([message.get('timestamp', '') for message in batch.fields])
+    security_events = EventStore(MAX_EVENTS)
+    system_events = EventStore(MAX_EVENTS)
+    add_batch_events(classifier, batch, timestamps, security_events, system_events)
+    return (security_events if security else system_events).table()
+
+
+def fetch_server_aggregates(client, query, start_time, end_time, bucket_width=None, deadline=None,
+                            classifier=None):
+    """Get traffic_data using Graylog histogram, terms and count queries"""
+    return partial_traffic_data(
+        fetch_server_partial(client, query, start_time, end_time, bucket_width, deadline, classifier)
+    )
+
+
+def fetch_server_partial(client, query, start_time, end_time, bucket_width=None, deadline=None,
+                         classifier=None):
+    """PartialAggregate built from Graylog histogram, terms and count queries
+
+    Only the top security and system events are fetched as raw messages,
+    so the bytes transferred and the work done here stay flat no matter
+    how many messages fall in the window. Source categories are assigned
+    from the source field alone, because message text and other fields
+    are not available for terms buckets.
+
+    All queries are issued concurrently under one deadline and the result
+    is assembled from those that finished in time; the names of the rest
+    are listed in missing. Raises the first error if none finished.
+    """
+    classifier = classifier or default_classifier
+    rules = classifier.rules
+    bucket_width = bucket_width or bucket_width_for_window(end_time - start_time)
+    interval = histogram_interval(bucket_width)
+
+    calls = {
+        'total_histogram': lambda: client.histogram(query, start_time, end_time, interval),
+        'source_terms': lambda: client.terms('source', query, start_time, end_time, size=SOURCE_TERMS_SIZE),
+    }
+    if rules.security:
+        security_query = f"({query}) AND {rules_query(rules.security)}"
+        calls['blocked_histogram'] = lambda: client.histogram(security_query, start_time, end_time, interval)
+        calls['security_events'] = lambda: client.search(security_query, start_time, end_time, limit=EVENT_SEARCH_LIMIT)
+    if rules.system:
+        system_query = f"({query}) AND {rules_query(rules.system)}"
+        calls['system_events'] = lambda: client.search(system_query, start_time, end_time, limit=EVENT_SEARCH_LIMIT)
+    type_queries = traffic_type_queries(classifier)
+    for index, (category, type_query) in enumerate(type_queries):
+        calls[f'type:{index}:{category}'] = (
+            lambda type_query=type_query: client.count(f"({query}) AND {type_query}", start_time, end_time)
+        )
+
+    results, errors = client.run_concurrently(calls, deadline)
+    if not results:
+        raise next(iter(errors.values()))
+
+    # Traffic over time; blocked traffic uses the security keywords
+    time_histogram = TimeHistogram(start_time, end_time, bucket_width)
+    if 'total_histogram' in results:
+        timestamps, counts = histogram_arrays(results['total_histogram'])
+        time_histogram.add(timestamps, weights=counts)
+    if 'blocked_histogram' in results:
+        timestamps, counts = histogram_arrays(results['blocked_histogram'])
+        time_histogram.add_blocked(timestamps, weights=counts)
+
+    # Traffic sources from the terms aggregation over the source field
+    traffic_sources = empty_source_counts(classifier)
+    source_terms = results.get('source_terms', {})
+    terms = source_terms.get('terms', {})
+    for category, count in zip(classifier.classify_sources(list(terms)), terms.values()):
+        traffic_sources[category] += count
+    traffic_sources[rules.default_source] += source_terms.get('other', 0) + source_terms.get('missing', 0)
+    total_messages = source_terms.get('total', int(time_histogram.total.sum()))
+
+    # Traffic types from one count query per rule
+    traffic_types = empty_traffic_type_counts(classifier)
+    for index, (category, _) in enumerate(type_queries):
+        traffic_types[category] += results.get(f'type:{index}:{category}', 0)
+    if not any(name.startswith('type:') for name in errors):
+        traffic_types[rules.default_traffic_type] += max(0, total_messages - sum(traffic_types.values()))
+
+    return PartialAggregate(
+        time_histogram.origin, time_histogram.width, time_histogram.total, time_histogram.blocked,
+        traffic_sources,
+        traffic_types,
+        event_table(classifier, results.get('security_events', []), security=True),
+        event_table(classifier, results.get('system_events', []), security=False),
+        tuple(sorted(errors))
+    )
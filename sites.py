@@ -0,0 +1,82 @@
+"""Graylog sites: the nodes and streams whose traffic the dashboard merges"""
+import hashlib
+import json
+import os
+import re
+from collections import namedtuple
+
+from graylog_client import DEFAULT_GRAYLOG_PASSWORD, DEFAULT_GRAYLOG_URL, DEFAULT_GRAYLOG_USERNAME
+
+# JSON list of sites; unset queries every stream of the GRAYLOG_URL node as one site
+SITES_FILE = os.environ.get('DASHBOARD_SITES_FILE')
+
+# Name of the site built from GRAYLOG_* when no sites file is given
+DEFAULT_SITE_NAME = 'Graylog'
+
+# One Graylog node, or some streams of it, shown as a selectable site
+Site = namedtuple("Site", ["name", "url", "username", "password", "streams"])
+
+
+def default_site():
+    """The single site of GRAYLOG_URL, GRAYLOG_USERNAME and GRAYLOG_PASSWORD"""
+    return Site(
+        DEFAULT_SITE_NAME,
+        os.environ.get('GRAYLOG_URL', DEFAULT_GRAYLOG_URL),
+        os.environ.get('GRAYLOG_USERNAME', DEFAULT_GRAYLOG_USERNAME),
+        os.environ.get('GRAYLOG_PASSWORD', DEFAULT_GRAYLOG_PASSWORD),
+        (),
+    )
+
+
+def load_sites(path):
+    """Read a JSON list of sites
+
+    Each site has a unique "name" and optional "url", "username" and
+    "password" (defaulting to the GRAYLOG_* settings) and "streams", a
+    list of stream ids to restrict it to (default: every stream).
+    """
+    with open(path) as f:
+        config = json.load(f)
+    defaults = default_site()
+    sites = []
+    for entry in config:
+        try:
+            streams = entry.get('streams', [])
+            if isinstance(streams, str):
+                raise TypeError("streams must be a list of stream ids")
+            sites.append(Site(
+                str(entry['name']),
+                entry.get('url', defaults.url),
+                entry.get('username', defaults.username),
+                entry.get('password', defaults.password),
+                tuple(streams),
+            ))
+        except (AttributeError, KeyError, TypeError) as e:
+            raise ValueError(f"Invalid site in {path}: {e!r}") from e
+    names = [site.name for site in sites]
+    if not sites or len(set(names)) != len(names):
+        raise ValueError(f"{path} must list at least one site, with unique names")
+    return sites
+
+
+def sites_from_env():
+    """Sites from DASHBOARD_SITES_FILE, or the single default site when it isn't set"""
+    return load_sites(SITES_FILE) if SITES_FILE else [default_site()]
+
+
+def site_query(query, site):
+    """A Graylog query restricted to the site's streams"""
+    if not site.streams:
+        return query
+    return f"({query}) AND streams:({' OR '.join(site.streams)})"
+
+
+def site_slug(site):
+    """Lowercase identifier for a site, usable in metric names and file names"""
+    return re.sub(r'\W+', '_', site.name).strip('_').lower() or 'site'
+
+
+def site_key(site):
+    """site_slug plus a short hash of the exact name, so no two sites share one"""
+    digest = hashlib.sha1(site.name.encode('utf-8')).hexdigest()[:8]
+    return f"{site_slug(site)}_{digest}"
@@ -0,0 +1,111 @@
+"""Smoke tests running the dashboard script against a fake Graylog with Streamlit's AppTest"""
+import json
+import os
+import re
+import sys
+
+import pytest
+from streamlit.testing.v1 import AppTest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'benchmarks')]
+
+from fake_graylog import FakeGraylog  # noqa: E402
+
+SCRIPT = os.path.join(ROOT, 'enhanced_network_dashboard.py')
+
+PERIODS = ["Last Hour", "Last 6 Hours", "Last 24 Hours", "Last 7 Days"]
+
+# Every synthetic message is in this stream, so the second site sees no traffic
+STREAM = '000000000000000000000001'
+EMPTY_STREAM = '000000000000000000000002'
+
+
+@pytest.fixture(scope='module')
+def graylog(tmp_path_factory):
+    """Fake Graylog serving a week of traffic, configured as two sites of the dashboard
+
+    The environment is set before the script first runs, as its modules and
+    cached resources read it once per process.
+    """
+    fake = FakeGraylog(messages=20000, days=7).start()
+    sites_file = tmp_path_factory.mktemp('config') / 'sites.json'
+    sites_file.write_text(json.dumps([
+        {'name': 'HQ', 'url': fake.url, 'streams': [STREAM]},
+        {'name': 'Branch', 'url': fake.url, 'streams': [EMPTY_STREAM]},
+    ]))
+    env = {'GRAYLOG_URL': fake.url, 'DASHBOARD_SITES_FILE': str(sites_file)}
+    saved = {name: os.environ.get(name) for name in env}
+    os.environ.update(env)
+    yield fake
+    for name, value in saved.items():
+        if value is None:
+            os.environ.pop(name, None)
+        else:
+            os.environ[name] = value
+    fake.stop()
+
+
+@pytest.fixture
+def app(graylog):
+    app = AppTest.from_file(SCRIPT, default_timeout=60)
+    app.run()
+    return app
+
+
+def assert_rendered(app):
+    assert not app.exception, [e.value for e in app.exception]
+    assert not app.error, [e.value for e in app.error]
+    assert len(app.get('plotly_chart')) == 3
+    assert len(app.dataframe) == 2
+
+
+def event_counts(app):
+    """(first, last, total) of the "Showing" caption of each event table"""
+    counts = []
+    for caption in app.caption:
+        match = re.fullmatch(r"Showing (\d+)-(\d+) of (\d+) events", caption.value)
+        if match:
+            counts.append(tuple(map(int, match.groups())))
+    return counts
+
+
+def test_period_change(app):
+    for period in PERIODS:
+        app.selectbox(key='time_period').set_value(period).run()
+        assert_rendered(app)
+    assert event_counts(app)[0][2] > 0
+
+
+def test_site_selection(app):
+    app.selectbox(key='time_period').set_value("Last 7 Days").run()
+    all_sites = event_counts(app)
+
+    app.multiselect(key='sites').set_value(['HQ']).run()
+    assert_rendered(app)
+    assert event_counts(app) == all_sites
+
+    app.multiselect(key='sites').set_value(['Branch']).run()
+    assert not app.exception
+    assert not event_counts(app)
+    assert [info.value for info in app.info] == [
+        "No security events found in the selected time period.",
+        "No system events found in the selected time period.",
+    ]
+
+
+def test_event_table_paging(app):
+    app.selectbox(key='time_period').set_value("Last 7 Days").run()
+    total = event_counts(app)[0][2]
+    assert total > 25
+
+    app.number_input(key='security_page').set_value(2).run()
+    assert_rendered(app)
+    assert event_counts(app)[0] == (26, min(50, total), total)
+
+    source = app.selectbox(key='security_source').options[1]
+    app.selectbox(key='security_source').set_value(source).run()
+    assert_rendered(app)
+    first, last, filtered = event_counts(app)[0]
+    assert 0 < filtered < total
+    assert first <= last <= filtered
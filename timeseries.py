@@ -0,0 +1,296 @@
+"""Period-aware time bucketing for the traffic-over-time series"""
+import warnings
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+# Window length and bucket width for each selectable time period
+PERIODS = {
+    "Last Hour": (timedelta(hours=1), timedelta(minutes=5)),
+    "Last 6 Hours": (timedelta(hours=6), timedelta(minutes=30)),
+    "Last 24 Hours": (timedelta(hours=24), timedelta(hours=1)),
+    "Last 7 Days": (timedelta(days=7), timedelta(hours=12)),
+}
+DEFAULT_PERIOD = "Last 24 Hours"
+
+# Resolutions kept by MultiResolutionSeries: (bucket width, retention)
+ROLLUP_TIERS = [
+    (timedelta(minutes=1), timedelta(hours=6)),
+    (timedelta(minutes=5), timedelta(hours=24)),
+    (timedelta(hours=1), timedelta(days=30)),
+]
+
+NS_PER_SECOND = 1_000_000_000
+NAT = np.iinfo(np.int64).min
+
+
+def period_duration(time_period):
+    """Length of the window shown for a time period"""
+    return PERIODS.get(time_period, PERIODS[DEFAULT_PERIOD])[0]
+
+
+def period_bucket_width(time_period):
+    """Bucket width used to chart a time period"""
+    return PERIODS.get(time_period, PERIODS[DEFAULT_PERIOD])[1]
+
+
+def bucket_width_for_window(duration):
+    """Bucket width of the shortest period that covers a window of this length"""
+    for period_length, width in sorted(PERIODS.values()):
+        if duration <= period_length:
+            return width
+    return max(width for _, width in PERIODS.values())
+
+
+def to_ns(value):
+    """Nanoseconds since the epoch for a datetime (naive values are taken as UTC)"""
+    timestamp = pd.Timestamp(value)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.tz_localize('UTC')
+    return timestamp.value
+
+
+def parse_timestamps(timestamps):
+    """Parse ISO-8601 timestamp strings in bulk into int64 nanoseconds since the epoch
+
+    Graylog's UTC timestamps go through numpy's C datetime parser; anything
+    it rejects (offsets, malformed values) falls back to pandas, where
+    unparseable timestamps come back as NAT.
+    """
+    if not len(timestamps):
+        return np.zeros(0, dtype=np.int64)
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            stripped = [t[:-1] if t[-1:] == 'Z' else t for t in timestamps]
+            return np.array(stripped, dtype='datetime64[ns]').view(np.int64)
+    except (ValueError, TypeError, DeprecationWarning):
+        parsed = pd.to_datetime(pd.Series(timestamps, dtype=object), format='ISO8601', utc=True, errors='coerce')
+        return parsed.values.view(np.int64)
+
+
+class TimeHistogram:
+    """Fixed-width total/blocked counts over a time window
+
+    Buckets are aligned to multiples of the bucket width since the epoch, so
+    the same instant always lands in the same bucket regardless of when the
+    window was opened. Counting is done with np.bincount over whole arrays
+    of timestamps.
+    """
+
+    def __init__(self, start_time, end_time, bucket_width):
+        self.width = int(bucket_width.total_seconds() * NS_PER_SECOND)
+        self.origin = to_ns(start_time) // self.width * self.width
+        end = to_ns(end_time)
+        self.size = max(1, -(-(end - self.origin) // self.width))
+        self.total = np.zeros(self.size, dtype=np.int64)
+        self.blocked = np.zeros(self.size, dtype=np.int64)
+
+    def bucket_index(self, timestamps_ns):
+        """Bucket of each timestamp, plus a mask of those inside the window"""
+        timestamps_ns = np.asarray(timestamps_ns, dtype=np.int64)
+        index = (timestamps_ns - self.origin) // self.width
+        valid = (timestamps_ns != NAT) & (index >= 0) & (index < self.size)
+        return index[valid], valid
+
+    def _bucket(self, timestamps_ns, weights=None):
+        index, valid = self.bucket_index(timestamps_ns)
+        if weights is not None:
+            weights = np.asarray(weights)[valid]
+        return index, weights, valid
+
+    def _count(self, index, weights):
+        return np.bincount(index, weights=weights, minlength=self.size).astype(np.int64)
+
+    def add(self, timestamps_ns, blocked=None, weights=None):
+        """Count timestamps (int64 ns), optionally weighted, with an optional blocked mask"""
+        index, weights, valid = self._bucket(timestamps_ns, weights)
+        self.total += self._count(index, weights)
+        if blocked is not None:
+            blocked = np.asarray(blocked)[valid]
+            self.blocked += self._count(index[blocked], weights[blocked] if weights is not None else None)
+
+    def add_blocked(self, timestamps_ns, weights=None):
+        """Count blocked traffic that is already included in the totals"""
+        index, weights, _ = self._bucket(timestamps_ns, weights)
+        self.blocked += self._count(index, weights)
+
+    def slide(self, start_time, end_time, *arrays):
+        """Move the window to [start_time, end_time], keeping overlapping buckets
+
+        Buckets that slid out of the window are dropped and new ones start
+        at zero. Extra per-bucket arrays (indexed by bucket on their first
+        axis) are realigned the same way and returned in order.
+        """
+        origin = to_ns(start_time) // self.width * self.width
+        size = max(1, -(-(to_ns(end_time) - origin) // self.width))
+        shift = (origin - self.origin) // self.width
+
+        def realign(values):
+            moved = np.zeros((size,) + values.shape[1:], dtype=values.dtype)
+            src = max(shift, 0)
+            dst = max(-shift, 0)
+            count = min(len(values) - src, size - dst)
+            if count > 0:
+                moved[dst:dst + count] = values[src:src + count]
+            return moved
+
+        self.total = realign(self.total)
+        self.blocked = realign(self.blocked)
+        self.origin = origin
+        self.size = size
+        return [realign(values) for values in arrays]
+
+    def times(self):
+        """Start time of each bucket as a UTC DatetimeIndex"""
+        starts = self.origin + np.arange(self.size, dtype=np.int64) * self.width
+        return pd.DatetimeIndex(starts.view('datetime64[ns]'), tz='UTC')
+
+    def series(self):
+        """times, total, allowed and blocked arrays for the traffic chart"""
+        return self.times(), self.total.copy(), self.total - self.blocked, self.blocked.copy()
+
+
+class RollupTier:
+    """Ring buffer of per-bucket counts at one resolution
+
+    capacity buckets of width ns each are kept in a preallocated 2D array,
+    one column per counter. Every bucket is stored twice, at its slot and
+    capacity rows later, so any run of up to capacity consecutive buckets
+    is a contiguous slice and can be read without copying.
+    """
+
+    def __init__(self, bucket_width, retention, columns, now):
+        self.width = int(bucket_width.total_seconds() * NS_PER_SECOND)
+        self.capacity = max(1, int(retention.total_seconds() * NS_PER_SECOND) // self.width)
+        self.columns = columns
+        self.data = np.zeros((2 * self.capacity, columns), dtype=np.int64)
+        self.head = to_ns(now) // self.width
+
+    def oldest(self):
+        """Index of the oldest bucket still held"""
+        return self.head - self.capacity + 1
+
+    def advance(self, now):
+        """Make the bucket containing now the newest one, clearing expired slots"""
+        head = to_ns(now) // self.width
+        if head <= self.head:
+            return
+        if head - self.head >= self.capacity:
+            self.data[:] = 0
+        else:
+            slots = np.arange(self.head + 1, head + 1) % self.capacity
+            self.data[slots] = 0
+            self.data[slots + self.capacity] = 0
+        self.head = head
+
+    def add(self, timestamps_ns, columns, weights=None):
+        """Count each timestamp (int64 ns) into its column, optionally weighted"""
+        buckets = timestamps_ns // self.width
+        valid = (timestamps_ns != NAT) & (buckets >= self.oldest()) & (buckets <= self.head)
+        flat = (buckets[valid] % self.capacity) * self.columns + columns[valid]
+        if weights is not None:
+            weights = weights[valid]
+        counts = np.bincount(flat, weights=weights, minlength=self.capacity * self.columns)
+        counts = counts.astype(np.int64).reshape(self.capacity, self.columns)
+        self.data[:self.capacity] += counts
+        self.data[self.capacity:] += counts
+
+    def buckets(self, first, count):
+        """Read-only view of count consecutive buckets starting at bucket index first"""
+        start = first % self.capacity
+        view = self.data[start:start + count]
+        view.flags.writeable = False
+        return view
+
+
+class MultiResolutionSeries:
+    """Constant-memory rolling counts at several resolutions
+
+    Every batch is binned into each tier, so coarser tiers are always the
+    exact rollup of the finer ones without a separate downsampling pass.
+    A window is read from the coarsest tier that still divides the
+    requested bucket width and covers the window: when the widths match
+    this is a view into the ring buffer, otherwise whole tier buckets are
+    summed into the requested width.
+    """
+
+    def __init__(self, columns, now, tiers=ROLLUP_TIERS):
+        self.columns = columns
+        self.tiers = [RollupTier(width, retention, columns, now) for width, retention in tiers]
+
+    def advance(self, now):
+        """Move every tier forward to now"""
+        for tier in self.tiers:
+            tier.advance(now)
+
+    def add(self, timestamps_ns, columns, weights=None):
+        """Count timestamps (int64 ns) into the given column of every tier"""
+        timestamps_ns = np.asarray(timestamps_ns, dtype=np.int64)
+        columns = np.asarray(columns, dtype=np.int64)
+        if weights is not None:
+            weights = np.asarray(weights)
+        for tier in self.tiers:
+            tier.add(timestamps_ns, columns, weights)
+
+    def layout(self):
+        """(width, head, capacity) of every tier; only series with the same layout merge"""
+        return tuple((tier.width, tier.head, tier.capacity) for tier in self.tiers)
+
+    def counts(self):
+        """The buckets of every tier stacked into one array, in ring order"""
+        return np.concatenate([tier.data[:tier.capacity] for tier in self.tiers])
+
+    def add_counts(self, counts):
+        """Add the counts() of a series with the same layout"""
+        first = 0
+        for tier in self.tiers:
+            values = counts[first:first + tier.capacity]
+            tier.data[:tier.capacity] += values
+            tier.data[tier.capacity:] += values
+            first += tier.capacity
+
+    def window(self, start_time, end_time, bucket_width):
+        """Bucket start times (UTC DatetimeIndex) and per-bucket counts for a window
+
+        Buckets are aligned to multiples of bucket_width since the epoch,
+        like TimeHistogram. Raises ValueError if no tier can serve the window.
+        """
+        width = int(bucket_width.total_seconds() * NS_PER_SECOND)
+        origin = to_ns(start_time) // width * width
+        size = max(1, -(-(to_ns(end_time) - origin) // width))
+        for tier in reversed(self.tiers):
+            if width % tier.width or origin // tier.width < tier.oldest():
+                continue
+            factor = width // tier.width
+            first = origin // tier.width
+            held = min(size * factor, tier.head + 1 - first)
+            values = tier.buckets(first, max(held, 0))
+            if factor > 1 or len(values) < size:
+                padded = np.zeros((size * factor, self.columns), dtype=np.int64)
+                padded[:len(values)] = values
+                values = padded.reshape(size, factor, self.columns).sum(axis=1)
+            starts = origin + np.arange(size, dtype=np.int64) * width
+            return pd.DatetimeIndex(starts.view('datetime64[ns]'), tz='UTC'), values
+        raise ValueError(f"No rollup tier covers {start_time} - {end_time} at {bucket_width}")
+
+    def head(self, start_time, bucket_width):
+        """Counts of the first window() bucket clipped to start_time, as far as the tiers resolve it
+
+        window() counts whole buckets, so its first bucket can begin up to
+        a bucket width before start_time. Here it is summed from the finest
+        tier holding start_time, from that tier's first bucket boundary at
+        or after start_time. Returns the boundary (int64 ns) and the counts;
+        traffic between start_time and the boundary is left out.
+        """
+        width = int(bucket_width.total_seconds() * NS_PER_SECOND)
+        start = to_ns(start_time)
+        end = start // width * width + width
+        for tier in self.tiers:
+            first = -(-start // tier.width)
+            if width % tier.width or first < tier.oldest():
+                continue
+            held = min(end // tier.width, tier.head + 1) - first
+            return first * tier.width, tier.buckets(first, max(held, 0)).sum(axis=0)
+        raise ValueError(f"No rollup tier covers {start_time} at {bucket_width}")
@@ -0,0 +1,642 @@
+"""Aggregation of Graylog messages into the dashboard's traffic_data structure"""
+import functools
+import threading
+from collections import namedtuple
+from datetime import timedelta
+from itertools import islice
+
+import numpy as np
+import pandas as pd
+
+from classifier import DEFAULT_SECURITY_SEVERITY, DEFAULT_SYSTEM_SEVERITY, MessageClassifier
+from event_store import EventStore, EventTable
+from graylog_client import GraylogTimeout, format_timestamp
+from metrics import metrics
+from timeseries import (
+    NAT, NS_PER_SECOND, ROLLUP_TIERS, MultiResolutionSeries, TimeHistogram, bucket_width_for_window,
+    parse_timestamps, to_ns,
+)
+
+# Number of messages handed to the aggregator at a time
+BATCH_SIZE = 1000
+
+# Number of most recent events of each kind kept for the event tables
+MAX_EVENTS = 5000
+
+# Rules are loaded and compiled once per process and reused for every batch
+default_classifier = MessageClassifier.from_env()
+
+# Counts for one site and time range that merge with other sites' into one traffic_data.
+#   origin, width: start of the first bucket and bucket width in int64 ns; buckets
+#                  are aligned to multiples of width since the epoch
+#   total, blocked: per-bucket message counts
+#   sources, traffic_types: {category: message count}
+#   security_events, system_events: EventTables of the newest events
+#   missing: names of the queries that did not finish
+PartialAggregate = namedtuple(
+    "PartialAggregate",
+    ["origin", "width", "total", "blocked", "sources", "traffic_types", "security_events", "system_events", "missing"]
+)
+
+# Counts of one aggregator in a few flat buffers, to add into another aggregator
+# over the same window, e.g. one built in a worker process
+#   layout: bucket alignment of the rows of columns; only equal layouts merge
+#   columns: per-bucket counts, one row per bucket and one column per counter
+#   undated_sources, undated_types: category counts of messages without a timestamp
+#   security_events, system_events: EventStore.pack() of the newest events
+AggregateCounts = namedtuple(
+    "AggregateCounts",
+    ["layout", "columns", "undated_sources", "undated_types", "security_events", "system_events"]
+)
+
+
+def iter_batches(messages, batch_size=BATCH_SIZE):
+    """Split any iterable of messages into lists of at most batch_size"""
+    iterator = iter(messages)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def make_security_event(message, category='Security Alert', severity=DEFAULT_SECURITY_SEVERITY):
+    """Row for the security events table"""
+    return {
+        'timestamp': message.get('timestamp', ''),
+        'type': category,
+        'severity': severity,
+        'source': message.get('source', ''),
+        'status': 'Blocked'
+    }
+
+
+def make_system_event(message, description=None, category='System', severity=DEFAULT_SYSTEM_SEVERITY):
+    """Row for the system events table"""
+    if description is None:
+        description = str(message)
+    return {
+        'timestamp': message.get('timestamp', ''),
+        'type': 'System Event',
+        'category': category,
+        'severity': severity,
+        'source': message.get('source', ''),
+        'description': description[:100] + '...' if len(description) > 100 else description,
+        'status': 'Completed'
+    }
+
+
+def add_batch_events(classifier, batch, timestamps, security_events, system_events):
+    """Add the security and system events of a classified batch to their EventStores"""
+    for i in _entering_indices(timestamps, batch.is_security, security_events):
+        category, severity = classifier.security_labels[batch.security_rules[i]]
+        security_events.add(timestamps[i], make_security_event(batch.fields[i], category, severity))
+    for i in _entering_indices(timestamps, batch.is_system, system_events):
+        category, severity = classifier.system_labels[batch.system_rules[i]]
+        system_events.add(timestamps[i], make_system_event(batch.fields[i], category=category, severity=severity))
+
+
+def empty_source_counts(classifier=None):
+    """Zeroed counts for every traffic source category"""
+    return dict.fromkeys((classifier or default_classifier).source_categories, 0)
+
+
+def empty_traffic_type_counts(classifier=None):
+    """Zeroed counts for every traffic type category"""
+    return dict.fromkeys((classifier or default_classifier).traffic_type_categories, 0)
+
+
+def source_percentages(traffic_sources):
+    """Convert traffic source counts to percentages of the total"""
+    total_messages = sum(traffic_sources.values())
+    if total_messages > 0:
+        return {k: (v / total_messages) * 100 for k, v in traffic_sources.items()}
+    return dict(traffic_sources)
+
+
+def _sum_counts(counts):
+    """Sum {category: count} dicts, keeping the categories in first-seen order"""
+    merged = {}
+    for values in counts:
+        for category, count in values.items():
+            merged[category] = merged.get(category, 0) + count
+    return merged
+
+
+def merge_event_tables(tables, limit=MAX_EVENTS):
+    """EventTable of the newest limit events across several tables"""
+    if len(tables) == 1:
+        return tables[0]
+    timestamps = np.concatenate([table.timestamps for table in tables])
+    rows = [row for table in tables for row in table.rows]
+    # Stable, so ties keep the order of the tables
+    order = np.argsort(-timestamps, kind='stable')[:limit]
+    return EventTable(timestamps[order], [rows[i] for i in order])
+
+
+def _merge_undated_and_events(aggregator, counts):
+    """Add the undated category counts and the events of AggregateCounts to an aggregator"""
+    aggregator.undated_sources += counts.undated_sources
+    aggregator.undated_types += counts.undated_types
+    aggregator.security_events.add_packed(counts.security_events)
+    aggregator.system_events.add_packed(counts.system_events)
+
+
+def merge_partials(partials):
+    """Merge the PartialAggregates of several sites into one
+
+    Counts add up bucket by bucket over the union of the time ranges and
+    the events keep the newest MAX_EVENTS overall, so merging is
+    associative and sites can be combined in any grouping. All partials
+    must use the same bucket width.
+    """
+    partials = list(partials)
+    if len(partials) == 1:
+        return partials[0]
+    width = partials[0].width
+    if any(partial.width != width for partial in partials):
+        raise ValueError("Partial aggregates with different bucket widths can't be merged")
+    origin = min(partial.origin for partial in partials)
+    size = max((partial.origin - origin) // width + len(partial.total) for partial in partials)
+    total = np.zeros(size, dtype=np.int64)
+    blocked = np.zeros(size, dtype=np.int64)
+    for partial in partials:
+        first = (partial.origin - origin) // width
+        total[first:first + len(partial.total)] += partial.total
+        blocked[first:first + len(partial.blocked)] += partial.blocked
+    return PartialAggregate(
+        origin, width, total, blocked,
+        _sum_counts(partial.sources for partial in partials),
+        _sum_counts(partial.traffic_types for partial in partials),
+        merge_event_tables([partial.security_events for partial in partials]),
+        merge_event_tables([partial.system_events for partial in partials]),
+        tuple(sorted(set().union(*(partial.missing for partial in partials))))
+    )
+
+
+def partial_traffic_data(partial):
+    """Build the traffic_data dict consumed by the charts and tables"""
+    starts = partial.origin + np.arange(len(partial.total), dtype=np.int64) * partial.width
+    return {
+        'traffic_sources': source_percentages(partial.sources),
+        'traffic_types': dict(partial.traffic_types),
+        'times': pd.DatetimeIndex(starts.view('datetime64[ns]'), tz='UTC'),
+        'total_traffic': partial.total,
+        'allowed_traffic': partial.total - partial.blocked,
+        'blocked_traffic': partial.blocked,
+        'security_events': partial.security_events,  # Most recent first
+        'system_events': partial.system_events,
+        'missing': list(partial.missing)
+    }
+
+
+class TrafficAggregator:
+    """Running aggregate of traffic counts over a stream of message batches
+
+    Memory use is bounded by the number of time buckets and MAX_EVENTS, not
+    by the number of messages seen, so arbitrarily long windows can be
+    folded in page by page. The bucket width defaults to the one used for
+    the shortest period covering the window.
+
+    Source and traffic type counts are kept per time bucket so the window
+    can slide forward, dropping whole buckets as they fall out of it and
+    taking the messages that left the first kept bucket back out.
+    """
+
+    def __init__(self, start_time, end_time, classifier=None, bucket_width=None):
+        self.start_time = start_time
+        self.end_time = end_time
+        self.classifier = classifier or default_classifier
+        self.histogram = TimeHistogram(
+            start_time, end_time,
+            bucket_width or bucket_width_for_window(end_time - start_time)
+        )
+        source_count = len(self.classifier.source_categories)
+        type_count = len(self.classifier.traffic_type_categories)
+        self.source_buckets = np.zeros((self.histogram.size, source_count), dtype=np.int64)
+        self.type_buckets = np.zeros((self.histogram.size, type_count), dtype=np.int64)
+
+        # Messages without a usable timestamp still count towards the categories
+        self.undated_sources = np.zeros(source_count, dtype=np.int64)
+        self.undated_types = np.zeros(type_count, dtype=np.int64)
+
+        self.security_events = EventStore(MAX_EVENTS)
+        self.system_events = EventStore(MAX_EVENTS)
+
+    def add_messages(self, messages):
+        """Fold a batch of Graylog search results into the aggregate"""
+        batch, timestamps = self._count(messages, 1)
+        # Batches may arrive out of order; the stores keep the newest events by timestamp
+        add_batch_events(self.classifier, batch, timestamps, self.security_events, self.system_events)
+
+    def remove_messages(self, messages):
+        """Take a batch of messages folded in earlier back out of the counts
+
+        Meant for messages that left the window, whose events have expired.
+        """
+        self._count(messages, -1)
+
+    def _count(self, messages, sign):
+        batch = self.classifier.classify(messages)
+
+        # Bucket timestamps in bulk; blocked traffic is what the security keywords flag
+        timestamps = parse_timestamps([message.get('timestamp', '') for message in batch.fields])
+        self.histogram.add(timestamps, batch.is_security, None if sign > 0 else np.full(len(timestamps), sign))
+
+        # Categorize by source and traffic type within each time bucket
+        index, valid = self.histogram.bucket_index(timestamps)
+        self.source_buckets += sign * _bucket_counts(index, batch.sources[valid], self.source_buckets.shape)
+        self.type_buckets += sign * _bucket_counts(index, batch.traffic_types[valid], self.type_buckets.shape)
+        undated = timestamps == NAT
+        if undated.any():
+            self.undated_sources += sign * np.bincount(batch.sources[undated], minlength=len(self.undated_sources))
+            self.undated_types += sign * np.bincount(batch.traffic_types[undated], minlength=len(self.undated_types))
+        return batch, timestamps
+
+    def slide(self, start_time, end_time):
+        """Move the window forward, expiring buckets and events that fell out of it
+
+        Buckets expire whole, so the first kept bucket can still count
+        messages from before start_time. Returns the (from, to) range of
+        those messages, to be fetched again and passed to remove_messages,
+        or None if there are none.
+        """
+        previous_start = self.start_time
+        self.start_time = start_time
+        self.end_time = end_time
+        self.source_buckets, self.type_buckets = self.histogram.slide(
+            start_time, end_time, self.source_buckets, self.type_buckets
+        )
+        cutoff = to_ns(start_time)
+        self.security_events.expire(cutoff)
+        self.system_events.expire(cutoff)
+        if max(to_ns(previous_start), self.histogram.origin) >= cutoff:
+            return None
+        kept_from = max(previous_start, pd.Timestamp(self.histogram.origin, tz='UTC').to_pydatetime())
+        # Ranges end 1 ms early, like time slices, so the message at start_time stays
+        return kept_from, start_time - timedelta(milliseconds=1)
+
+    def partial(self):
+        """PartialAggregate of the window, for merging with other sites"""
+        source_counts = self.source_buckets.sum(axis=0) + self.undated_sources
+        type_counts = self.type_buckets.sum(axis=0) + self.undated_types
+        return PartialAggregate(
+            self.histogram.origin, self.histogram.width,
+            self.histogram.total.copy(), self.histogram.blocked.copy(),
+            dict(zip(self.classifier.source_categories, source_counts.tolist())),
+            dict(zip(self.classifier.traffic_type_categories, type_counts.tolist())),
+            self.security_events.table(),
+            self.system_events.table(),
+            ()
+        )
+
+    def result(self):
+        """Build the traffic_data dict consumed by the charts and tables"""
+        return partial_traffic_data(self.partial())
+
+    def counts(self):
+        """AggregateCounts of everything folded in so far"""
+        histogram = self.histogram
+        return AggregateCounts(
+            (histogram.origin, histogram.width, histogram.size),
+            np.column_stack([histogram.total, histogram.blocked, self.source_buckets, self.type_buckets]),
+            self.undated_sources, self.undated_types,
+            self.security_events.pack(), self.system_events.pack()
+        )
+
+    def merge_counts(self, counts):
+        """Add the AggregateCounts of an aggregator over the same window"""
+        histogram = self.histogram
+        if counts.layout != (histogram.origin, histogram.width, histogram.size):
+            raise ValueError("Counts of a different window can't be merged")
+        types_from = 2 + self.source_buckets.shape[1]
+        histogram.total += counts.columns[:, 0]
+        histogram.blocked += counts.columns[:, 1]
+        self.source_buckets += counts.columns[:, 2:types_from]
+        self.type_buckets += counts.columns[:, types_from:]
+        _merge_undated_and_events(self, counts)
+
+
+class TrafficStore:
+    """Traffic counts for every time period in one set of multi-resolution rings
+
+    A drop-in replacement for TrafficAggregator whose memory use is fixed
+    by the rollup tiers. Total, blocked, source and traffic type counts
+    are all columns of one MultiResolutionSeries, so any period ending at
+    the newest data is read from the rings without recounting messages.
+    """
+
+    def __init__(self, start_time, end_time, classifier=None, tiers=ROLLUP_TIERS):
+        self.start_time = start_time
+        self.end_time = end_time
+        self.classifier = classifier or default_classifier
+        self.source_count = len(self.classifier.source_categories)
+        self.type_count = len(self.classifier.traffic_type_categories)
+        # Columns: total, blocked, one per source category, one per traffic type
+        self.series = MultiResolutionSeries(2 + self.source_count + self.type_count, end_time, tiers)
+        self.undated_sources = np.zeros(self.source_count, dtype=np.int64)
+        self.undated_types = np.zeros(self.type_count, dtype=np.int64)
+        self.security_events = EventStore(MAX_EVENTS)
+        self.system_events = EventStore(MAX_EVENTS)
+
+    def add_messages(self, messages):
+        """Fold a batch of Graylog search results into every tier"""
+        batch = self.classifier.classify(messages)
+        timestamps = parse_timestamps([message.get('timestamp', '') for message in batch.fields])
+        is_security = np.asarray(batch.is_security, dtype=bool)
+
+        self.series.add(
+            np.concatenate([timestamps, timestamps[is_security], timestamps, timestamps]),
+            np.concatenate([
+                np.zeros(len(timestamps), dtype=np.int64),
+                np.ones(int(is_security.sum()), dtype=np.int64),
+                2 + batch.sources,
+                2 + self.source_count + batch.traffic_types,
+            ])
+        )
+        undated = timestamps == NAT
+        if undated.any():
+            self.undated_sources += np.bincount(batch.sources[undated], minlength=self.source_count)
+            self.undated_types += np.bincount(batch.traffic_types[undated], minlength=self.type_count)
+
+        add_batch_events(self.classifier, batch, timestamps, self.security_events, self.system_events)
+
+    def slide(self, start_time, end_time):
+        """Advance the rings to end_time and drop events older than start_time"""
+        self.start_time = start_time
+        self.end_time = end_time
+        self.series.advance(end_time)
+        cutoff = to_ns(start_time)
+        self.security_events.expire(cutoff)
+        self.system_events.expire(cutoff)
+
+    def partial(self, start_time=None, bucket_width=None):
+        """PartialAggregate of the window from start_time to the newest data
+
+        Its first bucket only counts traffic from head_start() on; the
+        arrays are copies, which later updates leave alone.
+        """
+        start_time = start_time or self.start_time
+        bucket_width = bucket_width or bucket_width_for_window(self.end_time - start_time)
+        _, values = self.series.window(start_time, self.end_time, bucket_width)
+        values = values.copy()
+        values[0] = self.series.head(start_time, bucket_width)[1]
+        totals = values.sum(axis=0)
+
+        source_counts = totals[2:2 + self.source_count] + self.undated_sources
+        type_counts = totals[2 + self.source_count:] + self.undated_types
+        cutoff = to_ns(start_time)
+        width = int(bucket_width.total_seconds() * NS_PER_SECOND)
+        return PartialAggregate(
+            cutoff // width * width, width,
+            values[:, 0], values[:, 1],
+            dict(zip(self.classifier.source_categories, source_counts.tolist())),
+            dict(zip(self.classifier.traffic_type_categories, type_counts.tolist())),
+            self.security_events.table(cutoff),
+            self.system_events.table(cutoff),
+            ()
+        )
+
+    def result(self, start_time=None, bucket_width=None):
+        """Build traffic_data for the window from start_time to the newest data"""
+        return partial_traffic_data(self.partial(start_time, bucket_width))
+
+    def head_start(self, start_time=None, bucket_width=None):
+        """Time from which partial() counts the first bucket of a window from start_time
+
+        It is the first bucket boundary of the finest tier holding
+        start_time, so at most one bucket of that tier after it.
+        """
+        start_time = start_time or self.start_time
+        bucket_width = bucket_width or bucket_width_for_window(self.end_time - start_time)
+        boundary, _ = self.series.head(start_time, bucket_width)
+        return pd.Timestamp(boundary, tz='UTC').to_pydatetime()
+
+    def counts(self):
+        """AggregateCounts of everything folded in so far"""
+        return AggregateCounts(
+            self.series.layout(), self.series.counts(),
+            self.undated_sources, self.undated_types,
+            self.security_events.pack(), self.system_events.pack()
+        )
+
+    def merge_counts(self, counts):
+        """Add the AggregateCounts of a store ending at the same time"""
+        if counts.layout != self.series.layout():
+            raise ValueError("Counts of a different window can't be merged")
+        self.series.add_counts(counts.columns)
+        _merge_undated_and_events(self, counts)
+
+
+def _entering_indices(timestamps, mask, store):
+    """Indices of the messages selected by mask that are new enough to enter the store"""
+    if len(store) >= store.capacity:
+        mask = mask & (timestamps >= store.oldest())
+    selected = np.flatnonzero(mask)
+    if len(selected) > store.capacity:
+        newest = np.argpartition(timestamps[selected], -store.capacity)[-store.capacity:]
+        selected = selected[newest]
+    return selected
+
+
+def _bucket_counts(index, categories, shape):
+    """Counts per (time bucket, category) as a 2D array of the given shape"""
+    flat = np.bincount(index * shape[1] + categories, minlength=shape[0] * shape[1])
+    return flat.reshape(shape)
+
+
+class IncrementalWindow:
+    """Aggregate state for one time period, refreshed from a high-water mark
+
+    The first refresh fetches the whole window. Later refreshes slide the
+    window forward, expire buckets that left it and fetch only messages
+    newer than the watermark, so their cost follows new traffic rather
+    than window length. The fetch starts overlap before the watermark to
+    pick up late-indexed messages; messages already counted there are
+    skipped by id. A full refresh of everything fetched so far is forced
+    every resync_interval and after any failed fetch.
+
+    Periods are counted from their exact start, like a fresh aggregation.
+    Buckets expire whole, so the messages that left the window but sit in
+    its first kept bucket are fetched again and taken out. A store counts
+    the first bucket from its rings as finely as their tiers allow, and
+    the rest of it from Graylog.
+
+    Given a pool (a process_pool.ProcessPool), ranges long enough for it,
+    such as the first fetch of a long window, are folded on its worker
+    processes instead of in this one.
+
+    With store=True the window keeps a TrafficStore instead, which serves
+    every period up to duration. Only the part of the window that has
+    been requested is fetched; asking for a longer period later backfills
+    the older range once. A store window can also be given persist, an
+    aggregate_cache.AggregateCache: the first refresh resumes from its
+    state, fetching only what arrived since, and every refresh saves the
+    changes to it.
+    """
+
+    def __init__(self, duration, bucket_width=None, overlap=timedelta(seconds=30),
+                 resync_interval=timedelta(hours=6), classifier=None, store=False, persist=None):
+        self.duration = duration
+        self.bucket_width = bucket_width
+        self.overlap = overlap
+        self.resync_interval = resync_interval
+        self.classifier = classifier
+        self.store = store
+        self.persist = persist if store else None
+        self.save_failed = False
+        self.aggregator = None
+        self.watermark = None
+        self.synced_at = None
+        self.covered_from = None
+        self.recent_ids = set()
+        self.lock = threading.Lock()
+
+    def refresh(self, fetch_messages, now, start_time=None, bucket_width=None, pool=None, deadline=None):
+        """Bring the window up to now and return its PartialAggregate
+
+        fetch_messages(start_time, end_time) must return an iterable of
+        Graylog search results in that range, oldest first, and be
+        picklable when a pool is given. start_time and bucket_width select
+        the period to return from a store window.
+
+        With a deadline, the fetch of new traffic is called as
+        fetch_messages(start_time, end_time, deadline) and its
+        GraylogTimeout is raised like any failed fetch, so the next refresh
+        starts over. Part of a fold can't be kept, so the first fill,
+        backfills and ranges folded on the pool take as long as they need.
+        """
+        with self.lock:
+            if self.persist is not None and self.watermark is None:
+                self._restore()
+            window_start = now - self.duration
+            start_time = max(start_time or window_start, window_start)
+            ranges = []
+            new_range = None
+            full = self.aggregator is None or now - self.synced_at >= self.resync_interval
+            factory = self._factory(window_start, now)
+            expired = None
+            if full:
+                self.aggregator = factory()
+                self.synced_at = now
+                self.recent_ids = set()
+                # A resync fetches everything fetched before again, including backfills
+                self.covered_from = start_time if self.covered_from is None else (
+                    max(min(self.covered_from, start_time), window_start)
+                )
+                ranges.append((self.covered_from, now))
+            else:
+                expired = self.aggregator.slide(window_start, now)
+                if start_time < self.covered_from:
+                    # Ranges end 1 ms early, like time slices, so nothing is fetched twice
+                    ranges.append((start_time, self.covered_from - timedelta(milliseconds=1)))
+                new_range = (max(self.covered_from, self.watermark - self.overlap), now)
+                ranges.append(new_range)
+                self.covered_from = max(min(self.covered_from, start_time), window_start)
+
+            recent_cutoff = format_timestamp(now - self.overlap)
+            recent_ids = set()
+
+            def unseen(messages):
+                for msg in messages:
+                    message = msg.get('message', {})
+                    message_id = message.get('_id')
+                    if message.get('timestamp', '') >= recent_cutoff:
+                        recent_ids.add(message_id)
+                    if message_id not in self.recent_ids:
+                        yield msg
+
+            try:
+                if expired is not None:
+                    for batch in iter_batches(fetch_messages(*expired)):
+                        self.aggregator.remove_messages(batch)
+                for fetch_from, fetch_to in ranges:
+                    if pool is not None and pool.handles(fetch_from, fetch_to):
+                        recent_ids |= pool.fold(
+                            self.aggregator, factory, fetch_messages, fetch_from, fetch_to,
+                            self.recent_ids, recent_cutoff
+                        )
+                        continue
+                    if deadline is not None and (fetch_from, fetch_to) == new_range:
+                        messages = fetch_messages(fetch_from, fetch_to, deadline)
+                    else:
+                        messages = fetch_messages(fetch_from, fetch_to)
+                    for batch in iter_batches(unseen(messages)):
+                        self.aggregator.add_messages(batch)
+            except BaseException:
+                # Partially folded pages would be counted twice; start over next time
+                self.aggregator = None
+                raise
+
+            self.watermark = now
+            self.recent_ids = recent_ids
+            if self.persist is not None:
+                self._save(None if full else min(fetch_from for fetch_from, _ in ranges))
+            if self.store:
+                return self._store_partial(fetch_messages, now, start_time, bucket_width or self.bucket_width)
+            return self.aggregator.partial()
+
+    def _store_partial(self, fetch_messages, now, start_time, bucket_width):
+        # Arrays of the partial are copies, taken under the lock before another refresh moves the rings
+        bucket_width = bucket_width or bucket_width_for_window(now - start_time)
+        partial = self.aggregator.partial(start_time, bucket_width)
+        head_start = self.aggregator.head_start(start_time, bucket_width)
+        if head_start <= start_time:
+            return partial
+        # The rings count the first bucket from head_start on; the rest of it is counted from Graylog
+        head = TrafficAggregator(start_time, head_start, self.classifier, bucket_width)
+        for batch in iter_batches(fetch_messages(start_time, head_start - timedelta(milliseconds=1))):
+            head.add_messages(batch)
+        no_events = EventTable([], [])
+        return merge_partials([partial, head.partial()._replace(security_events=no_events, system_events=no_events)])
+
+    def _factory(self, window_start, now):
+        # Picklable, so worker processes can build empty aggregators over the same window
+        if self.store:
+            return functools.partial(TrafficStore, window_start, now, self.classifier)
+        return functools.partial(TrafficAggregator, window_start, now, self.classifier, self.bucket_width)
+
+    def _restore(self):
+        try:
+            with metrics.span('restore_aggregates'):
+                self.persist.restore(self)
+        except Exception:
+            # Unreadable state is counted by the span; start from Graylog instead
+            pass
+
+    def _save(self, changed_from):
+        try:
+            with metrics.span('save_aggregates'):
+                # After a failed save the file is behind by an unknown range, so rewrite it all
+                self.persist.save(self, None if self.save_failed else changed_from)
+            self.save_failed = False
+        except Exception:
+            # The in-memory window stays valid; errors are counted by the span
+            self.save_failed = True
+
+
+def aggregate_graylog_messages(messages, start_time, end_time, bucket_width=None):
+    """PartialAggregate of Graylog messages over a window
+
+    messages may be any iterable, including a lazy generator over search
+    result pages; it is consumed in batches and never fully materialized.
+    If it raises GraylogTimeout, as a fetch under a deadline does, the
+    messages folded so far are returned with "messages" in missing; the
+    timeout is raised if there were none.
+    """
+    aggregator = TrafficAggregator(start_time, end_time, bucket_width=bucket_width)
+    folded = 0
+    try:
+        for batch in iter_batches(messages):
+            aggregator.add_messages(batch)
+            folded += len(batch)
+    except GraylogTimeout:
+        if not folded:
+            raise
+        return aggregator.partial()._replace(missing=('messages',))
+    return aggregator.partial()
+
+
+def process_graylog_messages(messages, start_time, end_time, bucket_width=None):
+    """Process Graylog messages to extract traffic data"""
+    return partial_traffic_data(aggregate_graylog_messages(messages, start_time, end_time, bucket_width))